@@ -5,21 +5,23 @@ Module that defines the blueprint for all loci classes.
 """
 
 import abc
-import itertools
+import collections
 import logging
 import random
 from sys import maxsize
 import networkx
 from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
+from sklearn.utils import check_array
 import numpy
 from ..transcripts.clique_methods import find_cliques, find_communities, define_graph
 from ..transcripts.transcript import Transcript
 from ..configuration.configurator import to_json, check_json
 from ..exceptions import NotInLocusError
-from ..utilities import overlap, merge_ranges
+from ..utilities import overlap
 import operator
 from ..utilities.intervaltree import Interval, IntervalTree
 from ..utilities.log_utils import create_null_logger
+from ..utilities import shared_store, predicates, profiling
 from sys import version_info
 if version_info.minor < 5:
     from sortedcontainers import SortedDict
@@ -40,6 +42,8 @@ class Abstractlocus(metaclass=abc.ABCMeta):
 
     __name__ = "Abstractlocus"
     available_metrics = Transcript.get_available_metrics()
+    # State of the metrics calculation pass in progress, if any (see get_metrics)
+    _metrics_pass = None
 
     # ##### Special methods #########
 
@@ -141,12 +145,15 @@ class Abstractlocus(metaclass=abc.ABCMeta):
         state = self.__dict__.copy()
         self.logger = logger
 
-        if hasattr(self, "json_conf"):
-            # This removes unpicklable compiled attributes, eg in "requirements" or "as_requirements"
-            for key in self.json_conf:
-                if (isinstance(self.json_conf[key], dict) and
-                        self.json_conf[key].get("compiled", None) is not None):
-                    del state["json_conf"][key]["compiled"]
+        if self.json_conf is not None:
+            handle = shared_store.handle_of(self.json_conf)
+            if handle is not None:
+                # A published configuration is shared by reference through its handle
+                state["_Abstractlocus__json_conf"] = None
+                state["json_conf_handle"] = handle
+            else:
+                # This removes unpicklable compiled attributes, eg in "requirements" or "as_requirements"
+                state["_Abstractlocus__json_conf"] = shared_store.strip_compiled(self.json_conf)
 
         if hasattr(self, "session"):
             if self.session is not None:
@@ -162,9 +169,12 @@ class Abstractlocus(metaclass=abc.ABCMeta):
 
     def __setstate__(self, state):
         """Method to recreate the object after serialisation."""
+        handle = state.pop("json_conf_handle", None)
         self.__dict__.update(state)
 
-        if hasattr(self, "json_conf"):
+        if handle is not None:
+            self.json_conf = shared_store.attach(handle)[0]
+        elif self.json_conf is not None:
             if "requirements" in self.json_conf and "expression" in self.json_conf["requirements"]:
                 self.json_conf["requirements"]["compiled"] = compile(
                     self.json_conf["requirements"]["expression"],
@@ -226,29 +236,7 @@ class Abstractlocus(metaclass=abc.ABCMeta):
         operation from the JSON dict file.
         """
 
-        if conf["operator"] == "eq":
-            comparison = (float(param) == float(conf["value"]))
-        elif conf["operator"] == "ne":
-            comparison = (float(param) != float(conf["value"]))
-        elif conf["operator"] == "gt":
-            comparison = (float(param) > float(conf["value"]))
-        elif conf["operator"] == "lt":
-            comparison = (float(param) < float(conf["value"]))
-        elif conf["operator"] == "ge":
-            comparison = (float(param) >= float(conf["value"]))
-        elif conf["operator"] == "le":
-            comparison = (float(param) <= float(conf["value"]))
-        elif conf["operator"] == "in":
-            comparison = (param in conf["value"])
-        elif conf["operator"] == "not in":
-            comparison = (param not in conf["value"])
-        elif conf["operator"] == "within":
-            comparison = (param in range(*sorted([conf["value"][0], conf["value"][1] + 1])))
-        elif conf["operator"] == "not within":
-            comparison = (param not in range(*sorted([conf["value"][0], conf["value"][1] + 1])))
-        else:
-            raise ValueError("Unknown operator: {0}".format(conf["operator"]))
-        return comparison
+        return predicates.evaluate(param, conf)
 
     # #### Class methods ########
 
@@ -283,7 +271,7 @@ class Abstractlocus(metaclass=abc.ABCMeta):
                     return True
         return False
 
-    def define_graph(self, objects: dict, inters=None, **kwargs) -> networkx.Graph:
+    def define_graph(self, objects: dict, inters=None, overlapping_only=False, **kwargs) -> networkx.Graph:
         """
         :param objects: a dictionary of objects to be grouped into a graph
         :type objects: dict
@@ -291,6 +279,10 @@ class Abstractlocus(metaclass=abc.ABCMeta):
         :param inters: the intersecting function to be used to define the graph
         :type inters: callable
 
+        :param overlapping_only: boolean flag. If True, only pairs of overlapping objects will be
+        tested with the intersecting function.
+        :type overlapping_only: bool
+
         :param kwargs: optional arguments to be passed to the inters function
         :type kwargs: dict
 
@@ -308,7 +300,11 @@ class Abstractlocus(metaclass=abc.ABCMeta):
         if inters is None:
             inters = self.is_intersecting
 
-        return define_graph(objects, inters, **kwargs)
+        with profiling.stage("graph"):
+            graph = define_graph(objects, inters, overlapping_only=overlapping_only, **kwargs)
+        profiling.count("graph_nodes", len(graph))
+        profiling.count("graph_edges", graph.number_of_edges())
+        return graph
 
     def find_communities(self, graph: networkx.Graph) -> list:
         """
@@ -324,7 +320,10 @@ class Abstractlocus(metaclass=abc.ABCMeta):
             - communities
         """
 
-        return find_communities(graph, self.logger)
+        with profiling.stage("communities"):
+            communities = find_communities(graph, self.logger)
+        profiling.count("communities", len(communities))
+        return communities
 
     def find_cliques(self, graph: networkx.Graph) -> (networkx.Graph, list):
         """
@@ -338,7 +337,10 @@ class Abstractlocus(metaclass=abc.ABCMeta):
         whether two vertices are connected or not in the graph.
         """
 
-        return find_cliques(graph, self.logger)
+        with profiling.stage("cliques"):
+            cliques = find_cliques(graph, self.logger)
+        profiling.count("cliques", len(cliques))
+        return cliques
 
     @classmethod
     def choose_best(cls, transcripts: dict) -> str:
@@ -731,19 +733,68 @@ class Abstractlocus(metaclass=abc.ABCMeta):
 
     def get_metrics(self):
 
-        """Quick wrapper to calculate the metrics for all the transcripts."""
+        """Quick wrapper to calculate the metrics for all the transcripts.
+        The metrics are calculated as a single pass over the locus: the values which depend
+        on the whole locus are calculated once, rather than once per transcript."""
 
         if self.metrics_calculated is True:
             return
 
-        for tid in sorted(self.transcripts):
-            self.calculate_metrics(tid)
+        self._metrics_pass = dict()
+        try:
+            for tid in sorted(self.transcripts):
+                self.calculate_metrics(tid)
+            self._calculate_cds_locus_fractions()
+        finally:
+            self._metrics_pass = None
 
         self.logger.debug("Finished to calculate the metrics for %s", self.id)
 
         self.metrics_calculated = True
         return
 
+    @staticmethod
+    def _covered_bases(segments):
+        """Static method to calculate the number of bases covered by a group of segments, ie
+        the total length of the segments after merging them (see merge_ranges).
+        :param segments: the segments, as (start, end) pairs.
+        :type segments: list
+
+        :rtype: int
+        """
+
+        if len(segments) == 0:
+            return 0
+        coordinates = numpy.array(segments, dtype=numpy.int64)[:, :2]
+        coordinates = coordinates[numpy.lexsort((coordinates[:, 1], coordinates[:, 0]))]
+        # End of the merged segment each position belongs to, so far
+        ends = numpy.maximum.accumulate(coordinates[:, 1])
+        first = numpy.ones(len(coordinates), dtype=bool)
+        first[1:] = coordinates[1:, 0] > ends[:-1]
+        first = numpy.flatnonzero(first)
+        last = numpy.append(first[1:] - 1, len(coordinates) - 1)
+        return int((ends[last] - coordinates[first, 0] + 1).sum())
+
+    def _calculate_cds_locus_fractions(self):
+        """Private method to calculate, for all the transcripts, the fraction of the coding bases
+        of the locus which are covered by their combined and selected CDS."""
+
+        transcripts = list(self.transcripts.values())
+        cds_bases = self._covered_bases(
+            [segment for transcript in transcripts for segment in transcript.combined_cds])
+
+        if cds_bases == 0:
+            for transcript in transcripts:
+                transcript.combined_cds_locus_fraction = 0
+                transcript.selected_cds_locus_fraction = 0
+            return
+
+        selected_bases = self._covered_bases(
+            [segment for transcript in transcripts for segment in transcript.selected_cds])
+        for transcript in transcripts:
+            transcript.combined_cds_locus_fraction = transcript.combined_cds_length / cds_bases
+            transcript.selected_cds_locus_fraction = transcript.selected_cds_length / selected_bases
+
     def calculate_metrics(self, tid: str):
         """
         :param tid: the name of the transcript to be analysed
@@ -752,6 +803,8 @@ class Abstractlocus(metaclass=abc.ABCMeta):
         This function will calculate the metrics for a transcript which are relative in nature
         i.e. that depend on the other transcripts in the sublocus. Examples include the fraction
         of introns or exons in the sublocus, or the number/fraction of retained introns.
+        When called from get_metrics, the CDS locus fractions are calculated only once at the end
+        of the pass.
         """
 
         self.logger.debug("Calculating metrics for %s", tid)
@@ -780,26 +833,18 @@ class Abstractlocus(metaclass=abc.ABCMeta):
 
         self.transcripts[tid].exon_fraction = fraction
 
-        cds_bases = sum(_[1] - _[0] + 1 for _ in merge_ranges(
-            itertools.chain(*[
-                self.transcripts[_].combined_cds for _ in self.transcripts
-                if self.transcripts[_].combined_cds])))
-
-        selected_bases = sum(_[1] - _[0] + 1 for _ in merge_ranges(
-            itertools.chain(*[
-                self.transcripts[_].selected_cds for _ in self.transcripts
-                if self.transcripts[_].selected_cds])))
-
-        for tid in self.transcripts:
-            if cds_bases == 0:
-                self.transcripts[tid].combined_cds_locus_fraction = 0
-                self.transcripts[tid].selected_cds_locus_fraction = 0
-            else:
-                selected_length = self.transcripts[tid].selected_cds_length
-                combined_length = self.transcripts[tid].combined_cds_length
+        if self._metrics_pass is None:
+            self._calculate_cds_locus_fractions()
 
-                self.transcripts[tid].combined_cds_locus_fraction = combined_length / cds_bases
-                self.transcripts[tid].selected_cds_locus_fraction = selected_length / selected_bases
+        # NOTE: the intron and retained intron metrics are calculated for the transcript
+        # which was added last to the locus, as it has always been the case. Within a pass
+        # of get_metrics they are therefore calculated again only if the locus has changed.
+        tid = collections.deque(self.transcripts, maxlen=1)[0]
+        if self._metrics_pass is not None:
+            key = (tid, len(self.transcripts))
+            if self._metrics_pass.get("last", None) == key:
+                return
+            self._metrics_pass["last"] = key
 
         if len(self.introns) > 0:
             _ = len(set.intersection(self.transcripts[tid].introns, self.introns))
@@ -832,7 +877,7 @@ class Abstractlocus(metaclass=abc.ABCMeta):
                              for e in self.transcripts[tid].retained_introns)
         fraction = retained_bases / self.transcripts[tid].cdna_length
         self.transcripts[tid].retained_fraction = fraction
-        self.logger.debug("Calculated metrics for {0}".format(tid))
+        self.logger.debug("Calculated metrics for %s", tid)
 
     def _check_not_passing(self, previous_not_passing=set()):
         """
@@ -844,30 +889,21 @@ class Abstractlocus(metaclass=abc.ABCMeta):
 
         self.get_metrics()
         # self.logger.debug("Expression: %s", self.json_conf["requirements"]["expression"])
+        predicate = predicates.get_predicate(self.json_conf["requirements"])
 
-        if ("compiled" not in self.json_conf["requirements"] or
-                self.json_conf["requirements"]["compiled"] is None):
-            self.json_conf["requirements"]["compiled"] = compile(
-                self.json_conf["requirements"]["expression"], "<json>",
-                "eval")
-
+        tids = [tid for tid in self.transcripts if tid not in previous_not_passing]
+        clauses = predicate.clauses([self.transcripts[tid] for tid in tids])
+        passing = predicate.combine(clauses)
         not_passing = set()
-        for tid in iter(tid for tid in self.transcripts if
-                        tid not in previous_not_passing):
-            evaluated = dict()
-            for key in self.json_conf["requirements"]["parameters"]:
-                value = getattr(self.transcripts[tid],
-                                self.json_conf["requirements"]["parameters"][key]["name"])
-
-                evaluated[key] = self.evaluate(
-                    value,
-                    self.json_conf["requirements"]["parameters"][key])
-            # pylint: disable=eval-used
-            if eval(self.json_conf["requirements"]["compiled"]) is False:
-
+        for num, tid in enumerate(tids):
+            if not passing[num]:
                 not_passing.add(tid)
-        self.logger.debug("The following transcripts in %s did not pass the minimum check for requirements: %s",
-                          self.id, ", ".join(list(not_passing)))
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug("%s fails the requirements of %s: %s",
+                                      tid, self.id, ", ".join(predicate.failed_clauses(clauses, num)))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("The following transcripts in %s did not pass the minimum check for requirements: %s",
+                              self.id, ", ".join(list(not_passing)))
 
         return not_passing
 
@@ -885,29 +921,11 @@ class Abstractlocus(metaclass=abc.ABCMeta):
                               self.id)
             return
 
-        self.get_metrics()
-        # not_passing = set()
-        if not hasattr(self, "logger"):
-            self.logger = None
-            self.logger.setLevel("DEBUG")
-        self.logger.debug("Calculating scores for {0}".format(self.id))
-        if "requirements" in self.json_conf:
-            self._check_requirements()
-
-        if len(self.transcripts) == 0:
-            self.logger.warning("No transcripts pass the muster for {0}".format(self.id))
-            self.scores_calculated = True
+        if self._initialise_scores() is False:
             return
-        self.scores = dict()
-
-        for tid in self.transcripts:
-            self.scores[tid] = dict()
-            # Add the score for the transcript source
-            self.scores[tid]["source_score"] = self.transcripts[tid].source_score
 
         if self.regressor is None:
-            for param in self.json_conf["scoring"]:
-                self._calculate_score(param)
+            self._calculate_score_matrix()
 
             for tid in self.scores:
                 self.transcripts[tid].scores = self.scores[tid].copy()
@@ -936,39 +954,145 @@ class Abstractlocus(metaclass=abc.ABCMeta):
                 self.scores[tid]["score"] = self.transcripts[tid].score
 
         else:
-            valid_metrics = self.regressor.metrics
-            metric_rows = SortedDict()
-            for tid, transcript in sorted(self.transcripts.items(), key=operator.itemgetter(0)):
-                for param in valid_metrics:
-                    self.scores[tid][param] = "NA"
-                row = []
-                for attr in valid_metrics:
-                    val = getattr(transcript, attr)
-                    if isinstance(val, bool):
-                        if val:
-                            val = 1
-                        else:
-                            val = 0
-                    row.append(val)
-                # Necessary for sklearn ..
-                row = numpy.array(row)
-                # row = row.reshape(1, -1)
-                metric_rows[tid] = row
-            # scores = SortedDict.fromkeys(metric_rows.keys())
-            if isinstance(self.regressor, RandomForestClassifier):
-                # We have to pick the second probability (correct)
-                for tid in metric_rows:
-                    score = self.regressor.predict_proba(metric_rows[tid])[0][1]
-                    self.scores[tid]["score"] = score
-                    self.transcripts[tid].score = score
-            else:
-                pred_scores = self.regressor.predict(list(metric_rows.values()))
-                for pos, score in enumerate(pred_scores):
-                    self.scores[list(metric_rows.keys())[pos]]["score"] = score
-                    self.transcripts[list(metric_rows.keys())[pos]].score = score
+            tids, rows = self._model_rows()
+            self._set_model_scores(tids, self.predict_scores(self.regressor, rows))
 
         self.scores_calculated = True
 
+    def _initialise_scores(self):
+        """
+        Private method to prepare the calculation of the scores: it calculates the metrics,
+        removes the transcripts which do not pass the requirements and initialises the
+        score dictionaries with the source scores.
+        :return: False if no transcript is left to be scored, True otherwise
+        :rtype: bool
+        """
+
+        self.get_metrics()
+        # not_passing = set()
+        if not hasattr(self, "logger"):
+            self.logger = None
+            self.logger.setLevel("DEBUG")
+        self.logger.debug("Calculating scores for %s", self.id)
+        if "requirements" in self.json_conf:
+            self._check_requirements()
+
+        if len(self.transcripts) == 0:
+            self.logger.warning("No transcripts pass the muster for {0}".format(self.id))
+            self.scores_calculated = True
+            return False
+        self.scores = dict()
+
+        for tid in self.transcripts:
+            self.scores[tid] = dict()
+            # Add the score for the transcript source
+            self.scores[tid]["source_score"] = self.transcripts[tid].source_score
+        return True
+
+    def _model_rows(self):
+        """
+        Private method to create the rows of metrics used by the scoring model,
+        one per transcript, sorted by transcript ID.
+        :return: the list of transcript IDs and the list of the corresponding rows.
+        :rtype: (list, list)
+        """
+
+        valid_metrics = self.regressor.metrics
+        tids, rows = [], []
+        for tid, transcript in sorted(self.transcripts.items(), key=operator.itemgetter(0)):
+            for param in valid_metrics:
+                self.scores[tid][param] = "NA"
+            row = []
+            for attr in valid_metrics:
+                val = getattr(transcript, attr)
+                if isinstance(val, bool):
+                    if val:
+                        val = 1
+                    else:
+                        val = 0
+                row.append(val)
+            tids.append(tid)
+            rows.append(row)
+        return tids, rows
+
+    def _set_model_scores(self, tids, predicted):
+        """
+        Private method to assign to the transcripts the scores predicted by the model.
+        :param tids: the transcript IDs, in the order of the predictions.
+        :param predicted: the predicted scores.
+        """
+
+        for tid, score in zip(tids, predicted):
+            self.scores[tid]["score"] = score
+            self.transcripts[tid].score = score
+
+    @staticmethod
+    def predict_scores(regressor, rows):
+        """
+        Static method to calculate the scores of a group of metric rows with a random forest.
+        The predictions of the trees are accumulated one after the other, in the order of the forest,
+        so that the scores do not depend on the number of rows predicted together nor on the
+        number of threads of the model. For classifiers, the score is the probability
+        of the second class.
+
+        :param regressor: the scoring model.
+        :type regressor: (RandomForestRegressor|RandomForestClassifier)
+
+        :param rows: the metric rows, one per transcript.
+        :type rows: list
+
+        :rtype: numpy.ndarray
+        """
+
+        if len(rows) == 0:
+            return numpy.zeros(0)
+        rows = check_array(rows, dtype=numpy.float32)
+        classifier = isinstance(regressor, RandomForestClassifier)
+        total = None
+        for tree in regressor.estimators_:
+            if classifier:
+                prediction = tree.predict_proba(rows, check_input=False)
+            else:
+                prediction = tree.predict(rows, check_input=False)
+            if total is None:
+                total = numpy.zeros(prediction.shape, dtype=numpy.float64)
+            total += prediction
+        total /= len(regressor.estimators_)
+        if classifier:
+            # We have to pick the second probability (correct)
+            return total[:, 1]
+        return total
+
+    @staticmethod
+    def calculate_batch_scores(loci):
+        """
+        Static method to calculate the scores of a group of loci which use a scoring model,
+        predicting the scores of all of their transcripts together rather than locus by locus.
+        The scores are identical to those calculated by each locus independently.
+        Loci whose scores have been calculated already, or which do not use a model, are left untouched.
+
+        :param loci: the loci to score.
+        :type loci: list
+        """
+
+        batches = collections.OrderedDict()
+        for locus in loci:
+            if locus.scores_calculated is True or locus.regressor is None:
+                continue
+            if locus._initialise_scores() is False:
+                continue
+            tids, rows = locus._model_rows()
+            batches.setdefault(id(locus.regressor), (locus.regressor, []))[1].append((locus, tids, rows))
+
+        for regressor, batch in batches.values():
+            predicted = Abstractlocus.predict_scores(
+                regressor, [row for _, __, rows in batch for row in rows])
+            start = 0
+            for locus, tids, _ in batch:
+                locus._set_model_scores(tids, predicted[start:start + len(tids)])
+                locus.scores_calculated = True
+                start += len(tids)
+
     def _check_requirements(self):
         """
         This private method will identify and delete all transcripts which do not pass
@@ -1011,18 +1135,66 @@ class Abstractlocus(metaclass=abc.ABCMeta):
                 # Recalculate the metrics
                 self.get_metrics()
 
-    def _calculate_score(self, param):
+    @staticmethod
+    def _evaluate_column(values, column, conf):
+        """
+        Static method to evaluate a filter over the values of a metric for all the transcripts,
+        with the same semantics of the evaluate method.
+        :param values: the original values of the metric.
+        :type values: list
+
+        :param column: the values of the metric, as a float array.
+        :type column: numpy.ndarray
+
+        :param conf: the filter to evaluate.
+        :type conf: dict
+
+        :rtype: numpy.ndarray
+        """
+
+        return predicates.evaluate_column(values, conf, column=column)
+
+    def _calculate_score_matrix(self):
+        """
+        Private method that calculates the score of each transcript for each of the parameters
+        in the scoring section of the configuration.
+        The metrics of all the transcripts are collected into a single (transcripts x parameters)
+        matrix; rescaling, filters and multipliers are then applied to each column as a whole.
+        """
+
+        params = list(self.json_conf["scoring"].keys())
+        tids = list(self.transcripts.keys())
+        if len(params) == 0 or len(tids) == 0:
+            return
+        values = [[getattr(self.transcripts[tid], param) for param in params] for tid in tids]
+        try:
+            matrix = numpy.array(values, dtype=numpy.float64)
+        except (TypeError, ValueError):
+            for num, param in enumerate(params):
+                try:
+                    numpy.array([row[num] for row in values], dtype=numpy.float64)
+                except (TypeError, ValueError):
+                    raise ValueError("Non-numeric values for the scoring metric \"{}\" in {}".format(
+                        param, self.id))
+            raise
+
+        for num, param in enumerate(params):
+            self._calculate_score(param, [row[num] for row in values], matrix[:, num], tids)
+
+    def _calculate_score(self, param, values, column, tids):
         """
         Private method that calculates a score for each transcript,
         given a target parameter.
-        :param param:
+        :param param: the name of the parameter.
+        :param values: the original values of the metric for each transcript.
+        :param column: the values of the metric, as a float array.
+        :param tids: the names of the transcripts, in the same order as the values.
         :return:
         """
 
-        rescaling = self.json_conf["scoring"][param]["rescaling"]
-        use_raw = self.json_conf["scoring"][param]["use_raw"]
-
-        metrics = dict((tid, getattr(self.transcripts[tid], param)) for tid in self.transcripts)
+        conf = self.json_conf["scoring"][param]
+        rescaling = conf["rescaling"]
+        use_raw = conf["use_raw"]
 
         if use_raw is True and not param.startswith("external") and getattr(Transcript, param).usable_raw is False:
             self.logger.warning("The \"%s\" metric cannot be used as a raw score for %s, switching to False",
@@ -1033,9 +1205,10 @@ class Abstractlocus(metaclass=abc.ABCMeta):
                                 param, self.id)
             use_raw = False
 
+        minimum, maximum = column.min(), column.max()
         if rescaling == "target":
-            target = self.json_conf["scoring"][param]["value"]
-            denominator = max(abs(x - target) for x in metrics.values())
+            target = conf["value"]
+            denominator = numpy.abs(column - target).max()
         else:
             target = None
             if use_raw is True and rescaling == "max":
@@ -1043,43 +1216,48 @@ class Abstractlocus(metaclass=abc.ABCMeta):
             elif use_raw is True and rescaling == "min":
                 denominator = -1
             else:
-                denominator = (max(metrics.values()) - min(metrics.values()))
+                denominator = maximum - minimum
         if denominator == 0:
             denominator = 1
 
-        scores = []
-        for tid in metrics:
-            tid_metric = metrics[tid]
-            score = 0
-            check = True
-            if ("filter" in self.json_conf["scoring"][param] and
-                    self.json_conf["scoring"][param]["filter"] != {}):
-                check = self.evaluate(tid_metric, self.json_conf["scoring"][param]["filter"])
-
-            if check is True:
-                if use_raw is True:
-                    if not isinstance(tid_metric, (float, int)) and 0 <= tid_metric <= 1:
-                        error = ValueError(
-                            "Only scores with values between 0 and 1 can be used raw. Please recheck your values.")
-                        self.logger.exception(error)
-                        raise error
-                    score = tid_metric / denominator
-                elif rescaling == "target":
-                    score = 1 - abs(tid_metric - target) / denominator
-                else:
-                    if min(metrics.values()) == max(metrics.values()):
-                        score = 1
-                    elif rescaling == "max":
-                        score = abs((tid_metric - min(metrics.values())) / denominator)
-                    elif rescaling == "min":
-                        score = abs(1 - (tid_metric - min(metrics.values())) / denominator)
-
-            score *= self.json_conf["scoring"][param]["multiplier"]
+        if "filter" in conf and conf["filter"] != {}:
+            check = self._evaluate_column(values, column, conf["filter"])
+        else:
+            check = numpy.ones(len(column), dtype=bool)
+
+        # Transcripts which do not pass the filter, or which all have the same value, get an integer score
+        constant = None
+        if use_raw is True:
+            for value in (value for value, passing in zip(values, check) if passing):
+                if not isinstance(value, (float, int)) and 0 <= value <= 1:
+                    error = ValueError(
+                        "Only scores with values between 0 and 1 can be used raw. Please recheck your values.")
+                    self.logger.exception(error)
+                    raise error
+            scores = column / denominator
+        elif rescaling == "target":
+            scores = 1 - numpy.abs(column - target) / denominator
+        elif minimum == maximum:
+            scores, constant = None, 1
+        elif rescaling == "max":
+            scores = numpy.abs((column - minimum) / denominator)
+        else:
+            scores = numpy.abs(1 - (column - minimum) / denominator)
+
+        multiplier = conf["multiplier"]
+        final = []
+        for pos, tid in enumerate(tids):
+            if not check[pos]:
+                score = 0 * multiplier
+            elif constant is not None:
+                score = constant * multiplier
+            else:
+                score = float(scores[pos]) * multiplier
             self.scores[tid][param] = round(score, 2)
-            scores.append(score)
+            final.append(score)
 
         # This MUST be true
-        if "filter" not in self.json_conf["scoring"][param] and max(scores) <= 0:
+        if "filter" not in conf and max(final) <= 0:
             self.logger.warning("All transcripts have a score of 0 for %s in %s",
                                 param, self.id)
 
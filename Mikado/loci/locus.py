@@ -6,7 +6,7 @@ i.e. the locus.
 """
 
 import collections
-import itertools
+import logging
 import operator
 from collections import deque
 import pyfaidx
@@ -15,8 +15,8 @@ from ..transcripts.transcriptchecker import TranscriptChecker
 from .abstractlocus import Abstractlocus
 from .sublocus import Sublocus
 from ..parsers.GFF import GffLine
-from ..scales.assigner import Assigner
-from ..utilities import overlap
+from ..scales import comparison_cache
+from ..utilities import overlap, predicates, merge_ranges, profiling
 
 
 class Locus(Sublocus, Abstractlocus):
@@ -55,13 +55,17 @@ class Locus(Sublocus, Abstractlocus):
         self.tid = transcript.id
         self.logger = logger
         self.attributes = dict()
-        self.logger.debug("Created Locus object with {0}".format(transcript.id))
+        self.logger.debug("Created Locus object with %s", transcript.id)
         self.primary_transcript_id = transcript.id
         self.attributes["is_fragment"] = False
         self.metric_lines_store = []
         self.__id = None
         self.fai = None
         self.json_conf = json_conf
+        # Forms of the transcripts used to assess the AS events, and their index by signature
+        # (see as_signature). Both are updated lazily by __as_form.
+        self.__as_forms = dict()
+        self.__as_index = collections.defaultdict(set)
         # if verified_introns is not None:
         #     self.locus_verified_introns = verified_introns
 
@@ -93,8 +97,9 @@ class Locus(Sublocus, Abstractlocus):
         self_line.attributes["multiexonic"] = (not self.monoexonic)
         lines.append(str(self_line))
 
-        for tid in self.transcripts:
-            transcript_instance = self.transcripts[tid]
+        # The transcripts are printed in order of coordinates
+        for transcript_instance in sorted(self.transcripts.values(),
+                                          key=lambda transcript: (transcript.start, transcript.end)):
             transcript_instance.source = self.source
             transcript_instance.parent = self_line.id
             self.logger.debug(self.attributes)
@@ -133,24 +138,23 @@ class Locus(Sublocus, Abstractlocus):
 
             for tid, score in order:
                 if len(to_keep) == max_isoforms:
-                    self.logger.debug(
-                        "Discarding {} from the locus because we have \
-reached the maximum number of isoforms for the locus".format(
-                            ", ".join(list(set.difference(set(self.transcripts.keys()),
-                                                          to_keep)))
-                        ))
+                    if self.logger.isEnabledFor(logging.DEBUG):
+                        self.logger.debug(
+                            "Discarding %s from the locus because we have \
+reached the maximum number of isoforms for the locus",
+                            ", ".join(list(set.difference(set(self.transcripts.keys()), to_keep))))
                     break
                 if score < threshold:
-                    self.logger.debug(
-                        "Discarding {} from the locus because their scores are below the threshold ({})".format(
-                            ", ".join(list(set.difference(set(self.transcripts.keys()),
-                                                          to_keep))),
-                            round(threshold, 2)))
+                    if self.logger.isEnabledFor(logging.DEBUG):
+                        self.logger.debug(
+                            "Discarding %s from the locus because their scores are below the threshold (%s)",
+                            ", ".join(list(set.difference(set(self.transcripts.keys()), to_keep))),
+                            round(threshold, 2))
                     break
                 to_keep.add(tid)
 
             if to_keep == set(self.transcripts.keys()):
-                self.logger.debug("Finished to discard superfluous transcripts from {}".format(self.id))
+                self.logger.debug("Finished to discard superfluous transcripts from %s", self.id)
                 break
             else:
                 for tid in set.difference(set(self.transcripts.keys()), to_keep):
@@ -180,8 +184,9 @@ reached the maximum number of isoforms for the locus".format(
             if not to_remove:
                 break
             elif self.json_conf["pick"]["alternative_splicing"]["keep_retained_introns"] is False:
-                self.logger.debug("Removing {} because they contain retained introns".format(
-                    ", ".join(list(to_remove))))
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug("Removing %s because they contain retained introns",
+                                      ", ".join(list(to_remove)))
                 for tid in to_remove:
                     self.remove_transcript_from_locus(tid)
                 self.metrics_calculated = False
@@ -264,31 +269,22 @@ reached the maximum number of isoforms for the locus".format(
 
         # Add a check similar to what we do for the minimum requirements and the fragments
         if to_be_added and "as_requirements" in self.json_conf:
-            if ("compiled" not in self.json_conf["as_requirements"] or
-                        self.json_conf["as_requirements"]["compiled"] is None):
-                self.json_conf["as_requirements"]["compiled"] = compile(
-                    self.json_conf["as_requirements"]["expression"], "<json>",
-                    "eval")
-            evaluated = dict()
-            for key in self.json_conf["as_requirements"]["parameters"]:
-                value = getattr(transcript,
-                                self.json_conf["as_requirements"]["parameters"][key]["name"])
-                evaluated[key] = self.evaluate(
-                        value,
-                        self.json_conf["as_requirements"]["parameters"][key])
-                # pylint: disable=eval-used
-            if eval(self.json_conf["as_requirements"]["compiled"]) is False:
-                self.logger.debug("%s fails the minimum requirements for AS events", transcript.id)
+            predicate = predicates.get_predicate(self.json_conf["as_requirements"])
+            clauses = predicate.clauses([transcript])
+            if not predicate.combine(clauses)[0]:
+                self.logger.debug("%s fails the minimum requirements for AS events: %s",
+                                  transcript.id, ", ".join(predicate.failed_clauses(clauses, 0)))
                 to_be_added = False
 
         if to_be_added and self.json_conf["pick"]["alternative_splicing"]["min_cds_overlap"] > 0:
             if self.primary_transcript.combined_cds_length > 0:
-                tr_nucls = set(itertools.chain(
-                    *[range(x[0], x[1] + 1) for x in transcript.combined_cds]))
-                primary_nucls = set(
-                    itertools.chain(
-                        *[range(x[0], x[1] + 1) for x in self.primary_transcript.combined_cds]))
-                nucl_overlap = len(set.intersection(primary_nucls, tr_nucls))
+                primary_cds = list(merge_ranges(self.primary_transcript.combined_cds))
+                nucl_overlap = 0
+                for start, end in merge_ranges(transcript.combined_cds):
+                    for primary_start, primary_end in primary_cds:
+                        if primary_start > end:
+                            break
+                        nucl_overlap += max(0, min(end, primary_end) - max(start, primary_start) + 1)
                 overlap = nucl_overlap / self.primary_transcript.combined_cds_length
                 if overlap < self.json_conf["pick"]["alternative_splicing"]["min_cds_overlap"]:
                     self.logger.debug(
@@ -319,18 +315,8 @@ reached the maximum number of isoforms for the locus".format(
         """This method will use the expression in the "not_fragmentary" section
         of the configuration to determine whether it is itself a putative fragment."""
 
-        self.json_conf["not_fragmentary"]["compiled"] = compile(
-            self.json_conf["not_fragmentary"]["expression"], "<json>",
-            "eval")
-
-        evaluated = dict()
-        for key in self.json_conf["not_fragmentary"]["parameters"]:
-            value = getattr(self.primary_transcript,
-                            self.json_conf["not_fragmentary"]["parameters"][key]["name"])
-            evaluated[key] = self.evaluate(
-                value,
-                self.json_conf["not_fragmentary"]["parameters"][key])
-        if eval(self.json_conf["not_fragmentary"]["compiled"]) is True:
+        predicate = predicates.get_predicate(self.json_conf["not_fragmentary"])
+        if predicate.passing([self.primary_transcript])[0]:
             self.logger.debug("%s cannot be a fragment according to the definitions, keeping it",
                               self.id)
             return False
@@ -362,17 +348,17 @@ reached the maximum number of isoforms for the locus".format(
                           self.primary_transcript_id,
                           other.primary_transcript_id)
 
-        result, _ = Assigner.compare(other.primary_transcript, self.primary_transcript)
+        result, _ = comparison_cache.compare(other.primary_transcript, self.primary_transcript)
         max_distance = self.json_conf["pick"]["fragments"]["max_distance"]
-        self.logger.debug("Comparison between {0} (strand {3}) and {1}: class code \"{2}\"".format(
-            self.primary_transcript.id,
-            other.primary_transcript.id,
-            result.ccode[0],
-            other.strand))
+        self.logger.debug("Comparison between %s (strand %s) and %s: class code \"%s\"",
+                          self.primary_transcript.id,
+                          other.strand,
+                          other.primary_transcript.id,
+                          result.ccode[0])
         if (result.ccode[0] in self.json_conf["pick"]["fragments"]["valid_class_codes"] and
                     result.distance[0] <= max_distance):
-            self.logger.debug("{0} is a fragment (ccode {1})".format(
-                other.primary_transcript.id, result.ccode[0]))
+            self.logger.debug("%s is a fragment (ccode %s)",
+                              other.primary_transcript.id, result.ccode[0])
             return True, result
 
         return False, None
@@ -440,7 +426,7 @@ reached the maximum number of isoforms for the locus".format(
                 super().calculate_metrics(new_transcript.id)
                 self.__orf_doubles[tid].add(new_transcript.id)
 
-        self.logger.debug("Calculated metrics for {0}".format(tid))
+        self.logger.debug("Calculated metrics for %s", tid)
 
     def calculate_scores(self):
         """
@@ -509,6 +495,10 @@ reached the maximum number of isoforms for the locus".format(
         To do so, it compares the candidate against all transcripts in the Locus, and calculates
         the class code using scales.Assigner.compare.
         If all the matches are "n" or "j", the transcript is considered as an AS event.
+        Candidates which have the same signature (see as_signature) of a transcript already
+        in the locus would be classified as "=" or "_" against it; when these class codes are
+        redundant, the candidates are rejected through the index of the signatures, without
+        any further comparison.
 
         :param other: another transcript to compare against
         :type other: Transcript
@@ -522,16 +512,13 @@ reached the maximum number of isoforms for the locus".format(
         redundant_ccodes = self.json_conf["pick"]["alternative_splicing"]["redundant_ccodes"]
 
         if self.json_conf["pick"]["clustering"]["cds_only"] is True:
-            main_without_utr = self.primary_transcript.deepcopy()
-            main_without_utr.remove_utrs()
             other_without_utr = other.deepcopy()
             other_without_utr.remove_utrs()
-            main_result, _ = Assigner.compare(other_without_utr,
-                                              main_without_utr)
+            main_result, _ = comparison_cache.compare(other_without_utr,
+                                                      self.__as_form(self.primary_transcript_id))
         else:
-            other_without_utr = None
-            main_result, _ = Assigner.compare(other,
-                                              self.primary_transcript)
+            main_result, _ = comparison_cache.compare(other,
+                                                      self.primary_transcript)
         main_ccode = main_result.ccode[0]
 
         if main_ccode not in valid_ccodes:
@@ -540,24 +527,92 @@ reached the maximum number of isoforms for the locus".format(
                               main_result.ccode[0])
             is_valid = False
         if is_valid:
-            for tid in iter(tid for tid in self.transcripts if
-                            tid not in (self.primary_transcript_id, other.id)):
-                candidate = self.transcripts[tid]
-                if self.json_conf["pick"]["clustering"]["cds_only"] is True:
-                    candidate = candidate.deepcopy()
-                    candidate.remove_utrs()
-                    Assigner.compare(other_without_utr, candidate)
-                else:
-                    Assigner.compare(other, candidate)
-                result, _ = Assigner.compare(other, candidate)
-                if result.ccode[0] in redundant_ccodes:
-                    self.logger.debug("%s is a redundant isoform of %s (ccode %s)",
-                                      other.id, candidate.id, result.ccode[0])
-                    is_valid = False
-                    break
+            others = [tid for tid in self.transcripts if tid not in (self.primary_transcript_id, other.id)]
+            for tid in others:
+                self.__as_form(tid)
+            signature = self.as_signature(other)
+            ccode = "_" if other.monoexonic else "="
+            identical = self.__as_index.get(signature, set()).intersection(others)
+            if identical and ccode in redundant_ccodes:
+                profiling.count("as_signature_rejections")
+                self.logger.debug("%s is a redundant isoform of %s (ccode %s)",
+                                  other.id, sorted(identical)[0], ccode)
+                is_valid = False
+            else:
+                for tid in others:
+                    if tid in identical:
+                        continue
+                    candidate = self.__as_form(tid)
+                    result, _ = comparison_cache.compare(other, candidate)
+                    if result.ccode[0] in redundant_ccodes:
+                        self.logger.debug("%s is a redundant isoform of %s (ccode %s)",
+                                          other.id, candidate.id, result.ccode[0])
+                        is_valid = False
+                        break
 
         return is_valid, main_ccode, main_result
 
+    @staticmethod
+    def as_signature(transcript):
+        """
+        Static method to calculate the signature of a transcript used to identify redundant AS events:
+        the strand and the intron chain for multiexonic transcripts, the strand and the exon for
+        monoexonic transcripts. Two transcripts with the same signature are classified as "=" or "_"
+        (respectively) when compared.
+
+        :param transcript: the transcript.
+        :type transcript: Transcript
+
+        :rtype: tuple
+        """
+
+        if transcript.monoexonic is True:
+            return (transcript.strand, True,
+                    tuple((exon[0], exon[1]) for exon in transcript.exons))
+        return transcript.strand, False, tuple(sorted(transcript.introns))
+
+    def __as_form(self, tid):
+        """
+        Private method to retrieve the form of a transcript of the locus used to assess the AS events,
+        ie the transcript itself or, when clustering on the CDS only, a copy of it without the UTRs.
+        The forms are calculated only once per transcript, and indexed by their signature.
+
+        :param tid: the name of the transcript.
+        :type tid: str
+
+        :rtype: Transcript
+        """
+
+        transcript = self.transcripts[tid]
+        original, form, signature = self.__as_forms.get(tid, (None, None, None))
+        if original is not transcript:
+            if original is not None:
+                self.__as_index[signature].discard(tid)
+            form = transcript
+            if self.json_conf["pick"]["clustering"]["cds_only"] is True:
+                form = transcript.deepcopy()
+                form.remove_utrs()
+            else:
+                form.finalize()
+            signature = self.as_signature(form)
+            self.__as_forms[tid] = (transcript, form, signature)
+            self.__as_index[signature].add(tid)
+        return form
+
+    def remove_transcript_from_locus(self, tid: str):
+        """
+        :param tid: name of the transcript to remove
+        :type tid: str
+
+        Implementation of the remove_transcript_from_locus method, which also removes the transcript
+        from the index of the signatures used to assess the AS events.
+        """
+
+        if tid in self.__as_forms:
+            _, _, signature = self.__as_forms.pop(tid)
+            self.__as_index[signature].discard(tid)
+        super().remove_transcript_from_locus(tid)
+
     def pad_transcripts(self):
 
         """
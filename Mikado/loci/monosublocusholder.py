@@ -15,7 +15,7 @@ from .locus import Locus
 from .monosublocus import Monosublocus
 from .sublocus import Sublocus
 from ..parsers.GFF import GffLine
-from ..scales.contrast import compare as c_compare
+from ..scales import comparison_cache
 from ..utilities import overlap
 from ..utilities.log_utils import create_null_logger
 
@@ -196,6 +196,7 @@ class MonosublocusHolder(Sublocus, Abstractlocus):
         graph = self.define_graph(
             self.transcripts,
             inters=self.is_intersecting,
+            overlapping_only=True,
             logger=self.logger,
             cds_only=self.json_conf["pick"]["clustering"]["cds_only"],
             min_cdna_overlap=self.json_conf["pick"]["clustering"]["min_cdna_overlap"],
@@ -220,7 +221,7 @@ class MonosublocusHolder(Sublocus, Abstractlocus):
                 if purge is False or selected_transcript.score > 0:
                     new_locus = Locus(selected_transcript, logger=self.logger, json_conf=self.json_conf)
                     loci.append(new_locus)
-            self.logger.debug("Removing {0} transcripts from {1}".format(len(to_remove), self.id))
+            self.logger.debug("Removing %d transcripts from %s", len(to_remove), self.id)
             graph.remove_nodes_from(to_remove)  # Remove nodes from graph, iterate
 
         for locus in sorted(loci):
@@ -339,7 +340,7 @@ class MonosublocusHolder(Sublocus, Abstractlocus):
         :type simple_overlap_for_monoexonic: bool
         """
 
-        comparison, _ = c_compare(other, transcript)
+        comparison, _ = comparison_cache.compare(other, transcript)
         if comparison.n_f1[0] == 0:
             reason = "No genomic overlap between {} and {}".format(transcript.id, other.id)
             intersecting = False
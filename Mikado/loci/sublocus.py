@@ -7,6 +7,7 @@ or multiexonic and with at least one intron in common.
 """
 
 import itertools
+import logging
 
 
 from ..transcripts.transcript import Transcript
@@ -85,7 +86,7 @@ class Sublocus(Abstractlocus):
             self.attributes = getattr(span, "attributes")
 
         self.monosubloci = []
-        self.logger.debug("Initialized {0}".format(self.id))
+        self.logger.debug("Initialized %s", self.id)
         self.metric_lines_store = []  # This list will contain the lines to be printed in the metrics file
 
         self.scores = dict()
@@ -186,7 +187,7 @@ class Sublocus(Abstractlocus):
 
         self.monosubloci = []
         self.excluded = excluded
-        self.logger.debug("Launching calculate scores for {0}".format(self.id))
+        self.logger.debug("Launching calculate scores for %s", self.id)
         self.calculate_scores()
 
         if self._excluded_transcripts and self.purge:
@@ -195,17 +196,18 @@ class Sublocus(Abstractlocus):
                 self.excluded.add_transcript_to_locus(self._excluded_transcripts.pop(),
                                                       check_in_locus=False)
 
-        self.logger.debug("Defining monosubloci for {0}".format(self.id))
+        self.logger.debug("Defining monosubloci for %s", self.id)
 
         transcript_graph = self.define_graph(self.transcripts,
                                              inters=self.is_intersecting,
+                                             overlapping_only=True,
                                              logger=self.logger)
 
         while len(transcript_graph) > 0:
             cliques = self.find_cliques(transcript_graph)
             communities = self.find_communities(transcript_graph)
-            self.logger.debug("Cliques: {0}".format(cliques))
-            self.logger.debug("Communities: {0}".format(communities))
+            self.logger.debug("Cliques: %s", cliques)
+            self.logger.debug("Communities: %s", communities)
             to_remove = set()
             for msbl in communities:
                 msbl = dict((x, self.transcripts[x]) for x in msbl)
@@ -216,10 +218,9 @@ class Sublocus(Abstractlocus):
                                   selected_tid, selected_transcript.score)
                 for clique in cliques:
                     if selected_tid in clique:
-                        self.logger.debug("Removing as intersecting {0}: {1}".format(
-                            selected_tid,
-                            ",".join(list(clique))
-                        ))
+                        if self.logger.isEnabledFor(logging.DEBUG):
+                            self.logger.debug("Removing as intersecting %s: %s",
+                                              selected_tid, ",".join(list(clique)))
                         to_remove.update(clique)
                 if purge is False or selected_transcript.score > 0:
                     new_locus = Monosublocus(selected_transcript,
@@ -349,18 +350,18 @@ class Sublocus(Abstractlocus):
         if transcript.id == other.id:
             # We do not want intersection with oneself
             if logger is not None:
-                logger.debug("Self-comparison for {0}".format(transcript.id))
+                logger.debug("Self-comparison for %s", transcript.id)
             return False
         if logger is not None:
-            logger.debug("Comparing {0} and {1}".format(transcript.id, other.id))
+            logger.debug("Comparing %s and %s", transcript.id, other.id)
         if any(True for comb in itertools.product(transcript.exons, other.exons) if
                cls.overlap(*comb) >= 0):
             if logger is not None:
-                logger.debug("{0} and {1} are intersecting".format(transcript.id, other.id))
+                logger.debug("%s and %s are intersecting", transcript.id, other.id)
 
             return True
         if logger is not None:
-            logger.debug("{0} and {1} are not intersecting".format(transcript.id, other.id))
+            logger.debug("%s and %s are not intersecting", transcript.id, other.id)
         return False
     # pylint: enable=arguments-differ
 
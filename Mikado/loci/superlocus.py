@@ -27,7 +27,7 @@ from ..serializers.blast_serializer import Hit, Query, Target
 from ..serializers.external import External
 from ..serializers.junction import Junction, Chrom
 from ..serializers.orf import Orf
-from ..utilities import dbutils, grouper
+from ..utilities import dbutils, grouper, profiling, budget
 import itertools
 if version_info.minor < 5:
     from sortedcontainers import SortedDict
@@ -113,6 +113,7 @@ class Superlocus(Abstractlocus):
 
         super().__init__(source=source)
         self.approximation_level = 0
+        self.budget = budget.Budget()
         self.stranded = stranded
         self.feature = self.__name__
         if json_conf is None or not isinstance(json_conf, dict):
@@ -297,6 +298,8 @@ class Superlocus(Abstractlocus):
         superlocus_line.id, superlocus_line.name = new_id, self.name
         if self.approximation_level > 0:
             superlocus_line.attributes["approximation_level"] = self.approximation_level
+        if len(self.budget.degradations) > 0:
+            superlocus_line.attributes["budget_degradation"] = ",".join(self.budget.degradations)
         if len(self.__retained_sources) > 0:
             superlocus_line.attributes["retained_sources"] = ",".join(
                 sorted(list(self.__retained_sources))
@@ -340,7 +343,7 @@ class Superlocus(Abstractlocus):
         two different superloci.
         """
 
-        self.logger.debug("Splitting by strand for {0}".format(self.id))
+        self.logger.debug("Splitting by strand for %s", self.id)
         if self.stranded is True:
             self.logger.warning("Trying to split by strand a stranded Locus, {0}!".format(self.id))
             yield self
@@ -349,7 +352,7 @@ class Superlocus(Abstractlocus):
             plus, minus, nones = [], [], []
             for cdna_id in self.transcripts:
                 cdna = self.transcripts[cdna_id]
-                self.logger.debug("{0}: strand {1}".format(cdna_id, cdna.strand))
+                self.logger.debug("%s: strand %s", cdna_id, cdna.strand)
                 if cdna.strand == "+":
                     plus.append(cdna)
                 elif cdna.strand == "-":
@@ -424,7 +427,7 @@ class Superlocus(Abstractlocus):
 
         This routine is used to load data for a single transcript."""
 
-        self.logger.debug("Retrieving data for {0}".format(tid))
+        self.logger.debug("Retrieving data for %s", tid)
         self.transcripts[tid].logger = self.logger
         self.transcripts[tid].load_information_from_db(self.json_conf,
                                                        introns=self.locus_verified_introns,
@@ -672,10 +675,29 @@ class Superlocus(Abstractlocus):
 
     # ##### Sublocus-related steps ######
 
+    def __affordable(self, transcript_graph):
+
+        """
+        Private method to check whether the budget of the superlocus can cover the analysis
+        of the transcript graph. If not, the definition of the subloci is recorded as degraded.
+
+        :param transcript_graph: the transcript graph
+        :rtype: bool
+        """
+
+        if self.budget.affordable(transcript_graph.number_of_edges()):
+            return True
+        self.logger.warning("%s has exceeded its budget (%d work units, %.2f CPU seconds); approximating",
+                            self.id, self.budget.spent, self.budget.elapsed)
+        self.budget.degrade("subloci")
+        return False
+
     def __reduce_complex_loci(self, transcript_graph):
 
         """
         Method which checks whether a locus has too many transcripts and tries to reduce them.
+        The same approximations are used when the analysis of the transcript graph would exceed
+        the budget of the superlocus.
 
         :param transcript_graph: the transcript graph to analyse for redundancies
         :return:
@@ -683,7 +705,8 @@ class Superlocus(Abstractlocus):
 
         max_edges = max([transcript_graph.degree(node) for node in transcript_graph.nodes()])
         self.approximation_level = 0
-        if len(transcript_graph) < self._complex_limit[0] and max_edges < self._complex_limit[1]:
+        if (len(transcript_graph) < self._complex_limit[0] and max_edges < self._complex_limit[1] and
+                self.__affordable(transcript_graph)):
             return transcript_graph
         self.logger.warning("Complex superlocus with %d nodes \
         with the most connected having %d edges",
@@ -705,7 +728,8 @@ class Superlocus(Abstractlocus):
                         break
         transcript_graph.remove_nodes_from(to_remove)
         max_edges = max([transcript_graph.degree(node) for node in transcript_graph.nodes()])
-        if len(transcript_graph) < self._complex_limit[0] and max_edges < self._complex_limit[1]:
+        if (len(transcript_graph) < self._complex_limit[0] and max_edges < self._complex_limit[1] and
+                self.__affordable(transcript_graph)):
             self.logger.warning("Approximation level 1 for %s", self.id)
             return transcript_graph
 
@@ -762,7 +786,8 @@ class Superlocus(Abstractlocus):
 
         transcript_graph.remove_nodes_from(to_remove)
         max_edges = max([transcript_graph.degree(node) for node in transcript_graph.nodes()])
-        if len(transcript_graph) < self._complex_limit[0] and max_edges < self._complex_limit[1]:
+        if (len(transcript_graph) < self._complex_limit[0] and max_edges < self._complex_limit[1] and
+                self.__affordable(transcript_graph)):
             self.logger.warning("Approximation level 2 for %s", self.id)
             return transcript_graph
         self.logger.warning("Still %d nodes with the most connected with %d edges \
@@ -772,7 +797,7 @@ class Superlocus(Abstractlocus):
         sources = collections.defaultdict(set)
         for tid in transcript_graph:
             found = False
-            for tag in self.json_conf["prepare"]["labels"]:
+            for tag in self.json_conf["prepare"]["files"]["labels"]:
                 if tag != '' and tag in tid:
                     sources[tag].add(tid)
                     found = True
@@ -807,7 +832,8 @@ class Superlocus(Abstractlocus):
                 edges_most_connected = counter.most_common(1)[0][1]
 
             if (len(acceptable) > self._complex_limit[0] or
-                    edges_most_connected > self._complex_limit[1]):
+                    edges_most_connected > self._complex_limit[1] or
+                    (len(new_graph) > 0 and not self.budget.affordable(len(edges)))):
                 self.logger.debug("Reached the limit with source %s, %d nodes, %d max edges",
                                   source,
                                   len(acceptable),
@@ -823,6 +849,7 @@ class Superlocus(Abstractlocus):
                             self.id, ",".join(self.__retained_sources))
         return new_graph
 
+    @profiling.profiled("define_subloci")
     def define_subloci(self):
         """This method will define all subloci inside the superlocus.
         Steps:
@@ -845,12 +872,17 @@ class Superlocus(Abstractlocus):
             self.subloci_defined = True
             return
 
+        self.budget = budget.Budget.from_configuration(self.json_conf)
         cds_only = self.json_conf["pick"]["clustering"]["cds_only"]
         self.logger.debug("Calculating the transcript graph for %d transcripts", len(self.transcripts))
         transcript_graph = self.define_graph(self.transcripts,
                                              inters=self.is_intersecting,
+                                             overlapping_only=True,
                                              cds_only=cds_only)
         transcript_graph = self.__reduce_complex_loci(transcript_graph)
+        self.budget.spend(transcript_graph.number_of_edges())
+        if self.approximation_level > 0:
+            profiling.count("approximation_level_{}".format(self.approximation_level))
         if len(self.transcripts) > len(transcript_graph):
             self.logger.warning("Discarded %d transcripts from %s due to approximation level %d",
                                 len(self.transcripts) - len(transcript_graph),
@@ -927,6 +959,7 @@ class Superlocus(Abstractlocus):
         for sublocus_instance in self.subloci:
             sublocus_instance.get_metrics()
 
+    @profiling.profiled("define_monosubloci")
     def define_monosubloci(self):
 
         """This is a wrapper method that defines the monosubloci for each sublocus.
@@ -940,6 +973,9 @@ class Superlocus(Abstractlocus):
         self.logger.debug("Calculated subloci for %s, %d transcripts",
                           self.id, len(self.transcripts))
         self.monosubloci = []
+        if self.regressor is not None:
+            # Score the transcripts of all the subloci with a single call to the model
+            Abstractlocus.calculate_batch_scores(self.subloci)
         # Extract the relevant transcripts
         for sublocus_instance in sorted(self.subloci):
             self.excluded_transcripts = sublocus_instance.define_monosubloci(
@@ -954,6 +990,14 @@ class Superlocus(Abstractlocus):
         self.monosubloci = sorted(self.monosubloci)
         self.monosubloci_defined = True
 
+    def __add_budget_metrics(self, row):
+        """Private method to add the degradations of the analysis to a row of the metrics,
+        when the superloci are analysed within a budget."""
+
+        if self.budget.enabled is True:
+            row["budget_degradation"] = ",".join(self.budget.degradations) or "NA"
+        return row
+
     def print_subloci_metrics(self):
         """Wrapper method to create a csv.DictWriter instance and call
         the sublocus.print_metrics method
@@ -963,10 +1007,10 @@ class Superlocus(Abstractlocus):
 
         for slocus in self.subloci:
             for row in slocus.print_metrics():
-                yield row
+                yield self.__add_budget_metrics(row)
         if self.excluded_transcripts is not None:
             for row in self.excluded_transcripts.print_metrics():
-                yield row
+                yield self.__add_budget_metrics(row)
 
     def print_subloci_scores(self):
         """Wrapper method to create a csv.DictWriter instance and call the
@@ -995,7 +1039,7 @@ class Superlocus(Abstractlocus):
             return
         for monoholder in self.monoholders:
             for row in monoholder.print_metrics():
-                yield row
+                yield self.__add_budget_metrics(row)
 
     def print_monoholder_scores(self):
 
@@ -1019,7 +1063,7 @@ class Superlocus(Abstractlocus):
             return []
         for locus in self.loci:
             for row in self.loci[locus].print_metrics():
-                yield row
+                yield self.__add_budget_metrics(row)
 
     def print_loci_scores(self):
 
@@ -1035,6 +1079,7 @@ class Superlocus(Abstractlocus):
             for row in self.loci[locus].print_scores():
                 yield row
 
+    @profiling.profiled("define_loci")
     def define_loci(self):
         """This is the final method in the pipeline. It creates a container
         for all the monosubloci (an instance of the class MonosublocusHolder)
@@ -1073,10 +1118,19 @@ class Superlocus(Abstractlocus):
                           self.id,
                           self.json_conf["pick"]["alternative_splicing"]["report"])
         if self.json_conf["pick"]["alternative_splicing"]["report"] is True:
-            self.define_alternative_splicing()
+            if self.budget.exhausted():
+                self.logger.warning("%s has exceeded its budget; skipping the AS events", self.id)
+                self.budget.degrade("alternative_splicing")
+            else:
+                self.define_alternative_splicing()
+
+        if len(self.budget.degradations) > 0:
+            for locus in self.loci.values():
+                locus.attributes["budget_degradation"] = ",".join(self.budget.degradations)
 
         return
 
+    @profiling.profiled("define_alternative_splicing")
     def define_alternative_splicing(self):
 
         """
@@ -1101,6 +1155,7 @@ class Superlocus(Abstractlocus):
 
         t_graph = self.define_graph(self.transcripts,
                                     inters=MonosublocusHolder.is_intersecting,
+                                    overlapping_only=True,
                                     cds_only=cds_only,
                                     logger=self.logger,
                                     min_cdna_overlap=cdna_overlap,
@@ -1128,6 +1183,14 @@ class Superlocus(Abstractlocus):
             for tid in sorted(candidates[lid],
                               key=lambda ttid: self.transcripts[ttid].score,
                               reverse=True):
+                # Each candidate is compared against the transcripts already in the locus
+                work = len(self.loci[lid].transcripts)
+                if not self.budget.affordable(work):
+                    self.logger.warning("%s has exceeded its budget; no more AS events for %s",
+                                        self.id, lid)
+                    self.budget.degrade("alternative_splicing")
+                    break
+                self.budget.spend(work)
                 self.loci[lid].add_transcript_to_locus(self.transcripts[tid])
             self.loci[lid].finalize_alternative_splicing()
 
@@ -1165,6 +1228,9 @@ class Superlocus(Abstractlocus):
             monoholder.scores_calculated = False
             if self.regressor is not None:
                 monoholder.regressor = self.regressor
+        if self.regressor is not None:
+            Abstractlocus.calculate_batch_scores(self.monoholders)
+        for monoholder in self.monoholders:
             monoholder.calculate_scores()
 
     def compile_requirements(self):
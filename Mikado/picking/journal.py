@@ -0,0 +1,170 @@
+# coding: utf-8
+
+"""
+This module implements the journal used to resume interrupted multi-process runs of Mikado pick.
+The writer process periodically records in the journal the number of items of the locus queue
+(superloci, or regions of the input when sharding) whose output has been written completely,
+together with the state of the gene numbering and the size of each output file.
+When a run is resumed, the output files are truncated to the sizes recorded in the last valid
+checkpoint, and only the items following it are analysed again.
+"""
+
+import json
+import os
+from ..utilities import profiling
+
+__author__ = 'Luca Venturini'
+
+
+class Journal:
+
+    """
+    Class to write and read the checkpoints of a multi-process pick run. The journal is a text file
+    with one JSON record per line: the first line describes the run (input file and partitioning
+    of the input), the following lines are the checkpoints.
+    """
+
+    def __init__(self, filename, fingerprint):
+        """
+        :param filename: the name of the journal file.
+        :type filename: str
+
+        :param fingerprint: dictionary describing the run. A journal can only be used to resume
+        a run with the same fingerprint.
+        :type fingerprint: dict
+        """
+
+        self.filename = filename
+        # Normalise the fingerprint as it would be read back from the file
+        self.fingerprint = json.loads(json.dumps(fingerprint))
+        self.__handle = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_Journal__handle"] = None
+        return state
+
+    @staticmethod
+    def __sizes(output_files):
+        return [os.path.getsize(name) if name is not None and os.path.exists(name) else None
+                for group in output_files for name in group]
+
+    def load(self, output_files):
+        """
+        Method to retrieve the last checkpoint which is consistent with the current output files,
+        ie for which all the output files are at least as long as recorded.
+
+        :param output_files: the names of the output files, grouped as in the Picker.
+        :type output_files: list
+
+        :returns: the checkpoint, or None if the journal is missing, empty, or refers to a different run.
+        :rtype: (dict|None)
+        """
+
+        if not os.path.exists(self.filename):
+            return None
+
+        with open(self.filename) as journal:
+            records = []
+            for line in journal:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Incomplete line, written when the run was interrupted
+                    break
+
+        if not records or records[0].get("fingerprint", None) != self.fingerprint:
+            return None
+
+        sizes = self.__sizes(output_files)
+        valid = None
+        for record in records[1:]:
+            if len(record["offsets"]) != len(sizes):
+                return None
+            if all(offset is None or (size is not None and size >= offset)
+                   for offset, size in zip(record["offsets"], sizes)):
+                valid = record
+        return valid
+
+    def start(self, output_files):
+        """
+        Method to start a new journal, recording the initial size of the output files
+        (ie the size of their headers).
+        :param output_files: the names of the output files, grouped as in the Picker.
+        :type output_files: list
+        """
+
+        with open(self.filename, "wt") as journal:
+            print(json.dumps({"fingerprint": self.fingerprint}), file=journal)
+            print(json.dumps({"item": 0, "chrom": None, "genes": 0,
+                              "offsets": self.__sizes(output_files)}), file=journal)
+
+    def restore(self, checkpoint, output_files):
+        """
+        Method to truncate the output files to the sizes recorded in a checkpoint,
+        and to remove any later checkpoint from the journal.
+
+        :param checkpoint: the checkpoint, as returned by load.
+        :type checkpoint: dict
+
+        :param output_files: the names of the output files, grouped as in the Picker.
+        :type output_files: list
+        """
+
+        for name, offset in zip((name for group in output_files for name in group), checkpoint["offsets"]):
+            if name is not None and offset is not None:
+                with open(name, "r+b") as output:
+                    output.truncate(offset)
+
+        temporary = "{}.tmp".format(self.filename)
+        with open(temporary, "wt") as journal:
+            print(json.dumps({"fingerprint": self.fingerprint}), file=journal)
+            print(json.dumps(checkpoint), file=journal)
+        os.replace(temporary, self.filename)
+
+    @profiling.profiled("checkpoint")
+    def checkpoint(self, item, chrom, genes, handles):
+        """
+        Method to record that the output of all the items up to the given one has been written.
+        The output files are synchronised to disk before the checkpoint is recorded.
+
+        :param item: the last item whose output has been written.
+        :type item: int
+
+        :param chrom: the chromosome of the last gene printed.
+        :type chrom: (str|None)
+
+        :param genes: the number of genes printed for the chromosome.
+        :type genes: int
+
+        :param handles: the output file handles (None for disabled outputs).
+        :type handles: list
+        """
+
+        offsets = []
+        for handle in handles:
+            if handle is None:
+                offsets.append(None)
+                continue
+            handle.flush()
+            os.fsync(handle.fileno())
+            offsets.append(os.fstat(handle.fileno()).st_size)
+
+        if self.__handle is None:
+            self.__handle = open(self.filename, "at")
+        print(json.dumps({"item": item, "chrom": chrom, "genes": genes, "offsets": offsets}),
+              file=self.__handle)
+        self.__handle.flush()
+        os.fsync(self.__handle.fileno())
+
+    def close(self):
+        """Method to close the journal file."""
+        if self.__handle is not None:
+            self.__handle.close()
+            self.__handle = None
+
+    def remove(self):
+        """Method to remove the journal, once the run has been completed."""
+        self.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
@@ -1,229 +1,73 @@
 from multiprocessing import Process
 from multiprocessing.managers import AutoProxy
 import logging
-from itertools import product
 import logging.handlers as logging_handlers
 import functools
-from ..utilities import dbutils
+from ..utilities import dbutils, shared_store, profiling, log_utils, budget
+from ..utilities.intervaltree import IntervalTree
 from ..scales.assigner import Assigner
+from ..scales import comparison_cache
+from ..loci.abstractlocus import Abstractlocus
 from ..loci.superlocus import Superlocus
-from ..parsers.GFF import GffLine
 from ..serializers.external import ExternalSource
-import os
+from .shards import Shard, shard_superloci
+from .packing import PackedSuperlocus, unpack_superlocus
+from .prefetch import Prefetcher, in_window, windows
+import io
+import queue
 import collections
 import csv
-import re
 import sys
 import pickle
-from itertools import zip_longest
+import time
 from sqlalchemy.engine import create_engine  # SQLAlchemy/DB imports
 import sqlalchemy.orm.session
 
 __author__ = 'Luca Venturini'
 
 
-def print_gene(current_gene, gene_counter, handle, prefix):
+# Character used to delimit the gene numbers in the output of the workers, which are assigned
+# by the writer process only once the preceding superloci have been printed.
+_gene_placeholder = "\x1e"
 
-    """
-    This function takes a gene and reformats it using the new derived name.
-    :param current_gene: a dictionary with the data for the current gene.
-    :type current_gene: dict
-    :param gene_counter: A counter to be used inside the genes
-    :type gene_counter: int
-    :param handle: The handle to the file to print to
-    :type handle: io.TextIOWrapper
-    :param prefix: the prefix to add to the name of the genes
-    :type prefix: str
-    :return: a dictionary with the correspondeces for the transcripts
-    :rtype: dict
-    """
-
-    # Reset the name
-    current_gene["gene"].name = current_gene["gene"].id
-    print(current_gene["gene"], file=handle)
-    tid_corrs = dict()
-    chrom = current_gene["gene"].chrom
-
-    transcripts = [_ for _ in current_gene["transcripts"]]
 
-    transcripts = sorted(transcripts,
-                         key=lambda _:
-                         (current_gene["transcripts"][_]["transcript"].start,
-                          current_gene["transcripts"][_]["transcript"].end))
+def _gene_number(num):
+    """Private function to create the placeholder for the gene number of the num-th gene of a superlocus."""
+    return "{0}{1}{0}".format(_gene_placeholder, num)
 
-    # transcript_counter = 1
-
-    foo_counter = ["failed", 0]
-
-    for transcript in transcripts:
-        current_transcript = current_gene["transcripts"][transcript]["transcript"]
-        # Get the original transcript counter
-        try:
-            # first = re.sub("{0}\.".format(current_transcript.parent[0]), "", other)
-            # transcript_counter = int(re.sub("\.orf[0-9]+", "", first))
-            transcript_counter = int(re.sub("\.orf[0-9]+", "",
-                                            current_transcript.id).split(".")[-1])
-        except ValueError as exc:
-            # Patch. For
-            if isinstance(current_transcript.parent, list):
-                foo_counter[1] += 1
-                transcript_counter = "_".join(foo_counter)
-            else:
-                raise ValueError((exc, str(current_transcript)))
-        assert transcript_counter >= 1
-
-        tid = "{0}.{1}G{2}.{3}".format(prefix,
-                                       chrom,
-                                       gene_counter,
-                                       transcript_counter)
-        if ".orf" in transcript:
-            tid = "{0}{1}".format(tid,
-                                  transcript[transcript.find(".orf"):])
-
-        current_transcript.parent = current_gene["gene"].id
-        current_exons = current_gene["transcripts"][transcript]["exons"]
-        current_transcript.attributes["Alias"] = current_transcript.id[:]
-        # name = re.sub("\.orf[0-9]+", "", tid)
-        # tid_corrs[re.sub("\.orf[0-9]+", "", current_transcript.id)] = name
-        tid_corrs[current_transcript.id] = tid
-        current_transcript.id = tid
-        current_transcript.name = tid
-        print(current_transcript, file=handle)
-        for exon in current_exons:
-            exon.parent = tid
-            exon.id = re.sub(current_transcript.attributes["Alias"],
-                             tid, exon.id)
-            exon.name = re.sub(current_transcript.attributes["Alias"],
-                               tid, exon.id)
-            print(exon, file=handle)
-    return tid_corrs
-
-
-def merge_loci_gff(gff_filenames, gff_handle, prefix=""):
 
+def renumber_genes(text, offset):
     """
-    This function will merge different partial GFF files into a single loci file,
-    while changing the names to reflect the ordering.
-    :param gff_filenames:
-    :param gff_handle:
-    :param prefix:
-    :return:
+    Function to replace the placeholders of the gene numbers produced by print_locus
+    with the final gene numbers.
+    :param text: the text to modify.
+    :type text: str
+    :param offset: the number of genes already printed for the chromosome.
+    :type offset: int
+    :rtype: str
     """
 
-    current_lines = dict()
-    gffs = [open(_) for _ in gff_filenames]
-
-    for lines in zip_longest(*gffs):
-        for num, line in enumerate(lines):
-            if line is None:
-                continue
-            _ = line.split("/")
-            index = int(_[0])
-            if index not in current_lines:
-                current_lines[index] = {"filenum": num,
-                                        "lines": []}
-            else:
-                assert current_lines[index]["filenum"] == num, (num,
-                                                                current_lines[index])
-            current_lines[index]["lines"].append("/".join(_[1:]))
-
-    [_.close() for _ in gffs]
-
-    gid_to_new = dict()
-    tid_to_new = dict()
-
-    with open(gff_handle, "a") as gff_handle:
-        current_gene = dict()
-        current_chrom = None
-        gene_counter = 0
-        for index in sorted(current_lines.keys()):
-            file_index = current_lines[index]["filenum"]
-            lines = [GffLine(_) for _ in current_lines[index]["lines"]]
-            for line in lines:
-                if line.header is True:
-                    continue
-                if current_chrom is not None and current_chrom != line.chrom:
-                    gene_counter = 0
-                    current_chrom = line.chrom
-                elif current_chrom is None:
-                    current_chrom = line.chrom
-                # Start the printing process
-                if line.is_gene:
-                    if current_gene != dict():
-                        tid_corrs = print_gene(current_gene,
-                                               gene_counter,
-                                               gff_handle,
-                                               prefix)
-                        for tid in tid_corrs:
-                            assert (file_index, tid) not in tid_to_new, (file_index, tid)
-                            tid_to_new[(file_index, tid)] = tid_corrs[tid]
-                        current_gene = dict()
-                    current_gene["transcripts"] = dict()
-
-                    # Create the correspondence for the new gene
-                    gene_counter += 1
-                    new_id = "{0}.{1}G{2}".format(prefix, line.chrom, gene_counter)
-                    assert (file_index, line.id) not in gid_to_new, ((file_index, line.id),
-                                                                     gid_to_new)
-                    gid_to_new[(file_index, line.id)] = new_id
-                    line.id = new_id
-                    current_gene["gene"] = line
-                elif line.is_transcript:
-                    assert current_gene != dict()
-                    current_gene["transcripts"][line.id] = dict()
-                    current_gene["transcripts"][line.id]["transcript"] = line
-                    current_gene["transcripts"][line.id]["exons"] = []
-                    if line.attributes["primary"].lower() in ("true", "false"):
-                        if line.attributes["primary"].lower() == "true":
-                            primary = True
-                        else:
-                            primary = False
-                        current_gene["transcripts"][line.id]["primary"] = primary
-                    else:
-                        raise ValueError("Invalid value for \"primary\" field: {0}".format(
-                            line.attributes["primary"]))
-                elif line.is_exon:
-                    for parent in line.parent:
-                        assert parent in current_gene["transcripts"]
-                        current_gene["transcripts"][parent]["exons"].append(line)
-                else:
-                    if current_gene != dict():
-                        tid_corrs = print_gene(current_gene,
-                                               gene_counter,
-                                               gff_handle,
-                                               prefix)
-                        for tid in tid_corrs:
-                            assert (file_index, tid) not in tid_to_new, (file_index, tid)
-                            tid_to_new[(file_index, tid)] = tid_corrs[tid]
-                        current_gene = dict()
-                        print("###", file=gff_handle)
-
-                    print(line, file=gff_handle)
-                    continue
-
-            if current_gene != dict():
-                tid_corrs = print_gene(current_gene, gene_counter, gff_handle, prefix)
-                for tid in tid_corrs:
-                    assert (file_index, tid) not in tid_to_new, (file_index, tid)
-                    tid_to_new[(file_index, tid)] = tid_corrs[tid]
-                current_gene = dict()
-                print("###", file=gff_handle)
-            del current_lines[index]
-
-    [os.remove(_) for _ in gff_filenames]
-    return gid_to_new, tid_to_new
+    fields = text.split(_gene_placeholder)
+    fields[1::2] = [str(int(_) + offset) for _ in fields[1::2]]
+    return "".join(fields)
 
 
+@profiling.profiled("print")
 def print_locus(stranded_locus,
                 gene_counter,
                 handles,
                 counter=None,
                 logger=None,
-                json_conf=None):
+                json_conf=None,
+                gene_placeholders=False):
     """
     Method that handles a single superlocus for printing.
     It also detects and flags/discard fragmentary loci.
     :param stranded_locus: the stranded locus to analyse
+    :param gene_placeholders: if True, the genes are numbered within the superlocus, and their
+    numbers are delimited by placeholders to be substituted with renumber_genes once the number
+    of genes printed before the superlocus is known.
+    :type gene_placeholders: bool
     :return:
     """
 
@@ -279,20 +123,27 @@ def print_locus(stranded_locus,
                 row["tid"] = "{0}/{1}".format(counter, row["tid"])
             mono_scores.writerow(row)
 
+    # The loci must be defined before they are renamed
+    stranded_locus.define_loci()
     for locus in stranded_locus.loci:
         gene_counter += 1
-        fragment_test = (
-            json_conf["pick"]["fragments"]["remove"]
-            is True and stranded_locus.loci[locus].is_fragment is True)
+        if gene_placeholders is False:
+            fragment_test = (
+                json_conf["pick"]["fragments"]["remove"]
+                is True and stranded_locus.loci[locus].is_fragment is True)
 
-        if fragment_test is True:
-            continue
-        gene_counter += 1
+            if fragment_test is True:
+                continue
+            gene_counter += 1
         new_id = "{0}.{1}G{2}".format(
             json_conf["pick"]["output_format"]["id_prefix"],
-            stranded_locus.chrom, gene_counter)
+            stranded_locus.chrom,
+            _gene_number(gene_counter) if gene_placeholders is True else gene_counter)
         stranded_locus.loci[locus].logger = logger
         stranded_locus.loci[locus].id = new_id
+        if gene_placeholders is True:
+            for transcript in stranded_locus.loci[locus].transcripts.values():
+                transcript.name = transcript.id
 
     locus_lines = stranded_locus.__str__(
         print_cds=not json_conf["pick"]["run_options"]["exclude_cds"],
@@ -323,71 +174,6 @@ def print_locus(stranded_locus,
     return gene_counter
 
 
-def merge_loci(num_temp, out_handles, prefix="", tempdir="mikado_pick_tmp"):
-
-    """ Function to merge the temporary loci files into single output files,
-      renaming the genes according to the preferred style.
-    :param num_temp: number of temporary files.
-    :param out_handles: The names of the output loci files.
-    :param prefix: Prefix to use for the gene names.
-    :param tempdir: Temporary directory where the temporary files are located.
-    :return:
-    """
-
-    metrics_handle, scores_handle, gff_handle = out_handles
-
-    gff_filenames = [os.path.join(tempdir,
-                                  "{0}-{1}".format(os.path.basename(gff_handle),
-                                                   _))
-                     for _ in range(1, num_temp + 1)]
-
-    gid_to_new, tid_to_new = merge_loci_gff(gff_filenames, gff_handle, prefix)
-
-    for handle in metrics_handle, scores_handle:
-        filenames = [os.path.join(tempdir,
-                                  "{0}-{1}".format(os.path.basename(handle), _))
-                     for _ in range(1, num_temp + 1)]
-        handle = open(handle, "a")
-        current_lines = collections.defaultdict(list)
-        filenames = [open(_) for _ in filenames]
-        finished = set()
-        while len(finished) < len(filenames):
-            for num, _ in enumerate(filenames):
-                if _.name in finished:
-                    continue
-                else:
-                    try:
-                        line = next(_)
-                        fields = line.split("/")
-                        current_lines[int(fields[0])].append((num, "/".join(fields[1:])))
-                    except StopIteration:
-                        _.close()
-                        finished.add(_.name)
-
-        # Parsing scores and metrics
-        for current_index in sorted(current_lines.keys()):
-            # current = min(current_lines.keys())
-            for index, line in current_lines[current_index]:
-                fields = line.split("\t")
-                tid, gid = fields[:2]
-                if (index, gid) not in gid_to_new:
-                    raise KeyError("GID {} not found in {}!".format(
-                        (index, gid), handle.name))
-                if (index, tid) not in tid_to_new:
-                    raise KeyError("TID {} not found in {}!".format(
-                        (index, tid), handle.name))
-
-                fields[0] = tid_to_new[(index, tid)]
-                fields[1] = gid_to_new[(index, gid)]
-                line = "\t".join(fields)
-                print(line, file=handle, end="")
-            # del current_lines[current]
-        [_.close() for _ in filenames]
-        [os.remove(_) for _ in finished]
-        handle.close()
-    return
-
-
 def remove_fragments(stranded_loci, json_conf, logger):
 
     """This method checks which loci are possible fragments, according to the
@@ -430,12 +216,26 @@ def remove_fragments(stranded_loci, json_conf, logger):
         loci_to_check[True] = set()
 
     comparisons = collections.defaultdict(list)
-    # Produce a list of duples
 
-    for locus_to_check, gene in product(loci_to_check[True], loci_to_check[False]):
-        is_to_be_filtered, comparison = gene.other_is_fragment(locus_to_check)
-        if is_to_be_filtered is True:
-            comparisons[locus_to_check.id].append(comparison)
+    # Only the genes within the maximum distance of a putative fragment can be valid matches:
+    # index them by the coordinates of their primary transcripts, which are those compared.
+    max_distance = int(json_conf["pick"]["fragments"]["max_distance"])
+    genes = IntervalTree()
+    for gene in loci_to_check[False]:
+        genes.insert(gene.primary_transcript.start, gene.primary_transcript.end, gene)
+
+    # Cache of the comparisons, indexed by the primary transcripts of the two loci
+    cache = dict()
+    for locus_to_check in loci_to_check[True]:
+        start, end = locus_to_check.primary_transcript.start, locus_to_check.primary_transcript.end
+        for gene in genes.find(start - max_distance, end + max_distance):
+            key = (gene.primary_transcript_id, locus_to_check.primary_transcript_id)
+            if key not in cache:
+                cache[key] = gene.other_is_fragment(locus_to_check)
+            is_to_be_filtered, comparison = cache[key]
+            if is_to_be_filtered is True:
+                comparisons[locus_to_check.id].append(comparison)
+    profiling.count("fragment_comparisons", len(cache))
 
     for locus in comparisons:
         if json_conf["pick"]["fragments"]["remove"] is True:
@@ -503,17 +303,127 @@ def analyse_locus(slocus: Superlocus,
         else:
             return []
 
-    handler = logging_handlers.QueueHandler(logging_queue)
-    logger = logging.getLogger("{0}:{1}-{2}".format(
-        slocus.chrom, slocus.start, slocus.end))
-    logger.addHandler(handler)
+    start, transcripts = _clock(), len(slocus.transcripts)
+    logger = _locus_logger(slocus, counter, json_conf, logging_queue)
+    logger.debug("Started with %s, counter %d", slocus.id, counter)
+    stranded_loci = prepare_locus(slocus, json_conf, logger, engine=engine, data_dict=data_dict)
+    if stranded_loci is None:
+        # printer_dict[counter] = []
+        _record_locus(slocus, counter, transcripts, [], start)
+        flush_locus_logger()
+        if printer_queue:
+            while printer_queue.qsize >= json_conf["pick"]["run_options"]["procs"] * 10:
+                continue
+            # printer_queue.put_nowait(([], counter))
+            return
+        else:
+            return []
+
+    if slocus.regressor is not None:
+        score_subloci(stranded_loci, logger)
+    stranded_loci = _finalise_locus(slocus, counter, stranded_loci, json_conf, printer_queue, logger)
+    _record_locus(slocus, counter, transcripts, stranded_loci, start)
+    return stranded_loci
+
+
+def _clock():
+    """Private function to retrieve the current wall-clock and CPU times, to profile a superlocus.
+    It returns None if profiling is disabled."""
+
+    if profiling.active() is None:
+        return None
+    return time.perf_counter(), time.process_time()
 
+
+def _record_locus(slocus, counter, transcripts, stranded_loci, start, elapsed=(0, 0)):
+    """Private function to record in the profile the time spent on a superlocus, since the start
+    (as returned by _clock) plus any time previously elapsed."""
+
+    profile = profiling.active()
+    if profile is None or start is None:
+        return
+    wall = time.perf_counter() - start[0] + elapsed[0]
+    cpu = time.process_time() - start[1] + elapsed[1]
+    profile.counters["transcripts"] += transcripts
+    profile.record_locus("{0}:{1}-{2}".format(slocus.chrom, slocus.start, slocus.end), counter, wall, cpu,
+                         transcripts=transcripts,
+                         stranded_loci=len(stranded_loci or []),
+                         loci=sum(len(_.loci) for _ in stranded_loci or []),
+                         approximation_level=max([_.approximation_level for _ in stranded_loci or []],
+                                                 default=0))
+
+
+# Logger shared by all the superloci analysed by the process: (logging queue, logger, handler, context)
+_locus_logging = None
+
+
+def _locus_logger(slocus, counter, json_conf, logging_queue):
+    """Private function to retrieve the logger used for the analysis of a superlocus.
+    A single logger is used for all the superloci analysed by a process, rather than one per
+    superlocus: the superlocus is carried in the context of the logger, and the records are sent
+    to the logging queue in batches.
+    :returns: the logger
+    """
+
+    global _locus_logging
+    if _locus_logging is None or _locus_logging[0] is not logging_queue:
+        flush_locus_logger()
+        logger = logging.getLogger("superlocus")
+        for handler in logger.handlers[:]:
+            logger.removeHandler(handler)
+            handler.close()
+        for context in logger.filters[:]:
+            logger.removeFilter(context)
+        handler, context = log_utils.BatchQueueHandler(logging_queue), log_utils.LocusContext()
+        logger.addHandler(handler)
+        logger.addFilter(context)
+        logger.propagate = False
+        _locus_logging = (logging_queue, logger, handler, context)
+
+    _, logger, handler, context = _locus_logging
     # We need to set this to the lowest possible level,
     # otherwise we overwrite the global configuration
     logger.setLevel(json_conf["log_settings"]["log_level"])
-    logger.propagate = False
-    logger.debug("Started with %s, counter %d",
-                 slocus.id, counter)
+    locus = "{0}:{1}-{2}".format(slocus.chrom, slocus.start, slocus.end)
+    if context.locus != locus:
+        handler.flush()
+        context.locus = locus
+    context.counter = counter
+    return logger
+
+
+def flush_locus_logger():
+    """Function to send to the logging queue the records of the analysis of the superloci still waiting."""
+
+    if _locus_logging is not None:
+        _locus_logging[2].flush()
+
+
+def prepare_locus(slocus: Superlocus, json_conf: dict, logger, engine=None, data_dict=None):
+
+    """
+    This function loads the data of a superlocus and splits it into its stranded components.
+    If the loci are scored with a model, the subloci of each stranded locus are defined as well,
+    so that their transcripts can be scored together with those of other loci.
+
+    :param slocus: a superlocus instance
+    :type slocus: Mikado.loci_objects.superlocus.Superlocus
+
+    :param json_conf: the configuration dictionary
+    :type json_conf: dict
+
+    :param logger: the logger of the superlocus.
+
+    :param engine: an optional engine to connect to the database.
+    :type data_dict: sqlalchemy.engine.engine
+
+    :param data_dict: a dictionary of preloaded data
+    :type data_dict: (None|dict)
+
+    :returns: the sorted list of stranded loci, or None if no transcript passed the checks.
+    :rtype: (None|list)
+    """
+
     if slocus.stranded is True:
         logger.warn("%s is stranded already! Resetting",
                     slocus.id)
@@ -523,8 +433,9 @@ def analyse_locus(slocus: Superlocus,
     slocus.source = json_conf["pick"]["output_format"]["source"]
 
     try:
-        slocus.load_all_transcript_data(engine=engine,
-                                        data_dict=data_dict)
+        with profiling.stage("load_data"):
+            slocus.load_all_transcript_data(engine=engine,
+                                            data_dict=data_dict)
     except KeyboardInterrupt:
         raise
     except Exception as exc:
@@ -539,14 +450,7 @@ def analyse_locus(slocus: Superlocus,
         logger.warning(
             "%s had all transcripts failing checks, ignoring it",
             slocus.id)
-        # printer_dict[counter] = []
-        if printer_queue:
-            while printer_queue.qsize >= json_conf["pick"]["run_options"]["procs"] * 10:
-                continue
-            # printer_queue.put_nowait(([], counter))
-            return
-        else:
-            return []
+        return None
 
     # Split the superlocus in the stranded components
     logger.debug("Splitting by strand")
@@ -556,6 +460,52 @@ def analyse_locus(slocus: Superlocus,
 
     for stranded_locus in stranded_loci:
         stranded_locus.logger = logger
+        if stranded_locus.regressor is None:
+            continue
+        try:
+            stranded_locus.define_subloci()
+        except KeyboardInterrupt:
+            raise
+        except OSError:
+            raise
+        except Exception as exc:
+            # The error will be raised again, and handled, when defining the loci
+            logger.debug("Failed to define the subloci of %s: %s", stranded_locus.id, exc)
+        # The loci might be defined only after other superloci have been analysed (see
+        # LociProcesser.__analyse_scored_window): that time must not be charged to this one
+        stranded_locus.budget.pause()
+    return stranded_loci
+
+
+@profiling.profiled("score")
+def score_subloci(stranded_loci, logger):
+    """
+    This function scores with a single call to the scoring model all the subloci
+    of a group of stranded loci, which must have been prepared with prepare_locus.
+
+    :param stranded_loci: the stranded loci.
+    :type stranded_loci: list
+
+    :param logger: a logger instance.
+    """
+
+    subloci = [sublocus for stranded_locus in stranded_loci for sublocus in stranded_locus.subloci]
+    try:
+        Abstractlocus.calculate_batch_scores(subloci)
+    except KeyboardInterrupt:
+        raise
+    except Exception as exc:
+        # Each sublocus will be scored independently
+        logger.error("Error while scoring %d subloci in batch", len(subloci))
+        logger.exception(exc)
+
+
+def _finalise_locus(slocus, counter, stranded_loci, json_conf, printer_queue, logger):
+    """Private function to define the loci of each stranded locus and to remove the fragments."""
+
+    for stranded_locus in stranded_loci:
+        stranded_locus.logger = logger
+        stranded_locus.budget.resume()
         try:
             stranded_locus.define_loci()
         except KeyboardInterrupt:
@@ -573,14 +523,13 @@ def analyse_locus(slocus: Superlocus,
                      stranded_locus.strand)
 
     # Check if any locus is a fragment, if so, tag/remove it
-    stranded_loci = sorted(list(remove_fragments(stranded_loci, json_conf, logger)))
-    try:
-        logger.debug("Size of the loci to send: {0}, for {1} loci".format(
-            sys.getsizeof(stranded_loci),
-            len(stranded_loci)))
-    except Exception as err:
-        logger.error(err)
-        pass
+    with profiling.stage("remove_fragments"):
+        stranded_loci = sorted(list(remove_fragments(stranded_loci, json_conf, logger)))
+    # The comparisons between the transcripts of the superlocus will not be needed any more
+    comparison_cache.clear()
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Size of the loci to send: %d, for %d loci",
+                     sys.getsizeof(stranded_loci), len(stranded_loci))
     # printer_dict[counter] = stranded_loci
     if printer_queue:
         while printer_queue.qsize() >= json_conf["pick"]["run_options"]["procs"] * 10:
@@ -588,20 +537,18 @@ def analyse_locus(slocus: Superlocus,
         # printer_queue.put_nowait((stranded_loci, counter))
         # printer_queue.put((stranded_loci, counter))
         logger.debug("Finished with %s, counter %d", slocus.id, counter)
-        logger.removeHandler(handler)
-        handler.close()
+        flush_locus_logger()
         return
     else:
         logger.debug("Finished with %s, counter %d", slocus.id, counter)
-        logger.removeHandler(handler)
-        handler.close()
+        flush_locus_logger()
         return stranded_loci
 
 
 class LociProcesser(Process):
 
     """This process class takes care of getting from the queue the loci,
-    analyse them, and print them to the output files."""
+    analyse them, and send their output to the writer process."""
 
     def __init__(self,
                  json_conf,
@@ -610,7 +557,7 @@ class LociProcesser(Process):
                  locus_queue,
                  logging_queue,
                  identifier,
-                 tempdir="mikado_pick_tmp"
+                 results_queue
                  ):
 
         # current_counter, gene_counter, current_chrom = shared_values
@@ -618,25 +565,31 @@ class LociProcesser(Process):
         self.logging_queue = logging_queue
         self.__identifier = identifier  # Property directly unsettable
         self.name = "LociProcesser-{0}".format(self.identifier)
-        self.json_conf = json_conf
+        self.regressor = None
+        if isinstance(json_conf, str):
+            # Handle to the configuration and scoring model published by the parent process
+            self._shared_handle = json_conf
+            self.json_conf, self.regressor = shared_store.attach(self._shared_handle)
+        else:
+            self._shared_handle = None
+            self.json_conf = json_conf
         self.handler = logging_handlers.QueueHandler(self.logging_queue)
         self.logger = logging.getLogger(self.name)
         self.logger.addHandler(self.handler)
         self.logger.setLevel(self.json_conf["log_settings"]["log_level"])
         self.logger.propagate = False
-        self._tempdir = tempdir
 
         self.__data_dict = data_dict
         self.locus_queue = locus_queue
+        self.results_queue = results_queue
         # self.lock = lock
         self.__output_files = output_files
         self.locus_metrics, self.locus_scores, self.locus_out = [None] * 3
         self.sub_metrics, self.sub_scores, self.sub_out = [None] * 3
         self.mono_metrics, self.mono_scores, self.mono_out = [None] * 3
         self._handles = []
-        self.regressor = None
 
-        if self.json_conf["pick"]["scoring_file"].endswith((".pickle", ".model")):
+        if self.regressor is None and self.json_conf["pick"]["scoring_file"].endswith((".pickle", ".model")):
             with open(self.json_conf["pick"]["scoring_file"], "rb") as forest:
                 self.regressor = pickle.load(forest)
             from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
@@ -647,7 +600,6 @@ class LociProcesser(Process):
                 self.join()
 
         self._create_handles(self.__output_files)
-        self.__gene_counter = 0
         assert len(self._handles) > 0
 
         self.logger.debug("Starting Process %s", self.name)
@@ -671,6 +623,17 @@ class LociProcesser(Process):
                                                data_dict=self.__data_dict,
                                                engine=self.engine,
                                                logging_queue=self.logging_queue)
+        self.__create_prefetcher()
+
+    def __create_prefetcher(self):
+        """Private method to create the object used to retrieve the data of a window of superloci
+        with bulk queries, when the data has not been preloaded."""
+
+        self._window = self.json_conf["pick"]["run_options"]["prefetch_window"]
+        if self.engine is not None and self._window > 0:
+            self.prefetcher = Prefetcher(self.engine, self.json_conf, logger=self.logger)
+        else:
+            self.prefetcher = None
 
     @property
     def identifier(self):
@@ -701,6 +664,9 @@ class LociProcesser(Process):
 
         state["engine"] = None
         state["analyse_locus"] = None
+        state["prefetcher"] = None
+        if state["_shared_handle"] is not None:
+            state["json_conf"] = state["regressor"] = None
         del state["handler"]
         del state["logger"]
         return state
@@ -731,6 +697,8 @@ class LociProcesser(Process):
     def __setstate__(self, state):
 
         self.__dict__.update(state)
+        if self._shared_handle is not None:
+            self.json_conf, self.regressor = shared_store.attach(self._shared_handle)
         self.handler = logging_handlers.QueueHandler(self.logging_queue)
         self.logger = logging.getLogger(self.name)
         self.logger.addHandler(self.handler)
@@ -748,10 +716,12 @@ class LociProcesser(Process):
                                                data_dict=self.__data_dict,
                                                engine=self.engine,
                                                logging_queue=self.logging_queue)
+        self.__create_prefetcher()
 
     def __create_step_handles(self, handles, metrics, score_keys):
 
         """Private method to create the handles for a given step (eg Locus).
+        The output of each superlocus is kept in memory, until it is sent to the writer process.
 
         :param handles: the list with the filename prefixes
         :type handles: [list|tuple]
@@ -767,14 +737,8 @@ class LociProcesser(Process):
         :rtype: list
         """
 
-        (locus_metrics_file,
-         locus_scores_file,
-         locus_out_file) = [os.path.join(self._tempdir,
-                                         "{0}-{1}".format(os.path.basename(_),
-                                                          self.identifier))
-                            for _ in handles]
-        locus_metrics_handle = open(locus_metrics_file, "a")
-        locus_scores_handle = open(locus_scores_file, "a")
+        locus_metrics_handle = io.StringIO(newline=None)
+        locus_scores_handle = io.StringIO(newline=None)
         locus_metrics = csv.DictWriter(
             locus_metrics_handle,
             metrics,
@@ -790,7 +754,7 @@ class LociProcesser(Process):
         locus_scores.closed = locus_scores.handle.closed
         locus_scores.flush = locus_scores.handle.flush
 
-        locus_out = open(locus_out_file, 'w')
+        locus_out = io.StringIO(newline=None)
 
         return [locus_metrics, locus_scores, locus_out]
 
@@ -815,6 +779,8 @@ class LociProcesser(Process):
         metrics = Superlocus.available_metrics[3:]
         metrics.extend(["external.{}".format(_.source) for _ in session.query(ExternalSource.source).all()])
         metrics = Superlocus.available_metrics[:3] + sorted(metrics)
+        if budget.enabled(self.json_conf):
+            metrics.append("budget_degradation")
 
         self.locus_metrics, self.locus_scores, self.locus_out = self.__create_step_handles(
             handles[0], metrics, score_keys)
@@ -846,33 +812,174 @@ class LociProcesser(Process):
         # self.terminate()
         super().join(timeout=timeout)
 
+    def _analyse_and_print(self, slocus, counter, data_dict=None):
+        """Private method to analyse a single superlocus and print its results.
+        Data retrieved for the window of the superlocus can be provided through data_dict."""
+
+        if slocus is not None:
+            if self.regressor is not None:
+                slocus.regressor = self.regressor
+            if data_dict is None:
+                stranded_loci = self.analyse_locus(slocus, counter)
+            else:
+                stranded_loci = self.analyse_locus(slocus, counter, data_dict=data_dict)
+        else:
+            stranded_loci = []
+        self.__print_loci(slocus, counter, stranded_loci)
+
+    def __print_loci(self, slocus, counter, stranded_loci):
+        """Private method to print the loci derived from a superlocus. The output is kept
+        until it is sent to the writer process."""
+
+        genes, chrom = 0, None
+        for stranded_locus in stranded_loci:
+            printed = print_locus(stranded_locus, genes, self._handles,
+                                  logger=self.logger, json_conf=self.json_conf, gene_placeholders=True)
+            if printed > genes:
+                genes, chrom = printed, stranded_locus.chrom
+
+        output = []
+        for group in self._handles:
+            for handle in group:
+                if handle is None:
+                    output.append(None)
+                    continue
+                handle = getattr(handle, "handle", handle)
+                output.append(handle.getvalue())
+                handle.seek(0)
+                handle.truncate()
+
+        self.__results.append((chrom, genes, output))
+
+    def __send_results(self, index, done=True):
+        """Private method to send the output of the analysed superloci to the writer process,
+        together with the position of the corresponding item of the locus queue."""
+
+        results, self.__results = self.__results, []
+        self.results_queue.put((index, results, done))
+
+    def __analyse_scored_window(self, window, data_dict=None):
+        """Private method to analyse a window of superloci whose transcripts are scored with a model.
+        The subloci of all the superloci in the window are scored together, with a single prediction,
+        before the loci are defined."""
+
+        if data_dict is None:
+            data_dict = self.__data_dict
+        prepared = []
+        for slocus, counter in window:
+            if slocus is None:
+                prepared.append((slocus, counter, None, 0, None))
+                continue
+            start, transcripts = _clock(), len(slocus.transcripts)
+            slocus.regressor = self.regressor
+            logger = _locus_logger(slocus, counter, self.json_conf, self.logging_queue)
+            logger.debug("Started with %s, counter %d", slocus.id, counter)
+            stranded_loci = prepare_locus(slocus, self.json_conf, logger,
+                                          engine=self.engine, data_dict=data_dict)
+            elapsed = None
+            if start is not None:
+                # The time spent scoring the whole window is not attributed to the single superloci
+                elapsed = (time.perf_counter() - start[0], time.process_time() - start[1])
+            prepared.append((slocus, counter, stranded_loci, transcripts, elapsed))
+
+        score_subloci([stranded_locus for item in prepared if item[2]
+                       for stranded_locus in item[2]], self.logger)
+
+        for slocus, counter, stranded_loci, transcripts, elapsed in prepared:
+            start = _clock()
+            if stranded_loci is None:
+                stranded_loci = []
+            else:
+                logger = _locus_logger(slocus, counter, self.json_conf, self.logging_queue)
+                stranded_loci = _finalise_locus(slocus, counter, stranded_loci, self.json_conf,
+                                                None, logger)
+            if elapsed is not None:
+                _record_locus(slocus, counter, transcripts, stranded_loci, start, elapsed=elapsed)
+            self.__print_loci(slocus, counter, stranded_loci)
+        flush_locus_logger()
+
+    def _analyse_window(self, window):
+        """Private method to analyse a window of superloci, retrieving their data from the database
+        with bulk queries. The data is discarded once the window has been analysed."""
+
+        data_dict = None
+        if self.prefetcher is not None:
+            superloci = [slocus for slocus, _ in window if slocus is not None]
+            if superloci:
+                try:
+                    with profiling.stage("load_data"):
+                        data_dict = self.prefetcher.fetch(superloci)
+                except KeyboardInterrupt:
+                    raise
+                except Exception as exc:
+                    # Fall back to the per-superlocus retrieval
+                    self.logger.error("Error while retrieving data for %s:%d-%d",
+                                      superloci[0].chrom, superloci[0].start, superloci[-1].end)
+                    self.logger.exception(exc)
+        if self.regressor is not None and len(window) > 1:
+            self.__analyse_scored_window(window, data_dict=data_dict)
+        else:
+            for slocus, counter in window:
+                self._analyse_and_print(slocus, counter, data_dict=data_dict)
+        del data_dict
+
+    def __fill_window(self, window):
+        """Private method to add to a window the superloci already waiting in the queue, as long
+        as they fit into it. It returns the first item which could not be added, if any."""
+
+        while self.prefetcher is not None:
+            try:
+                slocus, counter = self.locus_queue.get_nowait()
+            except queue.Empty:
+                return None
+            if isinstance(slocus, PackedSuperlocus):
+                slocus = unpack_superlocus(slocus, self.json_conf)
+            if not isinstance(slocus, Superlocus) or not in_window(window, slocus, self._window):
+                return slocus, counter
+            window.append((slocus, counter))
+        return None
+
     def run(self):
-        """Start polling the queue, analyse the loci, and send them to the printer process."""
+        """Start polling the queue, analyse the loci, and send them to the writer process."""
         self.logger.debug("Starting to parse data for {0}".format(self.name))
-        current_chrom = None
+        if self.json_conf["pick"]["files"]["profile_out"]:
+            profiling.enable(self.name, slow_loci=self.json_conf["pick"]["run_options"]["slow_loci"])
+        comparison_cache.configure(self.json_conf["pick"]["run_options"]["comparison_cache"])
+        self.__results = []
+        pending = None
         while True:
-            slocus, counter = self.locus_queue.get()
+            if pending is not None:
+                (slocus, counter), pending = pending, None
+            else:
+                slocus, counter = self.locus_queue.get()
             if slocus == "EXIT":
                 self.logger.debug("EXIT received for %s", self.name)
                 self.locus_queue.put((slocus, counter))
+                flush_locus_logger()
+                profile = profiling.disable()
+                if profile is not None:
+                    self.results_queue.put(("PROFILE", profile.to_dict(), True))
                 self.__close_handles()
                 break
                 # self.join()
+            elif isinstance(slocus, Shard):
+                self.logger.debug("Parsing shard %s:%d-%d", slocus.chrom, slocus.start, slocus.end)
+                superloci = shard_superloci(slocus, self.json_conf, logger=self.logger)
+                for window in windows(profiling.timed("parse_input", superloci), self._window):
+                    self._analyse_window(window)
+                    self.__send_results(counter, done=False)
+                self.__send_results(counter)
             else:
+                if isinstance(slocus, PackedSuperlocus):
+                    slocus = unpack_superlocus(slocus, self.json_conf)
+                window = [(slocus, counter)]
                 if slocus is not None:
-                    if current_chrom != slocus.chrom:
-                        self.__gene_counter = 0
-                        current_chrom = slocus.chrom
-                    if self.regressor is not None:
-                        slocus.regressor = self.regressor
-                    stranded_loci = self.analyse_locus(slocus, counter)
-                else:
-                    stranded_loci = []
-
-                for stranded_locus in stranded_loci:
-                    self.__gene_counter = print_locus(
-                        stranded_locus, self.__gene_counter, self._handles,
-                        counter=counter, logger=self.logger, json_conf=self.json_conf)
+                    pending = self.__fill_window(window)
+                self._analyse_window(window)
+                # Each superlocus of the window is a separate item of the locus queue
+                assert len(window) == len(self.__results)
+                for (_, index), result in zip(window, self.__results):
+                    self.results_queue.put((index, [result], True))
+                self.__results = []
 
         return
-
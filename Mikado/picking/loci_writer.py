@@ -0,0 +1,222 @@
+# coding: utf-8
+
+"""
+This module implements the process which writes the output of Mikado pick when using
+multiple processes. The LociProcesser workers send the output of each superlocus to this process,
+which puts it back into the order of the input, assigns the final names to the genes and
+writes it directly into the output files. The number of items of the locus queue which have been
+submitted but not written yet is limited, so that the memory used to reorder the output is bounded.
+"""
+
+import logging
+import logging.handlers as logging_handlers
+import time
+from multiprocessing import Process
+from .loci_processer import renumber_genes
+from ..utilities import profiling
+
+__author__ = 'Luca Venturini'
+
+
+# Minimum interval, in seconds, between two checkpoints of the journal
+_checkpoint_interval = 10
+
+
+class SlotQueue:
+
+    """
+    Wrapper around the locus queue, used by the main process to submit the items to the workers.
+    An item can be submitted only when a slot is available; slots are released by the writer process
+    as soon as the output of an item has been written.
+    """
+
+    def __init__(self, locus_queue, slots, processes, logger, skip=0):
+        """
+        :param locus_queue: the queue used to send the items to the workers.
+        :type locus_queue: multiprocessing.Queue
+
+        :param slots: the semaphore which counts the available slots.
+        :type slots: multiprocessing.Semaphore
+
+        :param processes: the workers and the writer. If any of them dies, the number of items
+        will not be limited any more, so that the main process will not wait indefinitely.
+        :type processes: list
+
+        :param logger: the logger.
+
+        :param skip: number of items which have been analysed in a previous run, and will be discarded.
+        :type skip: int
+        """
+
+        self.locus_queue = locus_queue
+        self.slots = slots
+        self.processes = processes
+        self.logger = logger
+        self.skip = skip
+        self.items = 0
+
+    def put(self, item):
+        """Method to submit an item, waiting for a slot to become available."""
+
+        self.items = item[1]
+        if self.items <= self.skip:
+            return
+        with profiling.stage("submit"):
+            while self.slots is not None and not self.slots.acquire(timeout=1):
+                dead = [process.name for process in self.processes if not process.is_alive()]
+                if dead:
+                    self.logger.error("Processes %s terminated unexpectedly; the output might be incomplete",
+                                      ", ".join(dead))
+                    self.slots = None
+            self.locus_queue.put(item)
+
+
+class LociWriter(Process):
+
+    """
+    Process which receives the output of the superloci from the workers and writes it, in order,
+    into the output files.
+    """
+
+    def __init__(self, output_files, results_queue, slots, logging_queue, log_level="WARNING",
+                 journal=None, checkpoint=None, profile_out=None,
+                 slow_loci=profiling.default_slow_loci):
+        """
+        :param output_files: the names of the output files, grouped as the handles of the Picker
+        (loci, subloci and monoloci; each group with metrics, scores and GFF files).
+        Groups of disabled outputs contain only None values.
+        :type output_files: list
+
+        :param results_queue: the queue used by the workers to send the output of the superloci.
+        Each item is a tuple (index, results, done), where index is the position of the corresponding
+        item of the locus queue (starting from 1) and done indicates whether it has been completed.
+        The last item must be ("EXIT", total, True), where total is the number of items of the locus queue.
+        Items ("PROFILE", profile, True) carry the profiling data of the other processes.
+
+        :param slots: the semaphore used to limit the number of items submitted but not yet written.
+
+        :param logging_queue: the queue used for logging.
+
+        :param log_level: the log level.
+
+        :param journal: optional journal, to record the progress of the run.
+        :type journal: (Mikado.picking.journal.Journal|None)
+
+        :param checkpoint: optional checkpoint of the journal to resume the run from.
+        :type checkpoint: (dict|None)
+
+        :param profile_out: optional file to write the profiling summary of the run to.
+        :type profile_out: (str|None)
+
+        :param slow_loci: number of slowest superloci to report in the profiling summary.
+        :type slow_loci: int
+        """
+
+        super().__init__()
+        self.name = "LociWriter"
+        self.output_files = output_files
+        self.results_queue = results_queue
+        self.slots = slots
+        self.logging_queue = logging_queue
+        self.log_level = log_level
+        self.journal = journal
+        self.checkpoint = checkpoint
+        self.profile_out = profile_out
+        self.slow_loci = slow_loci
+        self.__handles = []
+        self.__current_chrom = None
+        self.__gene_counter = 0
+
+    @profiling.profiled("write")
+    def __write(self, results):
+        """Private method to write the output of a group of superloci."""
+
+        for chrom, genes, output in results:
+            if chrom is not None and chrom != self.__current_chrom:
+                self.__gene_counter = 0
+                self.__current_chrom = chrom
+            for num, (text, handle) in enumerate(zip(output, self.__handles)):
+                if handle is None or not text:
+                    continue
+                if num < 3:
+                    text = renumber_genes(text, self.__gene_counter)
+                handle.write(text)
+            self.__gene_counter += genes
+
+    def run(self):
+        """Start polling the queue and write the output in the order of the input."""
+
+        handler = logging_handlers.QueueHandler(self.logging_queue)
+        logger = logging.getLogger(self.name)
+        logger.addHandler(handler)
+        logger.setLevel(self.log_level)
+        logger.propagate = False
+        if self.profile_out:
+            profiling.enable(self.name, slow_loci=self.slow_loci)
+
+        self.__handles = [open(name, "a") if name is not None else None
+                          for group in self.output_files for name in group]
+        current = 1
+        if self.checkpoint is not None:
+            current = self.checkpoint["item"] + 1
+            self.__current_chrom, self.__gene_counter = self.checkpoint["chrom"], self.checkpoint["genes"]
+            logger.info("Resuming the output from item %d", current)
+        last_checkpoint = time.time()
+        waiting = dict()
+        written = 0
+        while True:
+            index, results, done = self.results_queue.get()
+            if index == "EXIT":
+                total = results
+                break
+            elif index == "PROFILE":
+                if profiling.active() is not None:
+                    profiling.active().update(results)
+                continue
+            elif index != current:
+                waiting.setdefault(index, [[], False])
+                waiting[index][0].extend(results)
+                waiting[index][1] = done
+                continue
+            self.__write(results)
+            while done is True:
+                written += 1
+                current += 1
+                self.slots.release()
+                if self.journal is not None and time.time() - last_checkpoint >= _checkpoint_interval:
+                    self.journal.checkpoint(current - 1, self.__current_chrom, self.__gene_counter,
+                                            self.__handles)
+                    last_checkpoint = time.time()
+                if current not in waiting:
+                    break
+                results, done = waiting.pop(current)
+                self.__write(results)
+
+        complete = not waiting and (total is None or current > total)
+        if waiting:
+            logger.error("The output of items %d to %d is missing; writing the remaining %d items",
+                         current, min(waiting) - 1, len(waiting))
+            for index in sorted(waiting):
+                self.__write(waiting[index][0])
+                written += 1
+        elif not complete:
+            logger.error("The output of items %d to %d is missing", current, total)
+
+        if self.journal is not None:
+            if complete:
+                self.journal.remove()
+            else:
+                # Items written after a missing one are not recorded, so that they will be analysed again
+                if not waiting:
+                    self.journal.checkpoint(current - 1, self.__current_chrom, self.__gene_counter,
+                                            self.__handles)
+                self.journal.close()
+
+        [_.close() for _ in self.__handles if _ is not None]
+        logger.debug("Written the output of %d items", written)
+        if self.profile_out:
+            profiling.disable().write(self.profile_out)
+            logger.info("Written the profiling summary to %s", self.profile_out)
+        logger.removeHandler(handler)
+        handler.close()
+        return
@@ -0,0 +1,146 @@
+# coding: utf-8
+
+"""
+This module defines the compact representation used to send superloci from the parsing
+process to the LociProcesser workers. Instead of pickling the full Superlocus object (which
+implies deep copies of every transcript and of the configuration), the coordinates of each
+transcript are stored in a flat integer array, with all the strings interned in a shared table.
+The worker rebuilds the Transcript and Superlocus objects using its own copy of the configuration.
+"""
+
+import array
+import collections
+from ..loci.superlocus import Superlocus
+from ..transcripts.transcript import Transcript
+
+__author__ = 'Luca Venturini'
+
+
+PackedSuperlocus = collections.namedtuple("PackedSuperlocus",
+                                          ["strings", "coordinates", "extras"])
+PackedSuperlocus.__doc__ = """Compact representation of a superlocus.
+- strings: table of the strings (IDs, chromosomes, sources, features) used by the transcripts
+- coordinates: flat array of integers, with the string indices and the coordinates of each transcript
+- extras: score and attributes of each transcript"""
+
+_strands = {None: 0, "+": 1, "-": 2}
+_strands_rev = dict((val, key) for key, val in _strands.items())
+
+
+def pack_superlocus(superlocus):
+    """
+    Function to convert a superlocus into its compact representation.
+    Each transcript is stored as a record of integers:
+    - indices of ID, chromosome, source, feature; strand code; start; end
+    - flags (finalized, has_start_codon, has_stop_codon)
+    - number of parents, followed by their indices
+    - number of exons, CDS segments (with their phases, -1 if absent) and UTR segments, followed
+    by their coordinates.
+
+    :param superlocus: the superlocus to pack.
+    :type superlocus: Superlocus
+
+    :rtype: PackedSuperlocus
+    """
+
+    table = dict()
+    strings = []
+
+    def index(string):
+        if string not in table:
+            table[string] = len(strings)
+            strings.append(string)
+        return table[string]
+
+    coordinates = array.array("q", [index(superlocus.source), int(superlocus.stranded),
+                                    len(superlocus.transcripts)])
+    extras = []
+
+    for transcript in superlocus.transcripts.values():
+        phases = transcript.phases
+        record = [index(transcript.id), index(transcript.chrom), index(transcript.source),
+                  index(transcript.feature), _strands[transcript.strand],
+                  transcript.start, transcript.end,
+                  int(transcript.finalized) | int(transcript.has_start_codon) << 1 |
+                  int(transcript.has_stop_codon) << 2,
+                  len(transcript.parent)]
+        record.extend(index(_) for _ in transcript.parent)
+        record.extend((len(transcript.exons), len(transcript.combined_cds), len(transcript.combined_utr)))
+        for exon in transcript.exons:
+            record.extend(exon[:2])
+        for segment in transcript.combined_cds:
+            phase = phases.get(tuple(segment[:2]), None)
+            record.extend((segment[0], segment[1], -1 if phase is None else phase))
+        for segment in transcript.combined_utr:
+            record.extend(segment[:2])
+        coordinates.extend(record)
+        extras.append((transcript.score, transcript.attributes))
+
+    return PackedSuperlocus(tuple(strings), coordinates, extras)
+
+
+def unpack_superlocus(packed, json_conf, logger=None):
+    """
+    Function to rebuild a superlocus from its compact representation.
+
+    :param packed: the compact representation of the superlocus.
+    :type packed: PackedSuperlocus
+
+    :param json_conf: the configuration dictionary.
+    :type json_conf: dict
+
+    :param logger: optional logger for the superlocus.
+
+    :rtype: Superlocus
+    """
+
+    strings, coordinates, extras = packed
+    intron_range = json_conf["pick"]["run_options"]["intron_range"]
+    source, stranded, num_transcripts = coordinates[:3]
+    pos = 3
+    superlocus = None
+
+    for num in range(num_transcripts):
+        (tid, chrom, tsource, feature, strand,
+         start, end, flags, num_parents) = coordinates[pos:pos + 9]
+        pos += 9
+        parents = [strings[_] for _ in coordinates[pos:pos + num_parents]]
+        pos += num_parents
+        num_exons, num_cds, num_utr = coordinates[pos:pos + 3]
+        pos += 3
+
+        transcript = Transcript(intron_range=intron_range)
+        transcript.score, attributes = extras[num]
+        transcript.attributes = attributes.copy()
+        transcript.id = strings[tid]
+        transcript.parent = parents
+        transcript.chrom, transcript.source = strings[chrom], strings[tsource]
+        transcript.feature = strings[feature]
+        transcript.strand = _strands_rev[strand]
+        transcript.start, transcript.end = start, end
+        transcript.has_start_codon = bool(flags & 2)
+        transcript.has_stop_codon = bool(flags & 4)
+
+        transcript.exons = [tuple(coordinates[_:_ + 2]) for _ in range(pos, pos + 2 * num_exons, 2)]
+        pos += 2 * num_exons
+        for cds_start, cds_end, phase in (coordinates[_:_ + 3] for _ in range(pos, pos + 3 * num_cds, 3)):
+            transcript.combined_cds.append((cds_start, cds_end))
+            if phase >= 0:
+                transcript.phases[(cds_start, cds_end)] = phase
+        pos += 3 * num_cds
+        transcript.combined_utr = [tuple(coordinates[_:_ + 2]) for _ in range(pos, pos + 2 * num_utr, 2)]
+        pos += 2 * num_utr
+
+        if flags & 1:
+            transcript.finalize()
+
+        if superlocus is None:
+            superlocus = Superlocus(transcript,
+                                    stranded=bool(stranded),
+                                    json_conf=json_conf,
+                                    source=strings[source],
+                                    logger=logger)
+        else:
+            superlocus.add_transcript_to_locus(transcript, check_in_locus=False)
+
+    return superlocus
@@ -15,6 +15,8 @@ import logging
 from logging import handlers as logging_handlers
 import collections
 import functools
+import hashlib
+import json
 import multiprocessing
 from sqlalchemy.engine import create_engine  # SQLAlchemy/DB imports
 from sqlalchemy.orm.session import sessionmaker
@@ -31,9 +33,15 @@ from ..serializers.orf import Orf
 from ..serializers.external import ExternalSource
 from ..loci.superlocus import Superlocus, Transcript
 from ..configuration.configurator import to_json, check_json  # Necessary for nosetests
-from ..utilities import dbutils, merge_partial
+from ..utilities import dbutils, shared_store, profiling, log_utils, budget
+from ..scales import comparison_cache
 from ..exceptions import UnsortedInput, InvalidJson, InvalidTranscript
-from .loci_processer import analyse_locus, LociProcesser, merge_loci, print_locus
+from .loci_processer import analyse_locus, LociProcesser, print_locus, flush_locus_logger
+from .loci_writer import LociWriter, SlotQueue
+from .journal import Journal
+from .shards import index_input, is_compressed
+from .packing import pack_superlocus
+from . import preload_store
 import multiprocessing.managers
 from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
 import pickle
@@ -41,6 +49,10 @@ import warnings
 logging.captureWarnings(True)
 warnings.simplefilter("always")
 
+# Run options which do not change the output, and which can therefore differ when a run is resumed
+_run_only_options = ("procs", "resume", "single_thread", "shm", "shm_db", "shm_shared", "preload",
+                     "prefetch_window", "output_buffer", "slow_loci", "comparison_cache")
+
 # pylint: disable=too-many-instance-attributes
 class Picker:
 
@@ -114,11 +126,6 @@ class Picker:
         elif self.json_conf["pick"]["run_options"]["procs"] == 1:
             self.json_conf["pick"]["run_options"]["single_thread"] = True
 
-        if self.json_conf["pick"]["run_options"]["preload"] is True and self.procs > 1:
-            self.logger.warning(
-                "Preloading using multiple threads can be extremely \
-memory intensive, proceed with caution!")
-
         if self.locus_out is None:
             raise InvalidJson(
                 "No output prefix specified for the final loci. Key: \"loci_out\"")
@@ -216,6 +223,12 @@ memory intensive, proceed with caution!")
         self.locus_out = path_join(
             self.json_conf["pick"]["files"]["output_dir"],
             self.json_conf["pick"]["files"]["loci_out"])
+        if self.json_conf["pick"]["files"]["profile_out"]:
+            self.profile_out = path_join(
+                self.json_conf["pick"]["files"]["output_dir"],
+                self.json_conf["pick"]["files"]["profile_out"])
+        else:
+            self.profile_out = ""
 
         assert self.locus_out != ''
         assert self.locus_out != self.sub_out and self.locus_out != self.monolocus_out
@@ -341,7 +354,8 @@ memory intensive, proceed with caution!")
             )
             session.close()
 
-        self.log_writer = logging_handlers.QueueListener(
+        # The records of the superloci are sent in batches by the workers
+        self.log_writer = log_utils.BatchQueueListener(
             self.logging_queue, self.logger)
         self.log_writer.start()
 
@@ -390,6 +404,8 @@ memory intensive, proceed with caution!")
         metrics = Superlocus.available_metrics[3:]
         metrics.extend(["external.{}".format(_.source) for _ in session.query(ExternalSource.source).all()])
         metrics = Superlocus.available_metrics[:3] + sorted(metrics)
+        if budget.enabled(self.json_conf):
+            metrics.append("budget_degradation")
 
         if self.sub_out != '':
             assert isinstance(self.sub_out, str)
@@ -499,6 +515,8 @@ memory intensive, proceed with caution!")
         metrics = Superlocus.available_metrics[3:]
         metrics.extend(["external.{}".format(_.source) for _ in session.query(ExternalSource.source).all()])
         metrics = Superlocus.available_metrics[:3] + sorted(metrics)
+        if budget.enabled(self.json_conf):
+            metrics.append("budget_degradation")
         session.close()
         engine.dispose()
 
@@ -626,17 +644,17 @@ memory intensive, proceed with caution!")
         This method preloads the data from the DB into a dictionary ("data_dict").
         The information on what to extract and how to connect to the
         DB is retrieved from the json_conf dictionary.
+        The data is written into a memory-mapped store (see preload_store), shared by all the processes;
+        the mappings of the store are returned in place of the dictionaries.
         :return: data_dict
         :rtype: dict
         """
 
         self.main_logger.info("Starting to preload the database into memory")
 
-        # data_dict = self.manager.dict(lock=False)
-        data_dict = dict()
         engine = create_engine("{0}://".format(self.json_conf["db_settings"]["dbtype"]),
                                creator=self.db_connection)
-        dbutils.DBBASE.metadata.create_all(self.engine)
+        dbutils.DBBASE.metadata.create_all(engine)
         session = sqlalchemy.orm.sessionmaker(bind=engine)()
 
         junc_dict = dict()
@@ -644,15 +662,10 @@ memory intensive, proceed with caution!")
             key = (junc.chrom, junc.junction_start, junc.junction_end)
             assert key not in junc_dict
             junc_dict[key] = junc.strand
-        data_dict["junctions"] = junc_dict
-
-        # data_dict["junctions"] = self.manager.dict(data_dict["junctions"], lock=False)
 
-        self.main_logger.info("%d junctions loaded",
-                              len(data_dict["junctions"]))
+        self.main_logger.info("%d junctions loaded", len(junc_dict))
         self.main_logger.debug("Example junctions:\n{0}".format(
-            "\n".join(str(junc) for junc in list(
-                data_dict["junctions"])[:min(10, len(data_dict["junctions"]))])))
+            "\n".join(str(junc) for junc in list(junc_dict)[:min(10, len(junc_dict))])))
 
         queries = dict((que.query_id, que) for que in engine.execute("select * from query"))
 
@@ -666,29 +679,30 @@ memory intensive, proceed with caution!")
                 Orf.as_bed12_static(orf, query_name)
             )
 
-        data_dict["orfs"] = orf_dict
-        assert len(data_dict["orfs"]) == engine.execute(
+        assert len(orf_dict) == engine.execute(
             "select count(distinct(query_id)) from orf").fetchone()[0]
 
-        # data_dict['orf'] = self.manager.dict(orfs, lock=False)
+        self.main_logger.info("%d ORFs loaded", len(orf_dict))
+        self.main_logger.debug(",".join(list(orf_dict.keys())[:10]))
 
-        self.main_logger.info("%d ORFs loaded",
-                              len(data_dict["orfs"]))
-        self.main_logger.debug(",".join(
-            list(data_dict["orfs"].keys())[:10]
-        ))
+        # External scores
+        sources = dict((source.source_id, source.source) for source in
+                       engine.execute("select * from external_sources"))
+        external_dict = collections.defaultdict(dict)
+        for ext in engine.execute("select * from external"):
+            external_dict[queries[ext.query_id].query_name][sources[ext.source_id]] = ext.score
+        self.main_logger.info("External scores loaded for %d queries", len(external_dict))
 
         # Finally load BLAST
+        hits_dict = self.__preload_blast(engine, queries)
+        session.close()
+        engine.dispose()
 
-        # if self.json_conf["pick"]["chimera_split"]["execute"] is True and \
-        #         self.json_conf["pick"]["chimera_split"]["blast_check"] is True:
-        data_dict["hits"] = self.__preload_blast(engine, queries)
-        # else:
-        #     data_dict["hits"] = dict()
-        #     self.main_logger.info("Skipping BLAST loading")
-
-        self.main_logger.info("Finished to preload the database into memory")
-        return data_dict
+        store = preload_store.create_store(junc_dict, orf_dict, hits_dict, external_dict,
+                                           directory=self.json_conf["pick"]["files"]["output_dir"])
+        self.main_logger.info("Finished to preload the database into memory (store: %s, %d bytes)",
+                              store.filename, os.path.getsize(store.filename))
+        return store.data_dict
 
     def _submit_locus(self, slocus, counter, data_dict=None, engine=None):
         """
@@ -706,8 +720,9 @@ memory intensive, proceed with caution!")
             
         self.logger.debug("Loading data for %s", slocus.id)
         slocus.logger = self.logger
-        slocus.load_all_transcript_data(engine=engine,
-                                        data_dict=data_dict)
+        with profiling.stage("load_data"):
+            slocus.load_all_transcript_data(engine=engine,
+                                            data_dict=data_dict)
         # slocus_id = slocus.id
         if slocus.initialized is False:
             # This happens when we have removed all transcripts from the locus
@@ -779,57 +794,106 @@ memory intensive, proceed with caution!")
         if test is False:
             self.__unsorted_interrupt(row, current_transcript)
 
-    def __submit_multi_threading(self, data_dict):
+    def __output_names(self):
+        """
+        Private method to retrieve the names of the output files, grouped as the handles
+        returned by __get_output_files, without creating the files.
+        :return: [[locus metrics, locus scores, loci], [subloci ...], [monoloci ...]]
+        """
 
+        names = []
+        for out in (self.locus_out, self.sub_out, self.monolocus_out):
+            if out:
+                names.append([re.sub("$", ".metrics.tsv", re.sub(".gff.?$", "", out)),
+                              re.sub("$", ".scores.tsv", re.sub(".gff.?$", "", out)),
+                              out])
+            else:
+                names.append([None] * 3)
+        return names
+
+    def __run_fingerprint(self, shards):
+        """
+        Private method to describe the input and the partitioning of the input into items, which must
+        not change for a run to be resumed.
+        :param shards: the list of shards, or None if the input is parsed by the main process.
+        :rtype: dict
         """
-        Method to execute Mikado pick in multi threaded mode.
 
-        :param data_dict: The data dictionary
+        stat = os.stat(self.input_file)
+        db = self.json_conf["db_settings"]["db"]
+        if self.json_conf["db_settings"]["dbtype"] == "sqlite":
+            db = os.path.abspath(db)
+        return {"input": os.path.abspath(self.input_file),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "flank": self.json_conf["pick"]["clustering"]["flank"],
+                "shards": None if shards is None else len(shards),
+                "shard_size": None if shards is None else self.json_conf["pick"]["run_options"]["shard_size"],
+                "outputs": [[os.path.abspath(name) if name is not None else None for name in group]
+                            for group in self.__output_names()],
+                "db": db,
+                "configuration": self.__configuration_digest()}
+
+    def __configuration_digest(self):
+        """
+        Private method to calculate a digest of the configuration which determines the output of the run.
+        Comments, log settings, DB settings and files are left out (the DB and the files are described
+        separately in the fingerprint of the run), together with the run options in _run_only_options.
+        :rtype: str
+        """
+
+        def strip(value):
+            if isinstance(value, dict):
+                return dict((key, strip(val)) for key, val in value.items()
+                            if key not in ("Comment", "SimpleComment"))
+            elif isinstance(value, (set, frozenset)):
+                return sorted((strip(val) for val in value), key=str)
+            elif isinstance(value, (list, tuple)):
+                return [strip(val) for val in value]
+            return value
+
+        conf = strip(self.json_conf)
+        for key in ("filename", "log_settings", "db_settings", "multiprocessing_method"):
+            conf.pop(key, None)
+        conf["pick"].pop("files", None)
+        for key in _run_only_options:
+            conf["pick"]["run_options"].pop(key, None)
+        return hashlib.sha1(json.dumps(conf, sort_keys=True, default=str).encode()).hexdigest()
+
+    def __define_shards(self):
+        """
+        Private method to split the input file into independent regions, to be parsed
+        directly by the worker processes. It returns None if the input cannot be sharded.
+        :return: list of shards, or None
+        """
+
+        if is_compressed(self.input_file):
+            self.logger.warning(
+                "The input file %s is compressed and cannot be split into shards; reverting to serial parsing.",
+                self.input_file)
+            return None
+
+        self.logger.info("Splitting %s into shards", self.input_file)
+        with profiling.stage("index_input"):
+            shards = index_input(self.input_file,
+                                 flank=self.json_conf["pick"]["clustering"]["flank"],
+                                 shard_size=self.json_conf["pick"]["run_options"]["shard_size"],
+                                 logger=self.logger)
+        self.logger.info("Split %s into %d shards", self.input_file, len(shards))
+        return shards
+
+    def __parse_and_queue(self, locus_queue):
+        """
+        Private method to parse the input file in the main process and send each superlocus
+        to the worker processes through the queue.
+        :param locus_queue: the queue used to communicate with the LociProcesser instances.
         :return:
         """
 
         intron_range = self.json_conf["pick"]["run_options"]["intron_range"]
-        self.logger.info("Intron range: %s", intron_range)
-
         current_locus = None
         current_transcript = None
 
-        locus_queue = multiprocessing.Queue(-1)
-
-        handles = list(self.__get_output_files())
-        [_.close() for _ in handles[0]]
-        handles[0] = [_.name for _ in handles[0]]
-
-        if handles[1][0] is not None:
-            [_.close() for _ in handles[1]]
-            handles[1] = [_.name for _ in handles[1]]
-        if handles[2][0] is not None:
-            [_.close() for _ in handles[2]]
-            handles[2] = [_.name for _ in handles[2]]
-
-        tempdirectory = tempfile.TemporaryDirectory(suffix="",
-                                                    prefix="mikado_pick_tmp",
-                                                    dir=self.json_conf["pick"]["files"]["output_dir"])
-        tempdir = tempdirectory.name
-
-        # tempdir = os.path.join(self.json_conf["pick"]["files"]["output_dir"], "mikado_pick_tmp")
-        # os.makedirs(tempdir, exist_ok=True)
-
-        self.logger.info("Creating the worker processes")
-        working_processes = [LociProcesser(self.json_conf,
-                                           data_dict,
-                                           handles,
-                                           locus_queue,
-                                           self.logging_queue,
-                                           _,
-                                           tempdir)
-                             for _ in range(1, self.procs+1)]
-        # Start all processes
-        [_.start() for _ in working_processes]
-        self.logger.info("Started all %d workers", self.procs)
-        # No sense in keeping this data available on the main thread now
-        del data_dict
-
         counter = 0
         invalid = False
         with self.define_input() as input_annotation:
@@ -854,11 +918,12 @@ memory intensive, proceed with caution!")
                         else:
                             if current_locus is not None:
                                 counter += 1
-                                self.logger.debug("Submitting locus # %d (%s), with transcripts:\n%s",
-                                                  counter,
-                                                  None if not current_locus else current_locus.id,
-                                                  ",".join(list(current_locus.transcripts.keys())))
-                                locus_queue.put((current_locus, counter))
+                                if self.logger.isEnabledFor(logging.DEBUG):
+                                    self.logger.debug("Submitting locus # %d (%s), with transcripts:\n%s",
+                                                      counter,
+                                                      None if not current_locus else current_locus.id,
+                                                      ",".join(list(current_locus.transcripts.keys())))
+                                locus_queue.put((pack_superlocus(current_locus), counter))
                             current_locus = Superlocus(
                                 current_transcript,
                                 stranded=False,
@@ -887,7 +952,7 @@ memory intensive, proceed with caution!")
                     counter += 1
                     self.logger.debug("Submitting locus #%d (%s)", counter,
                                       None if not current_locus else current_locus.id)
-                    locus_queue.put((current_locus, counter))
+                    locus_queue.put((pack_superlocus(current_locus), counter))
 
                 current_locus = Superlocus(
                     current_transcript,
@@ -900,43 +965,121 @@ memory intensive, proceed with caution!")
             counter += 1
             self.logger.debug("Submitting locus #%d (%s)", counter,
                               None if not current_locus else current_locus.id)
-            locus_queue.put((current_locus, counter))
+            locus_queue.put((pack_superlocus(current_locus), counter))
 
         self.logger.info("Finished chromosome %s", current_locus.chrom)
 
         counter += 1
-        locus_queue.put((current_locus, counter))
-        self.logger.debug("Submitting locus %s, counter %d, with transcripts:\n%s",
-                          current_locus.id, counter,
-                          ", ".join(list(current_locus.transcripts.keys())))
+        locus_queue.put((pack_superlocus(current_locus), counter))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Submitting locus %s, counter %d, with transcripts:\n%s",
+                              current_locus.id, counter,
+                              ", ".join(list(current_locus.transcripts.keys())))
+
+    def __submit_multi_threading(self, data_dict):
+
+        """
+        Method to execute Mikado pick in multi threaded mode.
+
+        :param data_dict: The data dictionary
+        :return:
+        """
+
+        intron_range = self.json_conf["pick"]["run_options"]["intron_range"]
+        self.logger.info("Intron range: %s", intron_range)
+
+        shards = None
+        if self.json_conf["pick"]["run_options"]["shard_input"] is True:
+            # This has to happen before starting the children, as it checks the sortedness of the input
+            shards = self.__define_shards()
+
+        locus_queue = multiprocessing.Queue(-1)
+
+        journal = Journal(re.sub("$", ".journal", re.sub(".gff.?$", "", self.locus_out)),
+                          self.__run_fingerprint(shards))
+        checkpoint = None
+        if self.json_conf["pick"]["run_options"]["resume"] is True:
+            checkpoint = journal.load(self.__output_names())
+            if checkpoint is None:
+                self.logger.warning("No valid checkpoint found in %s; starting the run from the beginning",
+                                    journal.filename)
+
+        if checkpoint is not None:
+            handles = self.__output_names()
+            journal.restore(checkpoint, handles)
+            self.logger.info("Resuming the run after item %d (chromosome %s)",
+                             checkpoint["item"], checkpoint["chrom"])
+        else:
+            handles = list(self.__get_output_files())
+            [_.close() for _ in handles[0]]
+            handles[0] = [_.name for _ in handles[0]]
+
+            if handles[1][0] is not None:
+                [_.close() for _ in handles[1]]
+                handles[1] = [_.name for _ in handles[1]]
+            if handles[2][0] is not None:
+                [_.close() for _ in handles[2]]
+                handles[2] = [_.name for _ in handles[2]]
+            journal.start(handles)
+
+        tempdirectory = tempfile.TemporaryDirectory(suffix="",
+                                                    prefix="mikado_pick_tmp",
+                                                    dir=self.json_conf["pick"]["files"]["output_dir"])
+        tempdir = tempdirectory.name
+
+        # tempdir = os.path.join(self.json_conf["pick"]["files"]["output_dir"], "mikado_pick_tmp")
+        # os.makedirs(tempdir, exist_ok=True)
+
+        # Publish the configuration and the scoring model once for all the workers
+        shared_handle = shared_store.publish(self.json_conf, self.regressor, directory=tempdir)
+
+        # The output of the workers is written, in order, by a separate process.
+        # The number of items submitted but not written yet is limited by the slots.
+        results_queue = multiprocessing.Queue(-1)
+        slots = multiprocessing.Semaphore(self.json_conf["pick"]["run_options"]["output_buffer"])
+        writer = LociWriter(handles, results_queue, slots, self.logging_queue,
+                            log_level=self.json_conf["log_settings"]["log_level"],
+                            journal=journal, checkpoint=checkpoint,
+                            profile_out=self.profile_out,
+                            slow_loci=self.json_conf["pick"]["run_options"]["slow_loci"])
+
+        self.logger.info("Creating the worker processes")
+        working_processes = [LociProcesser(shared_handle,
+                                           data_dict,
+                                           handles,
+                                           locus_queue,
+                                           self.logging_queue,
+                                           _,
+                                           results_queue)
+                             for _ in range(1, self.procs+1)]
+        # Start all processes
+        writer.start()
+        [_.start() for _ in working_processes]
+        self.logger.info("Started all %d workers", self.procs)
+        # No sense in keeping this data available on the main thread now
+        del data_dict
+
+        submission_queue = SlotQueue(locus_queue, slots, working_processes + [writer], self.logger,
+                                     skip=checkpoint["item"] if checkpoint is not None else 0)
+        if shards is not None:
+            for num, shard in enumerate(shards, 1):
+                submission_queue.put((shard, num))
+        else:
+            with profiling.stage("parse_input"):
+                self.__parse_and_queue(submission_queue)
+
         locus_queue.put(("EXIT", float("inf")))
         self.logger.info("Joining children processes")
-        [_.join() for _ in working_processes]
-        self.logger.info("Joined children processes; starting to merge partial files")
-
-        # Merge loci
-        merge_loci(self.procs,
-                   handles[0],
-                   prefix=self.json_conf["pick"]["output_format"]["id_prefix"],
-                   tempdir=tempdir)
-
-        for handle in handles[1]:
-            if handle is not None:
-                with open(handle, "a") as output:
-                    partials = [os.path.join(tempdir,
-                                             "{0}-{1}".format(os.path.basename(handle), _))
-                                for _ in range(1, self.procs + 1)]
-                    merge_partial(partials, output, logger=self.logger)
-
-        for handle in handles[2]:
-            if handle is not None:
-                with open(handle, "a") as output:
-                    partials = [os.path.join(tempdir,
-                                             "{0}-{1}".format(os.path.basename(handle), _))
-                                for _ in range(1, self.procs + 1)]
-                    merge_partial(partials, output, logger=self.logger)
-
-        self.logger.info("Finished merging partial files")
+        with profiling.stage("wait"):
+            [_.join() for _ in working_processes]
+        profile = profiling.disable()
+        if profile is not None:
+            # The summary is written by the writer process, together with the data of the workers
+            results_queue.put(("PROFILE", profile.to_dict(), True))
+        results_queue.put(("EXIT", submission_queue.items, True))
+        writer.join()
+        self.logger.info("Finished writing the output files")
+        shared_store.release(shared_handle)
         try:
             # shutil.rmtree(tempdir)
             tempdirectory.cleanup()
@@ -968,6 +1111,8 @@ memory intensive, proceed with caution!")
         logger.addHandler(handler)
         logger.setLevel(self.json_conf["log_settings"]["log_level"])
         logger.debug("Begun single-threaded run")
+        if self.json_conf["pick"]["run_options"]["resume"] is True:
+            logger.warning("Runs can be resumed only when using multiple processes; starting from the beginning")
 
         intron_range = self.json_conf["pick"]["run_options"]["intron_range"]
         logger.info("Intron range: %s", intron_range)
@@ -1092,6 +1237,7 @@ memory intensive, proceed with caution!")
                 gene_counter = 0
             gene_counter = locus_printer(stranded_locus, gene_counter)
         # submit_locus(current_locus, counter)
+        flush_locus_logger()
         for group in handles:
             [_.close() for _ in group if _]
         logger.info("Final number of superloci: %d", counter)
@@ -1108,7 +1254,12 @@ memory intensive, proceed with caution!")
         if self.json_conf["pick"]["run_options"]["single_thread"] is False:
             self.__submit_multi_threading(data_dict)
         else:
-            self.__submit_single_threaded(data_dict)
+            with profiling.stage("parse_input"):
+                self.__submit_single_threaded(data_dict)
+            profile = profiling.disable()
+            if profile is not None:
+                profile.write(self.profile_out)
+                self.logger.info("Written the profiling summary to %s", self.profile_out)
         return
 
     def __call__(self):
@@ -1119,10 +1270,14 @@ memory intensive, proceed with caution!")
         # Otherwise it will raise all sorts of mistakes
 
         data_dict = None
+        if self.profile_out:
+            profiling.enable(slow_loci=self.json_conf["pick"]["run_options"]["slow_loci"])
+        comparison_cache.configure(self.json_conf["pick"]["run_options"]["comparison_cache"])
 
         if self.json_conf["pick"]["run_options"]["preload"] is True:
             # Use the preload function to create the data dictionary
-            data_dict = self.preload()
+            with profiling.stage("preload"):
+                data_dict = self.preload()
         # pylint: disable=no-member
         # pylint: enable=no-member
 
@@ -1140,6 +1295,10 @@ memory intensive, proceed with caution!")
             self.logger.error(
                 "The input files were not properly sorted! Please run prepare and retry.")
             sys.exit(1)
+        finally:
+            if data_dict is not None:
+                # Remove the file backing the preloaded data
+                preload_store.release_store(data_dict["junctions"].store.filename)
 
         # list(map(job.get() for job in jobs if job is not None))
         # for job in iter(x for x in jobs if x is not None):
@@ -0,0 +1,211 @@
+# coding: utf-8
+
+"""
+This module implements the batched retrieval of the database data used by Mikado pick when
+the database has not been preloaded. Instead of querying the database for each superlocus,
+the worker processes group consecutive superloci into windows and retrieve the data for all of
+their transcripts (verified junctions, external scores, ORFs and BLAST hits) with a few bulk
+queries. The data is returned in the same format used for the preloaded data, and is kept by the
+worker only until all the superloci of the window have been analysed.
+"""
+
+import collections
+import logging
+from sqlalchemy import select
+from sqlalchemy.sql.expression import and_, or_
+from ..serializers.blast_serializer import Hit, Hsp, Query, Target
+from ..serializers.external import External, ExternalSource
+from ..serializers.junction import Junction, Chrom
+from ..serializers.orf import Orf
+from ..utilities import grouper
+
+__author__ = 'Luca Venturini'
+
+
+# Maximum number of values in each IN clause, to stay below the limits of SQLite
+_chunk_size = 400
+
+
+def in_window(window, superlocus, size):
+    """
+    Function to check whether a superlocus can be added to a window of superloci.
+    A window contains superloci of a single chromosome, spanning at most size bps.
+
+    :param window: list of (superlocus, counter) tuples
+    :type window: list
+
+    :param superlocus: the candidate superlocus.
+
+    :param size: maximum span of the window.
+    :type size: int
+
+    :rtype: bool
+    """
+
+    if not window:
+        return True
+    first = window[0][0]
+    return (superlocus.chrom == first.chrom and
+            max(superlocus.end, first.end) - min(superlocus.start, first.start) <= size)
+
+
+def windows(superloci, size):
+    """
+    Generator which groups an iterable of (superlocus, counter) tuples into windows.
+    :param superloci: iterable of (superlocus, counter) tuples, usually sorted by position.
+
+    :param size: maximum span of each window; if 0, each superlocus will be in a window by itself.
+    :type size: int
+
+    :rtype: list
+    """
+
+    window = []
+    for slocus, counter in superloci:
+        if window and (size == 0 or not in_window(window, slocus, size)):
+            yield window
+            window = []
+        window.append((slocus, counter))
+    if window:
+        yield window
+
+
+class Prefetcher:
+
+    """
+    Class to retrieve in bulk the data necessary to analyse a window of superloci.
+    """
+
+    def __init__(self, engine, json_conf, logger=None):
+        """
+        :param engine: the connection engine.
+        :type engine: sqlalchemy.engine.Engine
+
+        :param json_conf: the configuration dictionary.
+        :type json_conf: dict
+
+        :param logger: optional logger.
+        """
+
+        self.engine = engine
+        self.json_conf = json_conf
+        if logger is None:
+            logger = logging.getLogger("prefetch")
+            logger.addHandler(logging.NullHandler())
+        self.logger = logger
+        self.queries = 0
+
+    def __execute(self, statement):
+        self.queries += 1
+        return self.engine.execute(statement)
+
+    def fetch(self, superloci):
+        """
+        Method to retrieve the data for all the transcripts of a group of superloci.
+
+        :param superloci: the superloci to retrieve the data for.
+        :type superloci: list
+
+        :returns: a data dictionary, with the same structure of the preloaded one.
+        :rtype: dict
+        """
+
+        data_dict = dict()
+        data_dict["junctions"] = self.fetch_junctions(superloci)
+        data_dict["hits"] = collections.defaultdict(list)
+        data_dict["orfs"] = collections.defaultdict(list)
+        data_dict["external"] = collections.defaultdict(dict)
+
+        names = [tid for slocus in superloci for tid in slocus.transcripts]
+        for group in grouper(names, _chunk_size):
+            queries = dict((query.query_id, query) for query in self.__execute(
+                select([Query.__table__]).where(Query.query_name.in_(group))))
+            if not queries:
+                continue
+            self.__fetch_external(queries, data_dict)
+            self.__fetch_orfs(queries, data_dict)
+            self.__fetch_hits(queries, data_dict)
+
+        self.logger.debug("Retrieved the data for %d transcripts in %d superloci (%d queries so far)",
+                          len(names), len(superloci), self.queries)
+        return data_dict
+
+    def fetch_junctions(self, superloci):
+        """
+        Method to retrieve the verified junctions contained in a group of superloci.
+        The regions of overlapping superloci are merged before querying the database.
+
+        :param superloci: the superloci to retrieve the junctions for.
+        :type superloci: list
+
+        :returns: a dictionary (chrom, start, end) => strand
+        :rtype: dict
+        """
+
+        regions = []
+        for chrom, start, end in sorted((_.chrom, _.start, _.end) for _ in superloci):
+            if regions and regions[-1][0] == chrom and regions[-1][2] >= start:
+                regions[-1][2] = max(regions[-1][2], end)
+            else:
+                regions.append([chrom, start, end])
+
+        junctions = dict()
+        table = Junction.__table__.join(Chrom.__table__, Junction.chrom_id == Chrom.chrom_id)
+        for group in grouper(regions, _chunk_size // 3):
+            statement = select([Chrom.name, Junction.junction_start, Junction.junction_end, Junction.strand]
+                               ).select_from(table).where(or_(*[
+                                   and_(Chrom.name == chrom, Junction.junction_start > start,
+                                        Junction.junction_end < end) for chrom, start, end in group]))
+            for junc in self.__execute(statement):
+                junctions[(junc.name, junc.junction_start, junc.junction_end)] = junc.strand
+        return junctions
+
+    def __fetch_external(self, queries, data_dict):
+
+        """Private method to retrieve the external scores of a group of queries."""
+
+        table = External.__table__.join(ExternalSource.__table__,
+                                        External.source_id == ExternalSource.source_id)
+        statement = select([External.query_id, ExternalSource.source, External.score]
+                           ).select_from(table).where(External.query_id.in_(queries.keys()))
+        for ext in self.__execute(statement):
+            data_dict["external"][queries[ext.query_id].query_name][ext.source] = ext.score
+
+    def __fetch_orfs(self, queries, data_dict):
+
+        """Private method to retrieve the ORFs of a group of queries."""
+
+        for orf in self.__execute(select([Orf.__table__]).where(Orf.query_id.in_(queries.keys()))):
+            query_name = queries[orf.query_id].query_name
+            data_dict["orfs"][query_name].append(Orf.as_bed12_static(orf, query_name))
+
+    def __fetch_hits(self, queries, data_dict):
+
+        """Private method to retrieve the BLAST hits of a group of queries, together with their HSPs."""
+
+        blast_params = self.json_conf["pick"]["chimera_split"]["blast_params"]
+        hsps = collections.defaultdict(lambda: collections.defaultdict(list))
+        for hsp in self.__execute(select([Hsp.__table__]).where(and_(
+                Hsp.hsp_evalue <= blast_params["hsp_evalue"],
+                Hsp.query_id.in_(queries.keys())))):
+            hsps[hsp.query_id][hsp.target_id].append(hsp)
+
+        hits = list(self.__execute(select([Hit.__table__]).where(and_(
+            Hit.evalue <= blast_params["evalue"],
+            Hit.hit_number <= blast_params["max_target_seqs"],
+            Hit.query_id.in_(queries.keys()))).order_by(Hit.query_id, Hit.evalue)))
+        if not hits:
+            return
+
+        targets = dict()
+        for group in grouper(set(hit.target_id for hit in hits), _chunk_size):
+            targets.update((target.target_id, target) for target in self.__execute(
+                select([Target.__table__]).where(Target.target_id.in_(group))))
+
+        for hit in hits:
+            query = queries[hit.query_id]
+            data_dict["hits"][query.query_name].append(
+                Hit.as_full_dict_static(hit,
+                                        hsps[hit.query_id][hit.target_id],
+                                        query,
+                                        targets[hit.target_id]))
@@ -0,0 +1,395 @@
+# coding: utf-8
+
+"""
+This module implements the on-disk store used by Mikado pick to share the preloaded
+database data (verified junctions, ORFs, external scores and BLAST hits) among the processes.
+The data is written once by the main process into a single file, organised in columns:
+- junctions are stored as sorted arrays of coordinates, indexed by chromosome;
+- the queries are stored as a sorted array of names, with offset arrays pointing to their
+  ORFs (stored as columns of coordinates, scores and flags), external scores and BLAST hits
+  (stored as a contiguous block of serialised records per query).
+The file is memory-mapped by each process, so that the pages are shared through the OS page cache
+rather than copied into each worker; the data of each transcript is decoded only when requested.
+The mappings exposed by the store behave as the dictionaries previously used for the preloaded data.
+"""
+
+import abc
+import collections.abc
+import mmap
+import os
+import pickle
+import tempfile
+import numpy
+from ..serializers.orf import Orf
+
+__author__ = 'Luca Venturini'
+
+
+_magic = b"MKDPRLD1"
+_header = len(_magic) + 8
+_strands = {None: 0, "+": 1, "-": 2, ".": 3}
+_strands_rev = dict((val, key) for key, val in _strands.items())
+
+# Open stores, indexed by file name, so that each process maps the file only once
+__stores = dict()
+
+
+class _OrfState:
+
+    """Lightweight container with the same attributes of the ORF table rows,
+    used to rebuild the BED12 objects through Orf.as_bed12_static."""
+
+    __slots__ = ["start", "end", "orf_name", "score", "strand", "thick_start", "thick_end",
+                 "phase", "has_start_codon", "has_stop_codon"]
+
+
+def _as_names(names):
+    """Private function to convert a list of strings into a fixed-width byte array."""
+
+    encoded = [_.encode() for _ in names]
+    width = max([len(_) for _ in encoded] + [1])
+    return numpy.array(encoded, dtype="S{}".format(width))
+
+
+def write_store(filename, junctions, orfs, hits, external):
+    """
+    Function to serialise the preloaded data into a store file.
+
+    :param filename: the file to write.
+    :type filename: str
+
+    :param junctions: dictionary of the verified junctions, in the form (chrom, start, end) => strand
+    :type junctions: dict
+
+    :param orfs: dictionary of the ORFs (as BED12 objects) of each query
+    :type orfs: dict
+
+    :param hits: dictionary of the BLAST hits (as dictionaries) of each query
+    :type hits: dict
+
+    :param external: dictionary of the external scores (source => score) of each query
+    :type external: dict
+    """
+
+    columns = collections.OrderedDict()
+    directory = dict()
+
+    # Junctions, sorted by chromosome and coordinates
+    keys = sorted(junctions.keys())
+    chroms = collections.OrderedDict()
+    for pos, key in enumerate(keys):
+        if key[0] not in chroms:
+            chroms[key[0]] = [pos, pos]
+        chroms[key[0]][1] = pos + 1
+    directory["chroms"] = dict((key, tuple(val)) for key, val in chroms.items())
+    columns["junction_start"] = numpy.array([_[1] for _ in keys], dtype=numpy.int64)
+    columns["junction_end"] = numpy.array([_[2] for _ in keys], dtype=numpy.int64)
+    columns["junction_strand"] = numpy.array([_strands[junctions[_]] for _ in keys], dtype=numpy.int8)
+
+    # Queries, sorted by name
+    queries = sorted(set(orfs.keys()) | set(hits.keys()) | set(external.keys()))
+    columns["query_name"] = _as_names(queries)
+
+    orf_offsets, orf_rows = [0], []
+    for query in queries:
+        orf_rows.extend(orfs.get(query, []))
+        orf_offsets.append(len(orf_rows))
+    columns["orf_offset"] = numpy.array(orf_offsets, dtype=numpy.int64)
+    columns["orf_start"] = numpy.array([_.start for _ in orf_rows], dtype=numpy.int64)
+    columns["orf_end"] = numpy.array([_.end for _ in orf_rows], dtype=numpy.int64)
+    columns["orf_thick_start"] = numpy.array([_.thick_start for _ in orf_rows], dtype=numpy.int64)
+    columns["orf_thick_end"] = numpy.array([_.thick_end for _ in orf_rows], dtype=numpy.int64)
+    columns["orf_score"] = numpy.array([numpy.nan if _.score is None else _.score for _ in orf_rows],
+                                       dtype=numpy.float64)
+    columns["orf_strand"] = numpy.array([_strands[_.strand] for _ in orf_rows], dtype=numpy.int8)
+    columns["orf_phase"] = numpy.array([-1 if _.phase is None else _.phase for _ in orf_rows],
+                                       dtype=numpy.int8)
+    columns["orf_flags"] = numpy.array([int(bool(_.has_start_codon)) | int(bool(_.has_stop_codon)) << 1
+                                        for _ in orf_rows], dtype=numpy.int8)
+    columns["orf_name"] = _as_names([str(_.name) for _ in orf_rows])
+
+    sources = sorted(set(source for scores in external.values() for source in scores))
+    directory["sources"] = sources
+    source_index = dict((source, pos) for pos, source in enumerate(sources))
+    external_offsets, external_rows = [0], []
+    for query in queries:
+        external_rows.extend(sorted(external.get(query, dict()).items()))
+        external_offsets.append(len(external_rows))
+    columns["external_offset"] = numpy.array(external_offsets, dtype=numpy.int64)
+    columns["external_source"] = numpy.array([source_index[_[0]] for _ in external_rows],
+                                             dtype=numpy.int32)
+    columns["external_score"] = numpy.array([_[1] for _ in external_rows], dtype=numpy.float64)
+
+    blocks, hit_offsets = [], [0]
+    for query in queries:
+        block = pickle.dumps(hits[query], protocol=pickle.HIGHEST_PROTOCOL) if hits.get(query) else b""
+        blocks.append(block)
+        hit_offsets.append(hit_offsets[-1] + len(block))
+    columns["hit_offset"] = numpy.array(hit_offsets, dtype=numpy.int64)
+    columns["hits"] = numpy.frombuffer(b"".join(blocks), dtype=numpy.uint8)
+
+    with open(filename, "wb") as store:
+        store.write(_magic)
+        store.write(bytes(8))
+        position = _header
+        for name, column in columns.items():
+            padding = -position % 8  # Keep the columns aligned
+            store.write(bytes(padding))
+            position += padding
+            directory[name] = (position, column.dtype.str, len(column))
+            store.write(column.tobytes())
+            position += column.nbytes
+        store.write(pickle.dumps(directory, protocol=pickle.HIGHEST_PROTOCOL))
+        store.seek(len(_magic))
+        store.write(position.to_bytes(8, "little"))
+
+
+class PreloadStore:
+
+    """
+    Read-only view of a store file. The file is memory-mapped, and the columns are accessed
+    as numpy arrays backed directly by the mapping.
+    When pickled, only the name of the file is serialised.
+    """
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        self.__open()
+
+    def __open(self):
+        with open(self.filename, "rb") as handle:
+            self.__mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.__mmap[:len(_magic)] != _magic:
+            raise ValueError("{} is not a valid preload store".format(self.filename))
+        position = int.from_bytes(self.__mmap[len(_magic):_header], "little")
+        directory = pickle.loads(self.__mmap[position:])
+        self.chroms = directory.pop("chroms")
+        self.sources = directory.pop("sources")
+        self.columns = dict()
+        for name, (offset, dtype, length) in directory.items():
+            self.columns[name] = numpy.frombuffer(self.__mmap, dtype=dtype, count=length, offset=offset)
+
+    def __reduce__(self):
+        return open_store, (self.filename,)
+
+    def query_index(self, query):
+        """
+        Method to retrieve the position of a query in the store.
+        :param query: the name of the query.
+        :type query: str
+
+        :returns: the position of the query, or None if the query is not present.
+        :rtype: (int|None)
+        """
+
+        names = self.columns["query_name"]
+        try:
+            encoded = query.encode()
+        except AttributeError:
+            return None
+        if len(encoded) > names.dtype.itemsize:
+            return None
+        pos = int(numpy.searchsorted(names, encoded))
+        if pos < len(names) and names[pos] == encoded:
+            return pos
+        return None
+
+    @property
+    def data_dict(self):
+        """The mappings of the store, in the format expected by the picking functions."""
+
+        return {"junctions": JunctionMapping(self),
+                "orfs": OrfMapping(self),
+                "hits": HitMapping(self),
+                "external": ExternalMapping(self)}
+
+
+def open_store(filename):
+    """
+    Function to open a store file, reusing the mapping if it is already open in the current process.
+    :param filename: the store file.
+    :type filename: str
+
+    :rtype: PreloadStore
+    """
+
+    if filename not in __stores:
+        __stores[filename] = PreloadStore(filename)
+    return __stores[filename]
+
+
+def create_store(junctions, orfs, hits, external, directory=None):
+    """
+    Function to write the preloaded data into a new temporary store file, and open it.
+    See write_store for the description of the parameters.
+
+    :param directory: the directory where to create the file.
+    :type directory: (None|str)
+
+    :rtype: PreloadStore
+    """
+
+    handle, filename = tempfile.mkstemp(suffix=".store", prefix="mikado_preload_", dir=directory)
+    os.close(handle)
+    write_store(filename, junctions, orfs, hits, external)
+    return open_store(filename)
+
+
+def release_store(filename):
+    """
+    Function to close a store in the current process and delete its file.
+    :param filename: the store file.
+    :type filename: str
+    """
+
+    __stores.pop(filename, None)
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+class _StoreMapping(collections.abc.Mapping):
+
+    """Base class for the read-only mappings over the store."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __reduce__(self):
+        return self.__class__, (self.store,)
+
+
+class JunctionMapping(_StoreMapping):
+
+    """Mapping (chrom, start, end) => strand of the verified junctions."""
+
+    def __find(self, key):
+        try:
+            chrom, start, end = key
+        except (TypeError, ValueError):
+            return None
+        if chrom not in self.store.chroms:
+            return None
+        first, last = self.store.chroms[chrom]
+        starts = self.store.columns["junction_start"]
+        first, last = (first + int(numpy.searchsorted(starts[first:last], start, side="left")),
+                       first + int(numpy.searchsorted(starts[first:last], start, side="right")))
+        pos = first + int(numpy.searchsorted(self.store.columns["junction_end"][first:last], end))
+        if pos < last and self.store.columns["junction_end"][pos] == end:
+            return pos
+        return None
+
+    def __contains__(self, key):
+        return self.__find(key) is not None
+
+    def __getitem__(self, key):
+        pos = self.__find(key)
+        if pos is None:
+            raise KeyError(key)
+        return _strands_rev[int(self.store.columns["junction_strand"][pos])]
+
+    def __iter__(self):
+        starts, ends = self.store.columns["junction_start"], self.store.columns["junction_end"]
+        for chrom, (first, last) in self.store.chroms.items():
+            for pos in range(first, last):
+                yield (chrom, int(starts[pos]), int(ends[pos]))
+
+    def __len__(self):
+        return len(self.store.columns["junction_start"])
+
+
+class _QueryMapping(_StoreMapping):
+
+    """Base class for the mappings indexed by query name. Only queries with at least one
+    record are considered part of the mapping, as in the dictionaries built during the preload."""
+
+    _offsets = None
+
+    def _range(self, query):
+        pos = self.store.query_index(query)
+        if pos is None:
+            return None
+        offsets = self.store.columns[self._offsets]
+        first, last = int(offsets[pos]), int(offsets[pos + 1])
+        if first == last:
+            return None
+        return first, last
+
+    @abc.abstractmethod
+    def _decode(self, query, first, last):
+        """
+        Method to decode the records of a query, which are stored between the given offsets.
+        It must be implemented by each mapping (OrfMapping, ExternalMapping, HitMapping).
+        :param query: the name of the query.
+        :type query: str
+        :param first: the offset of the first record of the query.
+        :type first: int
+        :param last: the offset after the last record of the query.
+        :type last: int
+        """
+        raise NotImplementedError("This is an abstract method, implemented by the mappings over each table!")
+
+    def __contains__(self, query):
+        return self._range(query) is not None
+
+    def __getitem__(self, query):
+        boundaries = self._range(query)
+        if boundaries is None:
+            raise KeyError(query)
+        return self._decode(query, *boundaries)
+
+    def __iter__(self):
+        offsets = self.store.columns[self._offsets]
+        for pos, name in enumerate(self.store.columns["query_name"]):
+            if offsets[pos] != offsets[pos + 1]:
+                yield name.decode()
+
+    def __len__(self):
+        return int(numpy.count_nonzero(numpy.diff(self.store.columns[self._offsets])))
+
+
+class OrfMapping(_QueryMapping):
+
+    """Mapping query => list of ORFs, as BED12 objects."""
+
+    _offsets = "orf_offset"
+
+    def _decode(self, query, first, last):
+        columns = self.store.columns
+        orfs = []
+        for pos in range(first, last):
+            state = _OrfState()
+            state.start, state.end = int(columns["orf_start"][pos]), int(columns["orf_end"][pos])
+            state.thick_start = int(columns["orf_thick_start"][pos])
+            state.thick_end = int(columns["orf_thick_end"][pos])
+            score = float(columns["orf_score"][pos])
+            state.score = None if numpy.isnan(score) else score
+            state.strand = _strands_rev[int(columns["orf_strand"][pos])]
+            phase = int(columns["orf_phase"][pos])
+            state.phase = None if phase < 0 else phase
+            flags = int(columns["orf_flags"][pos])
+            state.has_start_codon, state.has_stop_codon = bool(flags & 1), bool(flags & 2)
+            state.orf_name = columns["orf_name"][pos].decode()
+            orfs.append(Orf.as_bed12_static(state, query))
+        return orfs
+
+
+class ExternalMapping(_QueryMapping):
+
+    """Mapping query => dictionary of external scores."""
+
+    _offsets = "external_offset"
+
+    def _decode(self, query, first, last):
+        sources, scores = self.store.columns["external_source"], self.store.columns["external_score"]
+        return dict((self.store.sources[int(sources[pos])], float(scores[pos])) for pos in range(first, last))
+
+
+class HitMapping(_QueryMapping):
+
+    """Mapping query => list of BLAST hits, as dictionaries."""
+
+    _offsets = "hit_offset"
+
+    def _decode(self, query, first, last):
+        return pickle.loads(self.store.columns["hits"][first:last].tobytes())
@@ -0,0 +1,226 @@
+# coding: utf-8
+
+"""
+This module contains the functions used by Mikado pick to split the sorted input file
+into independent regions ("shards"), which can then be parsed directly by the worker processes.
+Each shard is defined by a pair of byte offsets in the input file; boundaries are only ever placed
+between transcripts which cannot belong to the same superlocus, so that the superloci produced by
+parsing the shards one after the other are the same produced by parsing the whole file serially.
+"""
+
+import collections
+import logging
+from ..exceptions import UnsortedInput, InvalidTranscript
+from ..loci.superlocus import Superlocus, Transcript
+from ..parsers.GTF import GtfLine
+from ..parsers.GFF import GffLine
+from ..utilities import overlap
+
+__author__ = 'Luca Venturini'
+
+
+Shard = collections.namedtuple("Shard", ["filename", "gtf", "chrom", "start", "end"])
+Shard.__doc__ = """Region of a sorted GTF/GFF3 file, defined by the byte offsets of its first
+and last (excluded) lines."""
+
+
+def is_compressed(filename):
+    """
+    Function to check whether a file is compressed with GZip or BZip2, in which case it
+    cannot be accessed through byte offsets.
+    :param filename: the file to check.
+    :type filename: str
+
+    :rtype: bool
+    """
+
+    if filename.endswith((".gz", ".bz2")):
+        return True
+    with open(filename, "rb") as handle:
+        magic_bytes = handle.read(3)
+    return magic_bytes[:2] == b"\x1f\x8b" or magic_bytes == b"BZh"
+
+
+def _parse_line(line, gtf):
+    """Private function to convert a decoded line into the correct annotation line object,
+    consistently with what is done by the GTF and GFF3 parsers."""
+
+    if gtf is True:
+        return GtfLine(line)
+    elif line[0] == "#":
+        return GffLine(line, header=True)
+    else:
+        return GffLine(line)
+
+
+def _is_exon_feature(feature):
+    """Private function which replicates quickly the is_exon property of the annotation lines,
+    without the need of parsing the attributes."""
+
+    feature = feature.lower()
+    return ("cds" in feature or feature.endswith("exon") or "utr" in feature or "codon" in feature
+            or feature == "cdna_match" or feature == "match_part")
+
+
+def index_input(filename, flank=0, shard_size=10**7, logger=None):
+    """
+    Function to split a sorted GTF/GFF3 file into shards. A new shard is started at the
+    beginning of each chromosome, or whenever the current shard is at least shard_size bytes
+    long and the next transcript is beyond the reach (including the flank) of all the
+    features seen so far in the shard.
+    The function checks the sortedness of the input along the way.
+
+    :param filename: the input file.
+    :type filename: str
+
+    :param flank: the flanking distance used to cluster transcripts into superloci.
+    :type flank: int
+
+    :param shard_size: minimum size in bytes of each shard.
+    :type shard_size: int
+
+    :param logger: optional logger.
+
+    :returns: a list of Shard objects, in the order they appear in the file.
+    :rtype: list[Shard]
+    """
+
+    if logger is None:
+        logger = logging.getLogger("shards")
+        logger.addHandler(logging.NullHandler())
+
+    gtf = filename.endswith(".gtf")
+    shards = []
+    offset = 0
+    shard_start = None
+    current = None  # (chrom, start, end) of the last transcript
+    region = None  # Extent of all the features in the current shard
+
+    with open(filename, "rb") as handle:
+        for line in handle:
+            line_start = offset
+            offset += len(line)
+            if not line.strip() or line[0] == 35:  # 35 is "#"
+                continue
+            fields = line.split(b"\t")
+            if len(fields) != 9:
+                continue
+            if _is_exon_feature(fields[2].decode()):
+                if region is not None:
+                    region[1] = max(region[1], int(fields[4]))
+                continue
+            row = _parse_line(line.decode(), gtf)
+            if row.header is True or row.is_transcript is False:
+                continue
+
+            if current is not None and (current[0] > row.chrom or (
+                    current[0] == row.chrom and (current[1], current[2]) > (row.start, row.end))):
+                error_msg = """Unsorted input file, the results will not be correct.
+                Please provide a properly sorted input. Error:
+                {0}
+                {1}""".format("\t".join([str(_) for _ in (row.chrom, row.start, row.end, row.strand)]),
+                              "\t".join([str(_) for _ in current]))
+                logger.critical(error_msg)
+                raise UnsortedInput("CRITICAL - {0}".format(" ".join(
+                    [_.strip() for _ in error_msg.split("\n")])))
+
+            if current is None or current[0] != row.chrom or (
+                    line_start - shard_start >= shard_size and
+                    overlap(region, (row.start, row.end), flank) <= 0):
+                if current is not None:
+                    shards.append(Shard(filename, gtf, current[0], shard_start, line_start))
+                shard_start = line_start
+                region = [row.start, row.end]
+            current = (row.chrom, row.start, row.end)
+            region[1] = max(region[1], row.end)
+
+    if current is not None:
+        shards.append(Shard(filename, gtf, current[0], shard_start, offset))
+
+    logger.debug("Split %s into %d shards", filename, len(shards))
+    return shards
+
+
+def iter_shard(shard):
+    """
+    Generator which yields the annotation lines of a shard, together with their byte offset.
+    :param shard: the shard to parse.
+    :type shard: Shard
+
+    :rtype: (int, (GtfLine|GffLine))
+    """
+
+    with open(shard.filename, "rb") as handle:
+        handle.seek(shard.start)
+        offset = shard.start
+        while offset < shard.end:
+            line = handle.readline()
+            if not line:
+                break
+            line_start = offset
+            offset += len(line)
+            yield line_start, _parse_line(line.decode(), shard.gtf)
+
+
+def shard_superloci(shard, json_conf, logger=None):
+    """
+    Generator which parses a shard and yields its superloci, mirroring the logic used by the Picker
+    when parsing the whole input. Each superlocus is accompanied by a counter, derived from the byte
+    offset of its first transcript: counters are therefore unique and increasing across the whole file.
+
+    :param shard: the shard to parse.
+    :type shard: Shard
+
+    :param json_conf: the configuration dictionary.
+    :type json_conf: dict
+
+    :param logger: optional logger.
+
+    :rtype: (Superlocus, int)
+    """
+
+    if logger is None:
+        logger = logging.getLogger("shards")
+        logger.addHandler(logging.NullHandler())
+
+    intron_range = json_conf["pick"]["run_options"]["intron_range"]
+    flank = json_conf["pick"]["clustering"]["flank"]
+    source = json_conf["pick"]["output_format"]["source"]
+
+    current_locus, locus_counter = None, None
+    current_transcript, transcript_counter = None, None
+    invalid = False
+
+    def close_transcript():
+        nonlocal current_locus, locus_counter
+        if Superlocus.in_locus(current_locus, current_transcript, flank=flank) is True:
+            current_locus.add_transcript_to_locus(current_transcript, check_in_locus=False)
+            return None
+        finished = (current_locus, locus_counter)
+        current_locus = Superlocus(current_transcript, stranded=False, json_conf=json_conf, source=source)
+        locus_counter = transcript_counter
+        return finished
+
+    for offset, row in iter_shard(shard):
+        if row.is_exon is True and invalid is False:
+            try:
+                current_transcript.add_exon(row)
+            except InvalidTranscript as exc:
+                logger.error("Transcript %s is invalid;\n%s", current_transcript.id, exc)
+                invalid = True
+        elif row.is_transcript is True:
+            if current_transcript is not None and invalid is False:
+                finished = close_transcript()
+                if finished is not None and finished[0] is not None:
+                    yield finished
+            invalid = False
+            current_transcript = Transcript(row, intron_range=intron_range)
+            # Counters start from 1, as in the serial parsing
+            transcript_counter = offset + 1
+
+    if current_transcript is not None and invalid is False:
+        finished = close_transcript()
+        if finished is not None and finished[0] is not None:
+            yield finished
+    if current_locus is not None:
+        yield current_locus, locus_counter
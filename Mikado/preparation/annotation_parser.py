@@ -1,16 +1,14 @@
+import io
 import multiprocessing
-from ..parsers import to_gff
+import re
+from ..parsers import to_gff, Parser
 from ..utilities.log_utils import create_queue_logger
 import logging
 import logging.handlers
 from .. import exceptions
 from sys import intern
-try:
-    import ujson as json
-except ImportError:
-    import json
-import sqlite3
 import os
+from .shelf import ShelfWriter
 
 
 __author__ = 'Luca Venturini'
@@ -24,10 +22,26 @@ class AnnotationParser(multiprocessing.Process):
                  identifier,
                  min_length=0,
                  log_level="WARNING",
-                 strip_cds=False):
+                 strip_cds=False,
+                 returnqueue=None):
+
+        """
+        :param submission_queue: the queue of the files to parse. Each item is a tuple
+        (label, handle, strand_specific, shelf_name), where handle is either the name of a file
+        or a tuple (name, start, end) indicating a chunk of a file (see find_chunks).
+        :param logging_queue: the queue used for logging.
+        :param identifier: the numeric identifier of the process.
+        :param min_length: minimum length for a cDNA to be considered as valid
+        :param log_level: the log level.
+        :param strip_cds: boolean flag. If true, all CDS lines will be ignored.
+        :param returnqueue: optional queue. If provided, for each item the process will send back a tuple
+        (shelf_name, new_ids, found_ids); the IDs are reported only for chunks, and are None for whole files
+        or if the parsing failed.
+        """
 
         super().__init__()
         self.submission_queue = submission_queue
+        self.returnqueue = returnqueue
         self.min_length = min_length
         self.__strip_cds = strip_cds
         self.logging_queue = logging_queue
@@ -74,8 +88,14 @@ class AnnotationParser(multiprocessing.Process):
                               label,
                               strand_specific,
                               shelf_name)
+            chunk = isinstance(handle, tuple)
+            new_ids, found_in_file = None, None
             try:
-                gff_handle = to_gff(handle)
+                if chunk is True:
+                    gff_handle = open_chunk(*handle)
+                    found_in_file = set()
+                else:
+                    gff_handle = to_gff(handle)
                 if gff_handle.__annot_type__ == "gff3":
                     new_ids = load_from_gff(shelf_name,
                                             gff_handle,
@@ -84,7 +104,8 @@ class AnnotationParser(multiprocessing.Process):
                                             self.logger,
                                             min_length=self.min_length,
                                             strip_cds=self.__strip_cds,
-                                            strand_specific=strand_specific)
+                                            strand_specific=strand_specific,
+                                            found_in_file=found_in_file)
                 else:
                     new_ids = load_from_gtf(shelf_name,
                                             gff_handle,
@@ -93,8 +114,10 @@ class AnnotationParser(multiprocessing.Process):
                                             self.logger,
                                             min_length=self.min_length,
                                             strip_cds=self.__strip_cds,
-                                            strand_specific=strand_specific)
-                if len(new_ids) == 0:
+                                            strand_specific=strand_specific,
+                                            found_in_file=found_in_file)
+                # The validity of chunks is assessed on the whole file
+                if len(new_ids) == 0 and chunk is False:
                     raise exceptions.InvalidAssembly(
                         "No valid transcripts found in {0}{1}!".format(
                             handle, " (label: {0})".format(label) if label != "" else ""
@@ -106,6 +129,12 @@ class AnnotationParser(multiprocessing.Process):
             except Exception as exc:
                 self.logger.exception(exc)
                 raise
+            finally:
+                if self.returnqueue is not None:
+                    if chunk is True and found_in_file is not None and new_ids is not None:
+                        self.returnqueue.put((shelf_name, new_ids, found_in_file))
+                    else:
+                        self.returnqueue.put((shelf_name, None, None))
 
         self.logger.debug("Sending %s back, exiting.", counter)
 
@@ -118,6 +147,130 @@ class AnnotationParser(multiprocessing.Process):
         return self.__identifier
 
 
+class _Chunk(io.IOBase):
+
+    """
+    Read-only text handle over a byte range of a file, used to parse a chunk of an annotation file
+    with the standard parsers. The range must start and end at line boundaries.
+    """
+
+    def __init__(self, name, start, end):
+        super().__init__()
+        self.name = name
+        self.__handle = open(name, "rb")
+        self.__handle.seek(start)
+        self.__remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readline(self, size=-1):
+        if self.__remaining <= 0:
+            return ""
+        line = self.__handle.readline()
+        self.__remaining -= len(line)
+        return line.decode()
+
+    def close(self):
+        self.__handle.close()
+        super().close()
+
+
+def open_chunk(name, start, end):
+    """
+    Function to open a chunk of an annotation file with the appropriate parser.
+    :param name: the name of the file.
+    :type name: str
+    :param start: the offset of the first byte of the chunk.
+    :type start: int
+    :param end: the offset following the last byte of the chunk.
+    :type end: int
+
+    :rtype: (Mikado.parsers.GTF.GTF | Mikado.parsers.GFF.GFF3)
+    """
+
+    parser = to_gff(name)
+    parser.close()
+    return parser.__class__(_Chunk(name, start, end))
+
+
+__gtf_transcript = re.compile(rb'transcript_id\s+"?([^";]+)')
+__gff_id = re.compile(rb'(?:^|;)\s*ID=([^;]+)')
+__gff_parent = re.compile(rb'(?:^|;)\s*Parent=')
+
+
+def __group_key(line, annot_type):
+    """
+    Private function to determine the group a line belongs to, when looking for the boundaries of the chunks:
+    the transcript for GTF files, the top-level feature (eg the gene) for GFF3 files.
+    Returns None for comment lines and for GFF3 lines belonging to the same group as the previous line.
+    """
+
+    fields = line.split(b"\t")
+    if len(fields) < 9 or line[:1] == b"#":
+        return None
+    if annot_type == "gtf":
+        key = __gtf_transcript.search(fields[8])
+        return key.group(1) if key is not None else b""
+    elif __gff_parent.search(fields[8]) is not None:
+        return None
+    key = __gff_id.search(fields[8])
+    return key.group(1).strip() if key is not None else b""
+
+
+def find_chunks(name, chunk_size):
+    """
+    Function to divide an annotation file in chunks of about chunk_size bytes, which can be parsed independently.
+    Each chunk starts with a new transcript (GTF files) or a new top-level feature, eg a gene (GFF3 files),
+    so that the lines of a transcript are all within the same chunk as long as they are grouped together
+    in the file. Compressed files are not divided.
+
+    :param name: the name of the file.
+    :type name: str
+    :param chunk_size: the approximate size of the chunks. If 0, the file is not divided.
+    :type chunk_size: int
+
+    :returns: a list of (start, end) byte offsets.
+    :rtype: list
+    """
+
+    size = os.path.getsize(name)
+    if chunk_size <= 0 or size <= chunk_size:
+        return [(0, size)]
+    if name.endswith(".gz") or name.endswith(".bz2") or Parser.wizard.from_file(name) in (
+            b"application/gzip", b"application/x-bzip2"):
+        return [(0, size)]
+
+    parser = to_gff(name)
+    parser.close()
+    annot_type = parser.__annot_type__
+    boundaries = [0]
+    with open(name, "rb") as handle:
+        for target in range(chunk_size, size, chunk_size):
+            if target <= boundaries[-1]:
+                continue
+            handle.seek(target - 1)
+            handle.readline()  # Complete the current line
+            previous = None
+            while True:
+                position = handle.tell()
+                line = handle.readline()
+                if not line:
+                    position = size
+                    break
+                key = __group_key(line, annot_type)
+                if key is None:
+                    continue
+                elif previous is not None and key != previous:
+                    break
+                previous = key
+            if position >= size:
+                break
+            boundaries.append(position)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
 def __raise_redundant(row_id, name, label):
 
     if label == '':
@@ -150,68 +303,43 @@ def load_into_storage(shelf_name, exon_lines, min_length, logger):
 
     """Function to load the exon_lines dictionary into the temporary storage."""
 
-    conn = sqlite3.connect(shelf_name)
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "CREATE TABLE dump (chrom text, start integer, end integer, strand text, tid text, features blob)")
-    except sqlite3.OperationalError:
-        # Table already exists
+    if os.path.exists(shelf_name):
         logger.error("Shelf %s already exists (maybe from a previous aborted run?), dropping its contents", shelf_name)
-        cursor.close()
-        conn.close()
-        os.remove(shelf_name)
-        conn = sqlite3.connect(shelf_name)
-        cursor = conn.cursor()
-        cursor.execute(
-            "CREATE TABLE dump (chrom text, start integer, end integer, strand text, tid text, features blob)")
-
-    cursor.execute("CREATE INDEX idx ON dump (tid)")
-
-    for tid in exon_lines:
-        if "features" not in exon_lines[tid]:
-            raise KeyError("{0}: {1}\n{2}".format(tid, "features", exon_lines[tid]))
-        if ("exon" not in exon_lines[tid]["features"] or
-                len(exon_lines[tid]["features"]["exon"]) == 0):
-            # Match-like things
-            if "match" in exon_lines[tid]["features"]:
-                if len(exon_lines[tid]["features"]["match"]) > 1:
-                    logger.warning("Invalid features for %s, skipping.", tid)
+    with ShelfWriter(shelf_name) as shelf:
+        for tid in exon_lines:
+            if "features" not in exon_lines[tid]:
+                raise KeyError("{0}: {1}\n{2}".format(tid, "features", exon_lines[tid]))
+            if ("exon" not in exon_lines[tid]["features"] or
+                    len(exon_lines[tid]["features"]["exon"]) == 0):
+                # Match-like things
+                if "match" in exon_lines[tid]["features"]:
+                    if len(exon_lines[tid]["features"]["match"]) > 1:
+                        logger.warning("Invalid features for %s, skipping.", tid)
+                        continue
+                    exon_lines[tid]["features"]["exon"] = [exon_lines[tid]["features"]["match"][0]]
+                    logger.warning("Inferring that %s is a mono-exonic transcript-match: (%s, %d-%d)",
+                                   tid, exon_lines[tid]["chrom"],
+                                   exon_lines[tid]["features"]["exon"][0][0],
+                                   exon_lines[tid]["features"]["exon"][0][1])
+                    del exon_lines[tid]["features"]["match"]
+                else:
+                    logger.warning("No valid exon feature for %s, continuing", tid)
                     continue
-                exon_lines[tid]["features"]["exon"] = [exon_lines[tid]["features"]["match"][0]]
-                logger.warning("Inferring that %s is a mono-exonic transcript-match: (%s, %d-%d)",
-                               tid, exon_lines[tid]["chrom"],
-                               exon_lines[tid]["features"]["exon"][0][0],
-                               exon_lines[tid]["features"]["exon"][0][1])
+            elif "match" in exon_lines[tid]["features"] and "exon" in exon_lines[tid]["features"]:
                 del exon_lines[tid]["features"]["match"]
-            else:
-                logger.warning("No valid exon feature for %s, continuing", tid)
+
+            tlength = sum(exon[1] + 1 - exon[0] for exon in exon_lines[tid]["features"]["exon"])
+            # Discard transcript under a certain size
+            if tlength < min_length:
+                logger.debug("Discarding %s because its size (%d) is under the minimum of %d",
+                             tid, tlength, min_length)
                 continue
-        elif "match" in exon_lines[tid]["features"] and "exon" in exon_lines[tid]["features"]:
-            del exon_lines[tid]["features"]["match"]
-
-        tlength = sum(exon[1] + 1 - exon[0] for exon in exon_lines[tid]["features"]["exon"])
-        # Discard transcript under a certain size
-        if tlength < min_length:
-            logger.debug("Discarding %s because its size (%d) is under the minimum of %d",
-                         tid, tlength, min_length)
-            continue
 
-        values = json.dumps(exon_lines[tid])
-
-        start = min((_[0] for _ in exon_lines[tid]["features"]["exon"]))
-        end = max((_[1] for _ in exon_lines[tid]["features"]["exon"]))
-        logger.debug("Inserting %s into shelf %s", tid, shelf_name)
-        cursor.execute("INSERT INTO dump VALUES (?, ?, ?, ?, ?, ?)", (exon_lines[tid]["chrom"],
-                                                                      start,
-                                                                      end,
-                                                                      exon_lines[tid]["strand"],
-                                                                      tid,
-                                                                      values))
-
-    cursor.close()
-    conn.commit()
-    conn.close()
+            start = min((_[0] for _ in exon_lines[tid]["features"]["exon"]))
+            end = max((_[1] for _ in exon_lines[tid]["features"]["exon"]))
+            logger.debug("Inserting %s into shelf %s", tid, shelf_name)
+            shelf.add(tid, exon_lines[tid], start, end)
+
     return
 
 
@@ -222,7 +350,8 @@ def load_from_gff(shelf_name,
                   logger,
                   min_length=0,
                   strip_cds=False,
-                  strand_specific=False):
+                  strand_specific=False,
+                  found_in_file=None):
     """
     Method to load the exon lines from GFF3 files.
     :param shelf_name: the name of the shelf DB to use.
@@ -239,6 +368,9 @@ def load_from_gff(shelf_name,
     :type strip_cds: bool
     :param strand_specific: whether the assembly is strand-specific or not.
     :type strand_specific: bool
+    :param found_in_file: optional set, which will be updated with the IDs of all the transcripts
+    found in the file (including those without valid features).
+    :type found_in_file: (None|set)
     :return:
     """
 
@@ -344,6 +476,8 @@ def load_from_gff(shelf_name,
             else:
                 continue
     gff_handle.close()
+    if found_in_file is not None:
+        found_in_file.update(exon_lines.keys())
 
     load_into_storage(shelf_name, exon_lines, logger=logger, min_length=min_length)
 
@@ -357,7 +491,8 @@ def load_from_gtf(shelf_name,
                   logger,
                   min_length=0,
                   strip_cds=False,
-                  strand_specific=False):
+                  strand_specific=False,
+                  found_in_file=None):
     """
     Method to load the exon lines from GTF files.
     :param shelf_name: the name of the shelf DB to use.
@@ -374,6 +509,9 @@ def load_from_gtf(shelf_name,
     :type strip_cds: bool
     :param strand_specific: whether the assembly is strand-specific or not.
     :type strand_specific: bool
+    :param found_in_file: optional set, which will be updated with the IDs of all the transcripts
+    found in the file (including those without valid features).
+    :type found_in_file: (None|set)
     :return:
     """
 
@@ -449,6 +587,8 @@ def load_from_gtf(shelf_name,
         exon_lines[row.transcript]["features"][row.feature].append((row.start, row.end))
         new_ids.add(row.transcript)
     gff_handle.close()
+    if found_in_file is not None:
+        found_in_file.update(exon_lines.keys())
     load_into_storage(shelf_name, exon_lines, logger=logger, min_length=min_length)
 
     return new_ids
@@ -2,9 +2,8 @@ import functools
 import multiprocessing
 import os
 
-import pyfaidx
-
 from Mikado.transcripts.transcriptchecker import TranscriptChecker
+from .genome import Genome
 from .. import exceptions
 from ..loci import Transcript
 from ..utilities.log_utils import create_null_logger, create_queue_logger
@@ -124,9 +123,12 @@ class CheckingProcess(multiprocessing.Process):
         self.name = "Checker-{0}".format(self.identifier)
         create_queue_logger(self)
         self.lenient = lenient
-        self.__fasta = fasta
+        # The genome of the main process can be shared, so that its memory map is inherited
+        if isinstance(fasta, Genome):
+            self.fasta = fasta
+        else:
+            self.fasta = Genome(fasta)
         self.submission_queue = submission_queue
-        self.fasta = pyfaidx.Fasta(self.__fasta)
         self.fasta_out = os.path.join(tmpdir, "{0}-{1}".format(
             fasta_out, self.identifier
         ))
@@ -157,7 +159,7 @@ class CheckingProcess(multiprocessing.Process):
                 break
             self.logger.debug("Checking %s", lines["tid"])
             transcript = checker(lines,
-                                 str(self.fasta[lines["chrom"]][start-1:end]),
+                                 self.fasta.fetch(lines["chrom"], start, end),
                                  start,
                                  end,
                                  strand_specific=lines["strand_specific"])
@@ -178,7 +180,6 @@ class CheckingProcess(multiprocessing.Process):
 
     def __getstate__(self):
         state = self.__dict__.copy()
-        del state["fasta"]
         # del state["handler"]
         del state["logger"]
         return state
@@ -186,7 +187,6 @@ class CheckingProcess(multiprocessing.Process):
     def __setstate__(self, state):
         self.__dict__.update(state)
         create_queue_logger(self)
-        self.fasta = pyfaidx.Fasta(self.__fasta)
 
     @property
     def identifier(self):
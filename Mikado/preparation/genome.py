@@ -0,0 +1,120 @@
+# coding: utf-8
+
+"""
+This module implements the access to the genome sequence used by Mikado prepare to check the transcripts.
+The FASTA file is memory-mapped, and the position of each sequence within the file is retrieved from
+its FAI index (which is created with pyfaidx if necessary); the sequence of a region is therefore read
+directly from the page cache of the operating system, which is shared by all the processes which map
+the same file. Compressed files cannot be memory-mapped; they are accessed through pyfaidx instead.
+"""
+
+import collections
+import mmap
+import os
+import pyfaidx
+
+__author__ = 'Luca Venturini'
+
+
+# Entry of the FAI index: length of the sequence, offset of its first base, bases and bytes per line
+_FaiEntry = collections.namedtuple("_FaiEntry", ["length", "offset", "line_bases", "line_width"])
+
+
+class Genome:
+
+    """
+    Read-only access to the sequences of a FASTA file, memory-mapped through its FAI index.
+    When using the fork start method, child processes share the memory map of their parent;
+    otherwise, the file is mapped again when the object is unpickled.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: the name of the FASTA file.
+        :type filename: str
+        """
+
+        self.filename = filename
+        self.__handle = None
+        self.__map = None
+        self.__fasta = None
+        self.__index = dict()
+        self.__open()
+
+    def __open(self):
+        """Private method to open the file and load its index."""
+
+        with open(self.filename, "rb") as handle:
+            compressed = handle.read(2) == b"\x1f\x8b"
+        if compressed is True:
+            self.__fasta = pyfaidx.Fasta(self.filename)
+            return
+
+        index_name = "{}.fai".format(self.filename)
+        if not os.path.exists(index_name) or os.stat(index_name).st_mtime < os.stat(self.filename).st_mtime:
+            pyfaidx.Faidx(self.filename).close()
+        with open(index_name) as index:
+            for line in index:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 5:
+                    continue
+                self.__index[fields[0]] = _FaiEntry(*[int(_) for _ in fields[1:5]])
+
+        self.__handle = open(self.filename, "rb")
+        if os.stat(self.filename).st_size > 0:
+            self.__map = mmap.mmap(self.__handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getstate__(self):
+        return {"filename": self.filename}
+
+    def __setstate__(self, state):
+        self.__init__(state["filename"])
+
+    def __contains__(self, chrom):
+        if self.__fasta is not None:
+            return chrom in self.__fasta
+        return chrom in self.__index
+
+    def keys(self):
+        """The names of the sequences in the file."""
+        if self.__fasta is not None:
+            return self.__fasta.keys()
+        return self.__index.keys()
+
+    def fetch(self, chrom, start, end):
+        """
+        Method to retrieve the sequence of a region, in 1-based coordinates (ends included).
+        Coordinates beyond the ends of the sequence are truncated, as with pyfaidx.
+        :param chrom: the name of the sequence.
+        :type chrom: str
+        :param start: the start of the region.
+        :type start: int
+        :param end: the end of the region.
+        :type end: int
+
+        :rtype: str
+        """
+
+        if self.__fasta is not None:
+            return str(self.__fasta[chrom][start - 1:end])
+
+        entry = self.__index[chrom]
+        start, end = max(start - 1, 0), min(end, entry.length)
+        if start >= end:
+            return ""
+        first = entry.offset + (start // entry.line_bases) * entry.line_width + start % entry.line_bases
+        last = entry.offset + ((end - 1) // entry.line_bases) * entry.line_width + (end - 1) % entry.line_bases
+        region = self.__map[first:last + 1]
+        if entry.line_width != entry.line_bases:
+            region = region.translate(None, b"\r\n")
+        return region.decode()
+
+    def close(self):
+        """Method to close the memory map and the file."""
+
+        if self.__fasta is not None:
+            self.__fasta.close()
+        if self.__map is not None and not self.__map.closed:
+            self.__map.close()
+        if self.__handle is not None:
+            self.__handle.close()
@@ -2,9 +2,13 @@ import os
 import tempfile
 import gc
 from .checking import create_transcript, CheckingProcess
-from .annotation_parser import AnnotationParser, load_from_gtf, load_from_gff
+from .annotation_parser import AnnotationParser, load_from_gtf, load_from_gff, find_chunks
+from .shelf import Shelf
+from .genome import Genome
 from ..parsers import to_gff
 import operator
+import heapq
+import itertools
 import collections
 import io
 from .. import exceptions
@@ -14,15 +18,11 @@ import functools
 import multiprocessing
 import multiprocessing.connection
 import multiprocessing.sharedctypes
+import queue
 import pyfaidx
 import logging
 from ..utilities import path_join, merge_partial
 from collections import Counter
-import sqlite3
-try:
-    import ujson as json
-except ImportError:
-    import json
 
 __author__ = 'Luca Venturini'
 
@@ -42,13 +42,130 @@ def __cleanup(args, shelves):
     [os.remove(fname) for fname in shelves if os.path.exists(fname)]
 
 
-def store_transcripts(shelf_stacks, logger, keep_redundant=False):
+def __shelf_index(shelf_name, rank, shelf):
+    """Private function to iterate over the index of a shelf, as
+    ((chrom, start, end, rank, sequential number), (tid, shelf name, position, fingerprint)).
+    The first element sorts the transcripts by coordinates, then by shelf and then in order of insertion."""
+    for seq, (chrom, start, end, strand, tid, position, print_) in enumerate(shelf):
+        yield (chrom, start, end, rank, seq), (tid, shelf_name, position, print_)
+
+
+def __remove_redundant(chrom, key, group, logger):
+    """
+    Private function to remove the redundant transcripts from a group of transcripts with identical coordinates.
+    Transcripts are redundant if they have the same fingerprint, ie the same strand and exons; one of them
+    is chosen at random to be kept.
+    :param chrom: the chromosome of the group.
+    :param key: the (start, end) coordinates of the group.
+    :param group: the transcripts of the group, as (tid, shelf name, position, fingerprint).
+    :param logger: logger instance.
+
+    :rtype: list
+    """
+
+    exons = collections.defaultdict(list)
+    for transcript in group:
+        exons[transcript[3]].append(transcript)
+    logger.debug("%d intron chains for pos %s",
+                 len(exons), "{}:{}-{}".format(chrom, key[0], key[1]))
+    tids = []
+    for tid_list in exons.values():
+        if len(tid_list) > 1:
+            logger.debug("The following transcripts are redundant: %s",
+                         ",".join([_[0] for _ in tid_list]))
+            to_keep = random.choice(tid_list)
+            logger.debug("Keeping only %s out of the list",
+                         to_keep[0])
+            tids.append(to_keep)
+        else:
+            tids.extend(tid_list)
+    return tids
+
+
+def is_contained(outer, inner):
+    """
+    Function to verify whether a transcript is contained within the exon chain of another,
+    ie whether they are on the same strand, the introns of the inner transcript are a contiguous
+    subset of those of the outer transcript, and its terminal exons fall within the corresponding
+    exons of the outer transcript. Monoexonic transcripts are contained within a transcript if they fall
+    within one of its exons.
+    :param outer: the strand and the sorted exons of the putative container.
+    :type outer: (str, list)
+    :param inner: the strand and the sorted exons of the putative contained transcript.
+    :type inner: (str, list)
+
+    :rtype: bool
+    """
+
+    (outer_strand, outer_exons), (inner_strand, inner_exons) = outer, inner
+    if outer_strand != inner_strand or len(inner_exons) > len(outer_exons):
+        return False
+    if len(inner_exons) == 1:
+        return any(exon[0] <= inner_exons[0][0] and inner_exons[0][1] <= exon[1] for exon in outer_exons)
+
+    # Find the exon of the outer transcript which ends where the first exon of the inner transcript ends
+    for first, exon in enumerate(outer_exons[:len(outer_exons) - len(inner_exons) + 1]):
+        if exon[1] == inner_exons[0][1]:
+            break
+    else:
+        return False
+    if outer_exons[first][0] > inner_exons[0][0]:
+        return False
+    last = first + len(inner_exons) - 1
+    if any(outer_exons[first + num] != inner_exons[num] for num in range(1, len(inner_exons) - 1)):
+        return False
+    return (outer_exons[last][0] == inner_exons[-1][0] and
+            inner_exons[-1][1] <= outer_exons[last][1])
+
+
+def __collapse_contained(merged, shelf_stacks, logger):
+    """
+    Private function to remove the transcripts contained within the exon chain of another (see is_contained)
+    from the stream of sorted and non-redundant transcripts. The transcripts starting at the same position
+    are analysed together, from the longest; the kept transcripts which might still contain the following ones
+    are kept in a window, so that memory is proportional to the number of overlapping transcripts.
+    :param merged: iterable of the transcripts, as (chrom, start, end, tid, shelf name, position).
+    :param shelf_stacks: dictionary containing the names of the shelves and the shelves themselves.
+    :param logger: logger instance.
+    """
+
+    # Kept transcripts which might contain the following ones, as (chrom, end, tid, (strand, exons))
+    window = []
+    for (chrom, start), block in itertools.groupby(merged, key=operator.itemgetter(0, 1)):
+        block = list(block)
+        window = [_ for _ in window if _[0] == chrom and _[1] >= start]
+        exons = []
+        for transcript in block:
+            features = shelf_stacks[transcript[4]].get(transcript[5])
+            exons.append((features["strand"],
+                          sorted((exon[0], exon[1]) for exon in features["features"]["exon"])))
+        kept = []
+        # From the longest transcript; shorter transcripts with the same start cannot contain longer ones
+        for num in sorted(range(len(block)), key=lambda pos: -block[pos][2]):
+            end = block[num][2]
+            container = next((_ for _ in itertools.chain(window, kept)
+                              if _[1] >= end and is_contained(_[3], exons[num])), None)
+            if container is not None:
+                logger.debug("%s is contained within %s, removing it", block[num][3], container[2])
+                continue
+            kept.append((chrom, end, block[num][3], exons[num], num))
+        # Keep the original order of the transcripts
+        kept.sort(key=operator.itemgetter(4))
+        for transcript in kept:
+            window.append(transcript[:4])
+            yield block[transcript[4]]
+
+
+def store_transcripts(shelf_stacks, logger, keep_redundant=False, collapse_contained=False):
 
     """
     Function that analyses the exon lines from the original file
     and organises the data into a proper dictionary.
-    :param shelf_stacks: dictionary containing the name and the handles of the shelf DBs
-    :type shelf_stacks: dict
+    The shelves are already sorted by chromosome, start and end: they are merged
+    in streaming fashion, and redundant transcripts are looked for within each group of
+    transcripts with identical coordinates, as the merge passes it, by comparing their fingerprints.
+    :param shelf_stacks: dictionary containing the names of the shelves and the shelves themselves
+    :type shelf_stacks: dict[str, Shelf]
 
     :param logger: logger instance.
     :type logger: logging.Logger
@@ -56,67 +173,35 @@ def store_transcripts(shelf_stacks, logger, keep_redundant=False):
     :param keep_redundant: boolean flag. If set to True, redundant transcripts will be kept in the output.
     :type keep_redundant: bool
 
-    :return: transcripts: dictionary which will be the final output
-    :rtype: transcripts
+    :param collapse_contained: boolean flag. If set to True, transcripts contained within the exon chain
+    of another transcript will be removed as well (see is_contained). Ignored if keep_redundant is True.
+    :type collapse_contained: bool
+
+    :return: generator of the transcripts, as [(tid, shelf name, position), chrom, (start, end)]
     """
 
-    transcripts = collections.defaultdict(dict)
-
-    for shelf_name in shelf_stacks:
-
-        for values in shelf_stacks[shelf_name]["cursor"].execute("SELECT chrom, start, end, strand, tid FROM dump"):
-            chrom, start, end, strand, tid = values
-            if (start, end) not in transcripts[chrom]:
-                transcripts[chrom][(start, end)] = []
-            transcripts[chrom][(start, end)].append((tid, shelf_name))
-
-    for chrom in sorted(transcripts.keys()):
-
-        logger.debug("Starting with %s (%d positions)",
-                     chrom,
-                     len(transcripts[chrom]))
-
-        for key in sorted(transcripts[chrom].keys(),
-                          key=operator.itemgetter(0, 1)):
-            tids = transcripts[chrom][key]
-            if len(tids) > 1:
-                exons = collections.defaultdict(list)
-                for tid, shelf in tids:
-                    strand, features = next(shelf_stacks[shelf]["cursor"].execute(
-                        "select strand, features from dump where tid = ?", (tid,)))
-                    features = json.loads(features)
-                    exon_set = tuple(sorted([(exon[0], exon[1], strand) for exon in
-                                            features["features"]["exon"]],
-                                            key=operator.itemgetter(0, 1)))
-
-                    # exon_set = tuple(sorted(
-                    #     [(exon[0], exon[1], shelf_stacks[shelf][tid]["strand"]) for exon in
-                    #      shelf_stacks[shelf][tid]["features"]["exon"]],
-
-                    exons[exon_set].append((tid, shelf))
-                tids = []
-                logger.debug("%d intron chains for pos %s",
-                             len(exons), "{}:{}-{}".format(chrom, key[0], key[1]))
-                for tid_list in exons.values():
-                    if len(tid_list) > 1 and keep_redundant is False:
-                        logger.debug("The following transcripts are redundant: %s",
-                                     ",".join([_[0] for _ in tid_list]))
-                        to_keep = random.choice(tid_list)
-                        logger.debug("Keeping only %s out of the list",
-                                     to_keep)
-                        tids.append(to_keep)
-                    else:
-                        tids.extend(tid_list)
-
-            # seq = chrom_seq[key[0]-1:key[1]]
-            for tid in tids:
-                # counter += 1
-                yield [tid, chrom, key]
-            # keys.extend([tid, seq] for tid in tids)
-
-    # logger.info("Finished to sort %d transcripts, %d remain", len(exon_lines), counter)
-
-    # return keys
+    # Ties are resolved in the order of the shelves, and then in the order of insertion
+    merged = heapq.merge(*[__shelf_index(shelf_name, rank, shelf_stacks[shelf_name])
+                           for rank, shelf_name in enumerate(shelf_stacks)])
+
+    def unique():
+        current_chrom = None
+        for (chrom, start, end), group in itertools.groupby(merged, key=lambda item: item[0][:3]):
+            if chrom != current_chrom:
+                logger.debug("Starting with %s", chrom)
+                current_chrom = chrom
+            group = [payload for _, payload in group]
+            if len(group) > 1 and keep_redundant is False:
+                group = __remove_redundant(chrom, (start, end), group, logger)
+            for tid, shelf, position, _ in group:
+                yield chrom, start, end, tid, shelf, position
+
+    transcripts = unique()
+    if collapse_contained is True and keep_redundant is False:
+        transcripts = __collapse_contained(transcripts, shelf_stacks, logger)
+
+    for chrom, start, end, tid, shelf, position in transcripts:
+        yield [(tid, shelf, position), chrom, (start, end)]
 
 
 def perform_check(keys, shelve_stacks, args, logger):
@@ -127,8 +212,8 @@ def perform_check(keys, shelve_stacks, args, logger):
     they are correct when looking at the underlying genome sequence.
     This is also the point at which we start using multithreading, if
     so requested.
-    :param keys: sorted list of [tid, sequence]
-    :param shelve_stacks: dictionary containing the name and the handles of the shelf DBs
+    :param keys: sorted list of [(tid, shelf name, position), chrom, (start, end)]
+    :param shelve_stacks: dictionary containing the names of the shelves and the shelves themselves
     :param args: the namespace
     :param logger: logger
     :return:
@@ -151,16 +236,12 @@ def perform_check(keys, shelve_stacks, args, logger):
             logger=logger)
 
         for tid, chrom, key in keys:
-            tid, shelf_name = tid
-            try:
-                tobj = json.loads(next(shelve_stacks[shelf_name]["cursor"].execute(
-                    "SELECT features FROM dump WHERE tid = ?", (tid,)))[0])
-            except sqlite3.ProgrammingError as exc:
-                raise sqlite3.ProgrammingError("{}. Tids: {}".format(exc, tid))
+            tid, shelf_name, position = tid
+            tobj = shelve_stacks[shelf_name].get(position)
 
             transcript_object = partial_checker(
                 tobj,
-                str(args.json_conf["reference"]["genome"][chrom][key[0]-1:key[1]]),
+                args.json_conf["reference"]["genome"].fetch(chrom, key[0], key[1]),
                 key[0], key[1],
                 strand_specific=tobj["strand_specific"])
             if transcript_object is None:
@@ -182,7 +263,7 @@ def perform_check(keys, shelve_stacks, args, logger):
         working_processes = [CheckingProcess(
             submission_queue,
             args.logging_queue,
-            args.json_conf["reference"]["genome"].filename,
+            args.json_conf["reference"]["genome"],
             _ + 1,
             os.path.basename(args.json_conf["prepare"]["files"]["out_fasta"].name),
             os.path.basename(args.json_conf["prepare"]["files"]["out"].name),
@@ -196,9 +277,8 @@ def perform_check(keys, shelve_stacks, args, logger):
 
         for counter, keys in enumerate(keys):
             tid, chrom, (pos) = keys
-            tid, shelf_name = tid
-            tobj = json.loads(next(shelve_stacks[shelf_name]["cursor"].execute(
-                "SELECT features FROM dump WHERE tid = ?", (tid,)))[0])
+            tid, shelf_name, position = tid
+            tobj = shelve_stacks[shelf_name].get(position)
             submission_queue.put((tobj, pos[0], pos[1], counter + 1))
 
         submission_queue.put(tuple(["EXIT"]*4))
@@ -227,10 +307,75 @@ def perform_check(keys, shelve_stacks, args, logger):
     return
 
 
+def __chunk_shelf(shelf_name, num):
+    """Private function to define the name of the shelf of a chunk of an input file."""
+    root, ext = os.path.splitext(shelf_name)
+    return "{0}_{1}{2}".format(root, str(num).zfill(5), ext)
+
+
+def __collect_chunks(args, chunked, results, logger, min_length=0):
+    """
+    Private function to verify the chunks of the input files parsed in parallel. If the transcripts of a file
+    are not grouped together, so that any of them has been found in more than one chunk, the file
+    is parsed again as a whole (and serially).
+
+    :param args: the Namespace from the command line.
+    :param chunked: dictionary with the chunked files, as (label, strand_specific, shelf_name) -> [chunk shelves]
+    :param results: dictionary with the IDs found in each chunk, as shelf -> (new_ids, found_ids)
+    :param logger: the logger instance.
+    :param min_length: minimal length of the transcript.
+
+    :returns: the names of the shelves of each chunked file, keyed by the name of its own shelf.
+    :rtype: dict
+    """
+
+    shelves = dict()
+    strip_cds = args.json_conf["prepare"]["strip_cds"]
+    for (label, strand_specific, gff_name, shelf_name), chunk_shelves in chunked.items():
+        valid = all(results.get(shelf, (None, None))[1] is not None for shelf in chunk_shelves)
+        if valid is True:
+            found = [results[shelf][1] for shelf in chunk_shelves]
+            valid = sum(len(_) for _ in found) == len(set.union(*found))
+            if valid is False:
+                logger.warning("The transcripts of %s are not grouped together; parsing it as a whole",
+                               gff_name)
+        else:
+            logger.warning("Failed to parse %s in chunks; parsing it as a whole", gff_name)
+
+        if valid is True:
+            shelves[shelf_name] = chunk_shelves
+            if not any(results[shelf][0] for shelf in chunk_shelves):
+                logger.exception(exceptions.InvalidAssembly(
+                    "No valid transcripts found in {0}{1}!".format(
+                        gff_name, " (label: {0})".format(label) if label != "" else "")))
+            continue
+
+        [os.remove(shelf) for shelf in chunk_shelves if os.path.exists(shelf)]
+        gff_handle = to_gff(gff_name)
+        loader = load_from_gff if gff_handle.__annot_type__ == "gff3" else load_from_gtf
+        new_ids = loader(shelf_name,
+                         gff_handle,
+                         label,
+                         set(),
+                         logger,
+                         min_length=min_length,
+                         strip_cds=strip_cds,
+                         strand_specific=strand_specific)
+        if len(new_ids) == 0:
+            logger.exception(exceptions.InvalidAssembly(
+                "No valid transcripts found in {0}{1}!".format(
+                    gff_name, " (label: {0})".format(label) if label != "" else "")))
+        shelves[shelf_name] = [shelf_name]
+
+    return shelves
+
+
 def load_exon_lines(args, shelve_names, logger, min_length=0):
 
     """This function loads all exon lines from the GFF inputs into a
      defaultdict instance.
+    When using multiple processes, files larger than the chunk size are divided into chunks
+    (see annotation_parser.find_chunks) which are parsed in parallel, each into its own shelf.
     :param args: the Namespace from the command line.
     :param shelve_names: list of names of the shelf DB files.
     :param logger: the logger instance.
@@ -239,13 +384,34 @@ def load_exon_lines(args, shelve_names, logger, min_length=0):
     If it is not met, the transcript will be discarded.
     :type min_length: int
 
-    :return: exon_lines
-    :rtype: collections.defaultdict[list]
+    :return: the names of the shelf DB files which have been created.
+    :rtype: list
     """
 
-    threads = min([len(args.json_conf["prepare"]["files"]["gff"]),
-                   args.json_conf["prepare"]["procs"]])
     strip_cds = args.json_conf["prepare"]["strip_cds"]
+    procs = args.json_conf["prepare"]["procs"]
+    jobs = []
+    chunked = collections.OrderedDict()
+    if args.json_conf["prepare"]["single"] is False and procs > 1:
+        chunk_size = args.json_conf["prepare"]["chunk_size"] * 2 ** 20
+        for new_shelf, label, strand_specific, gff_name in zip(
+                shelve_names,
+                args.json_conf["prepare"]["files"]["labels"],
+                args.json_conf["prepare"]["files"]["strand_specific_assemblies"],
+                args.json_conf["prepare"]["files"]["gff"]):
+            chunks = find_chunks(gff_name, chunk_size)
+            if len(chunks) == 1:
+                jobs.append((label, gff_name, strand_specific, new_shelf))
+                continue
+            logger.info("Dividing %s in %d chunks", gff_name, len(chunks))
+            key = (label, strand_specific, gff_name, new_shelf)
+            chunked[key] = []
+            for num, (start, end) in enumerate(chunks, 1):
+                chunk_shelf = __chunk_shelf(new_shelf, num)
+                chunked[key].append(chunk_shelf)
+                jobs.append((label, (gff_name, start, end), strand_specific, chunk_shelf))
+
+    threads = min([max(len(jobs), len(args.json_conf["prepare"]["files"]["gff"])), procs])
 
     if args.json_conf["prepare"]["single"] is True or threads == 1:
 
@@ -281,9 +447,10 @@ def load_exon_lines(args, shelve_names, logger, min_length=0):
 
             previous_file_ids[gff_handle.name] = new_ids
     else:
-        logger.info("Starting to load lines from %d files (using %d processes)",
-                    len(args.json_conf["prepare"]["files"]["gff"]), threads)
+        logger.info("Starting to load lines from %d files (%d chunks, using %d processes)",
+                    len(args.json_conf["prepare"]["files"]["gff"]), len(jobs), threads)
         submission_queue = multiprocessing.Queue(-1)
+        returnqueue = multiprocessing.Queue(-1)
 
         working_processes = [AnnotationParser(
             submission_queue,
@@ -291,27 +458,40 @@ def load_exon_lines(args, shelve_names, logger, min_length=0):
             _ + 1,
             log_level=args.level,
             min_length=min_length,
-            strip_cds=strip_cds) for _ in range(threads)]
+            strip_cds=strip_cds,
+            returnqueue=returnqueue) for _ in range(threads)]
 
         [_.start() for _ in working_processes]
-        for new_shelf, label, strand_specific, gff_name in zip(
-                shelve_names,
-                args.json_conf["prepare"]["files"]["labels"],
-                args.json_conf["prepare"]["files"]["strand_specific_assemblies"],
-                args.json_conf["prepare"]["files"]["gff"]):
-
-            submission_queue.put((label, gff_name, strand_specific, new_shelf))
+        for job in jobs:
+            submission_queue.put(job)
 
         submission_queue.put(("EXIT", "EXIT", "EXIT", "EXIT"))
 
+        # Collect the IDs found in each chunk. The queue has to be emptied before joining the processes.
+        results = dict()
+        while len(results) < len(jobs):
+            try:
+                shelf, new_ids, found_ids = returnqueue.get(timeout=1)
+            except queue.Empty:
+                if not any(_.is_alive() for _ in working_processes):
+                    break
+                continue
+            results[shelf] = (new_ids, found_ids)
+
         [_.join() for _ in working_processes]
 
+        try:
+            chunk_shelves = __collect_chunks(args, chunked, results, logger, min_length=min_length)
+        except Exception:
+            [os.remove(shelf) for shelves in chunked.values() for shelf in shelves if os.path.exists(shelf)]
+            raise
+        shelve_names = [shelf for new_shelf in shelve_names for shelf in chunk_shelves.get(new_shelf, [new_shelf])]
+
         tid_counter = Counter()
-        for shelf in shelve_names:
-            conn = sqlite3.connect(shelf)
-            cursor = conn.cursor()
-            tid_counter.update([_[0] for _ in cursor.execute("SELECT tid FROM dump")])
-            if tid_counter.most_common()[0][1] > 1:
+        for shelf_name in shelve_names:
+            with Shelf(shelf_name) as shelf:
+                tid_counter.update(shelf.tids)
+            if tid_counter and tid_counter.most_common(1)[0][1] > 1:
                 if set(args.json_conf["prepare"]["files"]["labels"]) == {""}:
                     exception = exceptions.RedundantNames(
                         """Found redundant names during multiprocessed file analysis.
@@ -330,7 +510,7 @@ def load_exon_lines(args, shelve_names, logger, min_length=0):
     logger.info("Finished loading lines from %d files",
                 len(args.json_conf["prepare"]["files"]["gff"]))
 
-    return
+    return shelve_names
 
 
 def prepare(args, logger):
@@ -341,7 +521,7 @@ def prepare(args, logger):
     :type logger: logging.Logger
     """
 
-    if not isinstance(args.json_conf["reference"]["genome"], (io.TextIOWrapper, pyfaidx.Fasta)):
+    if not isinstance(args.json_conf["reference"]["genome"], (io.TextIOWrapper, pyfaidx.Fasta, Genome)):
         if not (isinstance(args.json_conf["reference"]["genome"], str) and
                 os.path.exists(args.json_conf["reference"]["genome"])):
             logger.critical("Invalid FASTA file: %s",
@@ -351,7 +531,7 @@ def prepare(args, logger):
             pass
     else:
         args.json_conf["reference"]["genome"].close()
-        if isinstance(args.json_conf["reference"]["genome"], pyfaidx.Fasta):
+        if isinstance(args.json_conf["reference"]["genome"], (pyfaidx.Fasta, Genome)):
             args.json_conf["reference"]["genome"] = args.json_conf["reference"]["genome"].filename
         else:
             args.json_conf["reference"]["genome"] = args.json_conf["reference"]["genome"].name
@@ -371,7 +551,7 @@ def prepare(args, logger):
             for member in args.json_conf["prepare"]["files"]["gff"]]
 
     shelve_names = [path_join(args.json_conf["prepare"]["files"]["output_dir"],
-                              "mikado_shelf_{}.db".format(str(_).zfill(5))) for _ in
+                              "mikado_shelf_{}.shelf".format(str(_).zfill(5))) for _ in
                     range(len(args.json_conf["prepare"]["files"]["gff"]))]
 
     logger.propagate = False
@@ -396,17 +576,17 @@ def prepare(args, logger):
 
 
     logger.info("Loading reference file")
-    args.json_conf["reference"]["genome"] = pyfaidx.Fasta(args.json_conf["reference"]["genome"])
+    args.json_conf["reference"]["genome"] = Genome(args.json_conf["reference"]["genome"])
 
     logger.info("Finished loading genome file")
     logger.info("Started loading exon lines")
 
     shelf_stacks = dict()
     try:
-        load_exon_lines(args,
-                        shelve_names,
-                        logger,
-                        min_length=args.json_conf["prepare"]["minimum_length"])
+        shelve_names = load_exon_lines(args,
+                                       shelve_names,
+                                       logger,
+                                       min_length=args.json_conf["prepare"]["minimum_length"])
 
         logger.info("Finished loading exon lines")
 
@@ -414,20 +594,20 @@ def prepare(args, logger):
         sorter = functools.partial(
             store_transcripts,
             logger=logger,
-            keep_redundant=args.json_conf["prepare"]["keep_redundant"]
+            keep_redundant=args.json_conf["prepare"]["keep_redundant"],
+            collapse_contained=args.json_conf["prepare"]["collapse_contained"]
             # min_length=args.json_conf["prepare"]["minimum_length"]
         )
 
         try:
             for shelf in shelve_names:
-                conn = sqlite3.connect(shelf)
-                shelf_stacks[shelf] = {"conn": conn, "cursor": conn.cursor()}
-            # shelf_stacks = dict((_, shelve.open(_, flag="r")) for _ in shelve_names)
+                shelf_stacks[shelf] = Shelf(shelf)
         except Exception as exc:
             raise TypeError((shelve_names, exc))
         perform_check(sorter(shelf_stacks), shelf_stacks, args, logger)
     except Exception as exc:
         logger.exception(exc)
+        [shelf.close() for shelf in shelf_stacks.values()]
         __cleanup(args, shelve_names)
         logger.error("Mikado has encountered an error, exiting")
         # sys.exit(1)
@@ -437,6 +617,7 @@ def prepare(args, logger):
         args.listener.enqueue_sentinel()
 
     logger.setLevel(logging.INFO)
+    [shelf.close() for shelf in shelf_stacks.values()]
     __cleanup(args, shelve_names)
 
     logger.info("Finished")
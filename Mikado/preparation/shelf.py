@@ -0,0 +1,277 @@
+# coding: utf-8
+
+"""
+This module implements the temporary storage used by Mikado prepare for the transcripts of each input file.
+Each shelf is a binary file, which is written in streaming fashion and memory-mapped for reading:
+
+- a header (magic string);
+- the records of the transcripts, in the order in which they have been written. Each record is made of
+  a fixed-width header (the interned values of the identifier, chromosome, strand, source, parent and
+  strand-specificity, and the number of attributes, additional values and features), the interned
+  keys and values of the attributes and of any additional value, and for each feature its interned name,
+  the number of its segments and their coordinates as an array of 64-bit integers;
+- the index, sorted by chromosome, start and end (ties keep the order of insertion); each entry
+  reports the coordinates, strand and identifier of a transcript together with the offset of its record
+  and the fingerprint of its strand and exons (see the fingerprint function);
+- the table of the interned values, encoded as JSON;
+- a fixed-width footer with the offsets of the index and of the table.
+
+Values are interned as they are stored, so that e.g. the chromosome names, sources and attribute
+keys are written only once per shelf.
+"""
+
+import array
+import copy
+import hashlib
+import mmap
+import struct
+import sys
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+__author__ = 'Luca Venturini'
+
+
+_magic = b"MIKSHLF1"
+_footer = struct.Struct("<QQQQ8s")
+_header = struct.Struct("<IIIIIIHHH")
+_index = struct.Struct("<IqqIIQQ")
+_feature = struct.Struct("<II")
+_absent = 2 ** 32 - 1
+# Number of entries of the index read at once
+_index_block = 10000
+# Keys which are stored in the fixed-width header of each record
+_standard = ("tid", "chrom", "strand", "source", "parent", "strand_specific")
+
+
+def fingerprint(strand, exons):
+    """
+    Function to calculate the fingerprint of a transcript, ie a 64-bit hash of its strand and exons.
+    Transcripts with the same fingerprint are redundant. The fingerprint does not depend on the process
+    which calculates it, so that fingerprints of different shelves can be compared.
+    :param strand: the strand of the transcript.
+    :type strand: (str|None)
+    :param exons: the exons of the transcript, as (start, end) pairs, in any order.
+
+    :rtype: int
+    """
+
+    digest = hashlib.sha1(str(strand).encode())
+    digest.update(array.array("q", (coordinate for exon in sorted((exon[0], exon[1]) for exon in exons)
+                                    for coordinate in exon)).tobytes())
+    return int.from_bytes(digest.digest()[:8], "little")
+
+
+class ShelfWriter:
+
+    """
+    Class to write the transcripts into a shelf. The records are written as they are added;
+    the index and the table of the values are written when the shelf is closed.
+    """
+
+    def __init__(self, name):
+        """
+        :param name: the name of the shelf file. If it exists, it will be overwritten.
+        :type name: str
+        """
+
+        self.name = name
+        self.__handle = open(name, "wb")
+        self.__handle.write(_magic)
+        self.__position = len(_magic)
+        self.__values = []
+        self.__interned = dict()
+        self.__index = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.__index)
+
+    def intern(self, value):
+        """
+        Method to retrieve the position of a value within the table, adding it if necessary.
+        :param value: a JSON-serialisable value.
+        :rtype: int
+        """
+
+        # Strings are by far the most common values; other values are keyed by their type and JSON
+        # encoding, so that e.g. True and 1 are kept distinct.
+        key = value if isinstance(value, str) else (type(value).__name__, json.dumps(value))
+        try:
+            return self.__interned[key]
+        except KeyError:
+            self.__interned[key] = len(self.__values)
+            self.__values.append(value)
+            return self.__interned[key]
+
+    def __pairs(self, items):
+        """Private method to encode key/value pairs as an array of interned values."""
+        pairs = array.array("I")
+        for key, value in items:
+            pairs.append(self.intern(key))
+            pairs.append(self.intern(value))
+        return pairs
+
+    def add(self, tid, transcript, start, end):
+        """
+        Method to add a transcript to the shelf.
+        :param tid: the identifier of the transcript within the shelf.
+        :type tid: str
+        :param transcript: the dictionary of the transcript, as created by the annotation parsers.
+        It must contain at least the "chrom" and "features" keys.
+        :type transcript: dict
+        :param start: the start of the transcript.
+        :type start: int
+        :param end: the end of the transcript.
+        :type end: int
+        """
+
+        standard = [self.intern(transcript[key]) if key in transcript else _absent for key in _standard]
+        attributes = self.__pairs(transcript.get("attributes", dict()).items())
+        extra = self.__pairs((key, value) for key, value in transcript.items()
+                             if key not in _standard and key not in ("attributes", "features"))
+        features = transcript["features"]
+        chunks = [_header.pack(*(standard + [len(attributes) // 2, len(extra) // 2, len(features)])),
+                  attributes.tobytes(), extra.tobytes()]
+        for feature, segments in features.items():
+            chunks.append(_feature.pack(self.intern(feature), len(segments)))
+            coordinates = array.array("q", (coordinate for segment in segments for coordinate in segment))
+            chunks.append(coordinates.tobytes())
+
+        record = b"".join(chunks)
+        self.__index.append((transcript["chrom"], start, end, self.intern(transcript.get("strand")),
+                             self.intern(tid), self.__position,
+                             fingerprint(transcript.get("strand"), features.get("exon", []))))
+        self.__handle.write(record)
+        self.__position += len(record)
+
+    def close(self):
+        """Method to write the index, the table of the values and the footer, and close the file."""
+
+        if self.__handle.closed:
+            return
+        index_position = self.__position
+        # Stable sort, so that transcripts with the same coordinates keep the order of insertion
+        self.__index.sort(key=lambda entry: entry[:3])
+        for chrom, start, end, strand, tid, position, print_ in self.__index:
+            self.__handle.write(_index.pack(self.intern(chrom), start, end, strand, tid, position, print_))
+        table_position = index_position + _index.size * len(self.__index)
+        table = json.dumps(self.__values).encode()
+        self.__handle.write(table)
+        self.__handle.write(_footer.pack(index_position, len(self.__index), table_position, len(table), _magic))
+        self.__handle.close()
+
+
+class Shelf:
+
+    """
+    Class to read a shelf written by ShelfWriter. The file is memory-mapped, so that records are decoded
+    only when requested.
+    """
+
+    def __init__(self, name):
+        """
+        :param name: the name of the shelf file.
+        :type name: str
+        """
+
+        self.name = name
+        self.__handle = open(name, "rb")
+        self.__map = mmap.mmap(self.__handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.__map) < len(_magic) + _footer.size or self.__map[:len(_magic)] != _magic:
+            self.close()
+            raise ValueError("{} is not a valid shelf".format(name))
+        index_position, self.__count, table_position, table_length, magic = _footer.unpack_from(
+            self.__map, len(self.__map) - _footer.size)
+        if magic != _magic:
+            self.close()
+            raise ValueError("{} is not a valid shelf".format(name))
+        self.__index_position = index_position
+        self.__values = [sys.intern(value) if isinstance(value, str) else value
+                         for value in json.loads(self.__map[table_position:table_position + table_length].decode())]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.__count
+
+    def __iter__(self):
+        """
+        Iterate over the index of the shelf, in order of chromosome, start and end.
+        Each item is a tuple (chrom, start, end, strand, tid, position, fingerprint); the position
+        can be used to retrieve the transcript with the get method.
+        """
+
+        values = self.__values
+        end_position = self.__index_position + _index.size * self.__count
+        # The index is read in blocks, so that it is never loaded in memory as a whole
+        for block in range(self.__index_position, end_position, _index.size * _index_block):
+            for chrom, start, end, strand, tid, position, print_ in _index.iter_unpack(
+                    self.__map[block:min(block + _index.size * _index_block, end_position)]):
+                yield values[chrom], start, end, values[strand], values[tid], position, print_
+
+    def __value(self, position):
+        """Private method to retrieve a value from the table, copying it if mutable."""
+        value = self.__values[position]
+        if isinstance(value, (list, dict)):
+            return copy.deepcopy(value)
+        return value
+
+    def get(self, position):
+        """
+        Method to retrieve a transcript from its position in the shelf.
+        The transcript is returned as a dictionary, as created by the annotation parsers;
+        tuples (e.g. the segments of the features) are returned as lists.
+        :param position: the offset of the record, as reported by the index.
+        :type position: int
+        :rtype: dict
+        """
+
+        memory = self.__map
+        header = _header.unpack_from(memory, position)
+        position += _header.size
+        transcript = dict((key, self.__value(value)) for key, value in zip(_standard, header[:6])
+                          if value != _absent)
+        num_attributes, num_extra, num_features = header[6:]
+        for key, num in (("attributes", num_attributes), (None, num_extra)):
+            pairs = array.array("I")
+            pairs.frombytes(memory[position:position + pairs.itemsize * 2 * num])
+            position += pairs.itemsize * 2 * num
+            items = dict((self.__values[pairs[pos]], self.__value(pairs[pos + 1]))
+                         for pos in range(0, len(pairs), 2))
+            if key is None:
+                transcript.update(items)
+            else:
+                transcript[key] = items
+        transcript["features"] = dict()
+        for _ in range(num_features):
+            feature, num = _feature.unpack_from(memory, position)
+            position += _feature.size
+            coordinates = array.array("q")
+            coordinates.frombytes(memory[position:position + coordinates.itemsize * 2 * num])
+            position += coordinates.itemsize * 2 * num
+            transcript["features"][self.__values[feature]] = [
+                coordinates[pos:pos + 2].tolist() for pos in range(0, len(coordinates), 2)]
+        return transcript
+
+    @property
+    def tids(self):
+        """The identifiers of the transcripts in the shelf, in the order of the index."""
+        return [entry[4] for entry in self]
+
+    def close(self):
+        """Method to close the memory map and the file."""
+        if not self.__map.closed:
+            self.__map.close()
+        self.__handle.close()
@@ -0,0 +1,134 @@
+# coding: utf-8
+
+"""
+This module implements the cache of the comparisons between transcripts used during the
+analysis of the loci in Mikado pick. The same pair of transcripts is compared repeatedly
+while defining the subloci, the loci, the alternative splicing events and the fragments;
+the cache ensures that each comparison is computed only once.
+The comparisons are indexed by the identity and the structure (chromosome, strand and exons)
+of the two transcripts, which are all the values that the comparison depends upon; so that,
+for example, a copy of a transcript without its UTRs is not confused with the original.
+The cache has a maximum size: when it is full, the least recently used comparisons are discarded.
+"""
+
+import collections
+from .contrast import compare as c_compare
+from ..utilities import profiling
+
+__author__ = 'Luca Venturini'
+
+
+class ComparisonCache:
+
+    """
+    Least-recently-used cache of the results of Mikado.scales.contrast.compare.
+    """
+
+    def __init__(self, max_size=10000):
+        """
+        :param max_size: maximum number of comparisons to keep. If 0, comparisons are not cached.
+        :type max_size: int
+        """
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__cache = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.__cache)
+
+    @staticmethod
+    def signature(transcript):
+        """
+        Method to create the key of a transcript within the cache.
+        :param transcript: the transcript.
+        :type transcript: Mikado.transcripts.transcript.Transcript
+        :rtype: tuple
+        """
+
+        return (transcript.id, tuple(transcript.parent), transcript.chrom, transcript.strand,
+                tuple((exon[0], exon[1]) for exon in transcript.exons))
+
+    def compare(self, prediction, reference, lenient=False):
+        """
+        Method to compare two transcripts, retrieving the result from the cache if possible.
+        The arguments and the result are the same as Mikado.scales.contrast.compare;
+        the result must not be modified.
+
+        :param prediction: the transcript query
+        :param reference: the reference transcript
+        :param lenient: whether the exon-level features should be calculated leniently.
+        :rtype (ResultStorer, (int,int)) | (ResultStorer, None)
+        """
+
+        if self.max_size <= 0:
+            return c_compare(prediction, reference, lenient)
+
+        # Finalise the transcripts as the comparison would, so that their exons are sorted
+        prediction.finalize()
+        reference.finalize()
+        key = (self.signature(prediction), self.signature(reference), lenient)
+        try:
+            result = self.__cache[key]
+        except KeyError:
+            self.misses += 1
+            profiling.count("comparison_cache_misses")
+            result = c_compare(prediction, reference, lenient)
+            self.__cache[key] = result
+            if len(self.__cache) > self.max_size:
+                self.__cache.popitem(last=False)
+        else:
+            self.hits += 1
+            profiling.count("comparison_cache_hits")
+            self.__cache.move_to_end(key)
+        return result
+
+    def resize(self, max_size):
+        """
+        Method to change the maximum size of the cache, discarding the least recently used comparisons if needed.
+        :param max_size: maximum number of comparisons to keep. If 0, comparisons are not cached.
+        :type max_size: int
+        """
+
+        self.max_size = max_size
+        while len(self.__cache) > max(max_size, 0):
+            self.__cache.popitem(last=False)
+
+    def clear(self):
+        """Method to remove all the comparisons from the cache. The counters are not reset."""
+        self.__cache.clear()
+
+
+# Cache used by the current process
+_cache = ComparisonCache()
+
+
+def configure(max_size):
+    """
+    Function to set the maximum size of the cache of the current process.
+    :param max_size: maximum number of comparisons to keep. If 0, comparisons are not cached.
+    :type max_size: int
+    """
+
+    _cache.resize(max_size)
+
+
+def active():
+    """Function to retrieve the cache of the current process.
+    :rtype: ComparisonCache
+    """
+    return _cache
+
+
+def compare(prediction, reference, lenient=False):
+    """
+    Function to compare two transcripts using the cache of the current process.
+    See ComparisonCache.compare.
+    """
+    return _cache.compare(prediction, reference, lenient)
+
+
+def clear():
+    """Function to empty the cache of the current process, eg once a superlocus has been analysed."""
+    _cache.clear()
@@ -52,6 +52,23 @@ def check_run_options(args, logger=None):
 
     args.json_conf["pick"]["run_options"]["single_thread"] = args.single
 
+    if args.shard_input is True:
+        args.json_conf["pick"]["run_options"]["shard_input"] = True
+    if args.shard_size is not None:
+        args.json_conf["pick"]["run_options"]["shard_size"] = args.shard_size
+    if args.prefetch_window is not None:
+        args.json_conf["pick"]["run_options"]["prefetch_window"] = args.prefetch_window
+    if args.output_buffer is not None:
+        args.json_conf["pick"]["run_options"]["output_buffer"] = args.output_buffer
+    if args.resume is True:
+        args.json_conf["pick"]["run_options"]["resume"] = True
+    if args.slow_loci is not None:
+        args.json_conf["pick"]["run_options"]["slow_loci"] = args.slow_loci
+    if args.superlocus_cpu_budget is not None:
+        args.json_conf["pick"]["run_options"]["superlocus_cpu_budget"] = args.superlocus_cpu_budget
+    if args.superlocus_work_budget is not None:
+        args.json_conf["pick"]["run_options"]["superlocus_work_budget"] = args.superlocus_work_budget
+
     if args.no_cds is not False:
         args.json_conf["pick"]["run_options"]["exclude_cds"] = True
     if args.purge is not False:
@@ -98,7 +115,7 @@ def check_run_options(args, logger=None):
     if args.consider_truncated_for_retained is True:
         args.json_conf["pick"]["run_options"]["consider_truncated_for_retained"] = True
 
-    for key in ["loci_out", "gff", "monoloci_out", "subloci_out", "log"]:
+    for key in ["loci_out", "gff", "monoloci_out", "subloci_out", "profile_out", "log"]:
         if getattr(args, key):
             if key == "gff":
                 args.json_conf["pick"]["files"]["input"] = getattr(
@@ -229,6 +246,34 @@ def pick_parser():
     parser.add_argument("--single", action="store_true", default=False,
                         help="""Flag. If set, Creator will be launched with a single process.
                         Useful for debugging purposes only.""")
+    parser.add_argument("--shard-input", dest="shard_input", action="store_true", default=False,
+                        help="""Flag. If set, the input file will be split into independent regions
+                        which will be parsed directly by the worker processes. Ignored for compressed inputs.""")
+    parser.add_argument("--shard-size", dest="shard_size", type=int, default=None,
+                        help="""Approximate size, in bytes, of each region when --shard-input is set.
+                        Default: determined by the configuration file.""")
+    parser.add_argument("--prefetch-window", dest="prefetch_window", type=int, default=None,
+                        help="""Maximum span, in bps, of the groups of superloci whose data is retrieved
+                        together from the database. Set to 0 to disable. Default: determined by the configuration file.""")
+    parser.add_argument("--output-buffer", dest="output_buffer", type=int, default=None,
+                        help="""Maximum number of superloci which can be analysed ahead of the first one
+                        still to be written. Default: determined by the configuration file.""")
+    parser.add_argument("--resume", action="store_true", default=False,
+                        help="""Flag. If set, an interrupted multi-process run will be resumed from the last
+                        checkpoint recorded in its journal, rather than restarted.""")
+    parser.add_argument("--profile_out", type=str, default=None,
+                        help="""Optional JSON file to write the time spent in each stage of the analysis to.
+                        The slowest superloci are reported in a tabular file with the same prefix.""")
+    parser.add_argument("--slow-loci", dest="slow_loci", type=int, default=None,
+                        help="""Number of slowest superloci to report when profiling.
+                        Default: determined by the configuration file.""")
+    parser.add_argument("--superlocus-cpu-budget", dest="superlocus_cpu_budget", type=float, default=None,
+                        help="""Maximum CPU time, in seconds, to spend on each superlocus before switching
+                        to cheaper algorithms. Default: determined by the configuration file.""")
+    parser.add_argument("--superlocus-work-budget", dest="superlocus_work_budget", type=int, default=None,
+                        help="""Maximum estimated work (graph edges and AS comparisons) to spend on each
+                        superlocus before switching to cheaper algorithms.
+                        Default: determined by the configuration file.""")
     log_options = parser.add_argument_group("Log options")
     log_options.add_argument("-l", "--log", default=None,
                              help="""File to write the log to.
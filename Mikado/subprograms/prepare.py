@@ -128,7 +128,7 @@ def setup(args):
                 args.json_conf["prepare"]["files"]["labels"] = args.labels
 
     for option in ["out", "out_fasta",
-                   "minimum_length", "procs", "single"]:
+                   "minimum_length", "procs", "single", "chunk_size"]:
         if getattr(args, option) is None or getattr(args, option) is False:
             continue
         else:
@@ -144,6 +144,9 @@ def setup(args):
     if args.strip_cds is True:
         args.json_conf["prepare"]["strip_cds"] = True
 
+    if args.collapse_contained is True:
+        args.json_conf["prepare"]["collapse_contained"] = True
+
     if args.out is not None:
         args.json_conf["prepare"]["files"]["out"] = args.out
     if args.out_fasta is not None:
@@ -233,8 +236,14 @@ def prepare_parser():
     parser.add_argument("-p", "--procs",
                         help="Number of processors to use (default %(default)s)",
                         type=to_cpu_count, default=None)
+    parser.add_argument("--chunk-size", dest="chunk_size", default=None, type=positive,
+                        help="""Size, in MB, of the chunks in which large input files are divided
+                        to be parsed in parallel. Set to 0 to disable. Default: 100.""")
     parser.add_argument("-scds", "--strip_cds", action="store_true", default=False,
                         help="Boolean flag. If set, ignores any CDS/UTR segment.")
+    parser.add_argument("--collapse-contained", dest="collapse_contained", action="store_true", default=False,
+                        help="""Boolean flag. If set, transcripts whose exon chain is contained within that of
+                        another transcript will be removed as redundant.""")
     parser.add_argument("--labels", type=str, default="",
                         help="""Labels to attach to the IDs of the transcripts of the input files,
                         separated by comma.""")
@@ -8,6 +8,7 @@ Unit tests for the scales library
 import unittest
 import Mikado.loci
 import Mikado.scales
+from Mikado.scales import comparison_cache
 import argparse
 import os
 import Mikado.parsers
@@ -1308,6 +1309,48 @@ class AssignerTester(unittest.TestCase):
         result, _ = Mikado.scales.assigner.Assigner.compare(t1, t2)
         self.assertEqual(result.ccode, ("J",))
 
+    def test_comparison_cache(self):
+
+        t1 = Mikado.loci.Transcript()
+        t1.chrom, t1.strand, t1.id, t1.parent = "Chr1", "+", "t1.1", "t1"
+        t1.start, t1.end = 101, 5000
+        t1.add_exons([(101, 1000), (1501, 2000), (2301, 4000), (4501, 5000)])
+        t1.add_exons([(501, 1000), (1501, 2000), (2301, 4000), (4501, 4698)], features="CDS")
+        t1.finalize()
+
+        t2 = Mikado.loci.Transcript()
+        t2.chrom, t2.strand, t2.id, t2.parent = "Chr1", "+", "t2.1", "t2"
+        t2.start, t2.end = 1300, 4300
+        t2.add_exons([(1300, 2000), (2301, 4300)])
+        t2.finalize()
+
+        cache = comparison_cache.ComparisonCache(max_size=2)
+        result, _ = cache.compare(t2, t1)
+        self.assertEqual(result.ccode, ("C",))
+        self.assertIs(cache.compare(t2, t1)[0], result)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # The order of the transcripts matters
+        self.assertEqual(cache.compare(t1, t2)[0].ccode, ("J",))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+        # A copy without UTRs is a different transcript
+        t1_without_utr = t1.deepcopy()
+        t1_without_utr.remove_utrs()
+        result, _ = cache.compare(t2, t1_without_utr)
+        self.assertEqual(repr(result), repr(Mikado.scales.assigner.Assigner.compare(t2, t1_without_utr)[0]))
+        self.assertEqual(result.ref_id, ("t1.1",))
+        self.assertEqual(result.location, ("Chr1:501..4698",))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        # The least recently used comparison has been evicted
+        self.assertEqual(len(cache), 2)
+        cache.compare(t2, t1)
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+        cache.resize(0)
+        self.assertEqual(len(cache), 0)
+        cache.compare(t2, t1)
+        self.assertEqual((len(cache), cache.hits, cache.misses), (0, 1, 4))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,19 +5,28 @@ Very basic, all too basic test for some functionalities of locus-like classes.
 """
 
 import unittest
+import unittest.mock
+import collections
 import os.path
 import logging
+import time
 from Mikado.configuration import configurator
 from Mikado import exceptions
 from Mikado.parsers import GFF  # ,GTF, bed12
 from Mikado.parsers.GTF import GtfLine
+from Mikado.picking import loci_processer
 from Mikado.loci import Transcript, Superlocus, Abstractlocus, Locus, Monosublocus, MonosublocusHolder, Sublocus
 from Mikado.utilities.log_utils import create_null_logger, create_default_logger
-from Mikado.utilities import overlap
+from Mikado.utilities import overlap, merge_ranges
 from Mikado.utilities.intervaltree import Interval
+from Mikado.scales import comparison_cache
 import Mikado.loci
 import pickle
 import inspect
+import random
+import itertools
+import numpy
+from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
 from Mikado.parsers.bed12 import BED12
 
 
@@ -237,6 +246,211 @@ Chr1\tfoo\texon\t101\t600\t.\t-\t.\tID=tminus0:exon1;Parent=tminus0""".split("\n
                 loc.define_subloci()
                 self.assertEqual(len(loc.transcripts), 3 if not suspicious else 2)
 
+    def test_covered_bases(self):
+
+        random.seed(10)
+        self.assertEqual(Abstractlocus._covered_bases([]), 0)
+        for _ in range(100):
+            segments = []
+            for __ in range(random.randint(1, 20)):
+                start = random.randint(1, 500)
+                segments.append((start, start + random.randint(0, 50)))
+            self.assertEqual(Abstractlocus._covered_bases(segments),
+                             sum(end - start + 1 for start, end in merge_ranges(segments)),
+                             segments)
+
+    def test_budget(self):
+
+        transcripts = []
+        for tid, exons in (("t1", [(100, 200), (300, 500), (600, 1000)]),
+                           ("t2", [(100, 200), (300, 1000)]),
+                           ("t3", [(100, 200), (300, 505), (600, 1000)]),
+                           ("t4", [(150, 200), (300, 500), (600, 900)])):
+            transcript = Transcript()
+            transcript.chrom, transcript.strand, transcript.id, transcript.source = "1", "+", tid, "foo"
+            transcript.add_exons(exons)
+            transcript.finalize()
+            transcripts.append(transcript)
+
+        for work in (0, 100, 1):
+            with self.subTest(work=work):
+                jconf = configurator.to_json(None)
+                jconf["pick"]["run_options"]["superlocus_work_budget"] = work
+                loc = Superlocus(transcripts[0].deepcopy(), json_conf=jconf, logger=self.logger)
+                for transcript in transcripts[1:]:
+                    loc.add_transcript_to_locus(transcript.deepcopy())
+                loc.define_loci()
+                rows = list(loc.print_loci_metrics())
+                self.assertGreater(len(rows), 0)
+                if work == 0:
+                    self.assertEqual(loc.budget.degradations, [])
+                    self.assertFalse(any("budget_degradation" in row for row in rows))
+                elif work == 100:
+                    self.assertEqual(loc.budget.degradations, [])
+                    self.assertEqual(loc.approximation_level, 0)
+                    self.assertTrue(all(row["budget_degradation"] == "NA" for row in rows))
+                    self.assertNotIn("budget_degradation", str(loc))
+                else:
+                    # The transcript graph has more edges than the budget
+                    self.assertIn("subloci", loc.budget.degradations)
+                    self.assertGreater(loc.approximation_level, 0)
+                    degradations = ",".join(loc.budget.degradations)
+                    self.assertTrue(all(row["budget_degradation"] == degradations for row in rows))
+                    self.assertIn("budget_degradation={}".format(degradations), str(loc))
+                    for locus in loc.loci.values():
+                        self.assertEqual(locus.attributes["budget_degradation"], degradations)
+
+    def test_budget_scored_window(self):
+
+        metrics = ["cdna_length", "exon_num", "combined_cds_length"]
+        rows = numpy.random.RandomState(0).rand(100, len(metrics)) * 1000
+        regressor = RandomForestRegressor(n_estimators=5, random_state=0).fit(rows, rows[:, 0] / rows[:, 1])
+        regressor.metrics = metrics
+
+        jconf = configurator.to_json(None)
+        jconf["pick"]["run_options"]["superlocus_cpu_budget"] = 0.5
+        jconf["pick"]["alternative_splicing"]["report"] = True
+        superloci = []
+        for offset in (0, 10000):
+            loc = None
+            for tid, exons in (("t1", [(100, 200), (300, 500), (600, 1000)]),
+                               ("t2", [(100, 200), (300, 1000)]),
+                               ("t3", [(100, 200), (300, 505), (600, 1000)])):
+                transcript = Transcript()
+                transcript.chrom, transcript.strand, transcript.source = "1", "+", "foo"
+                transcript.id = "{}_{}".format(tid, offset)
+                transcript.add_exons([(start + offset, end + offset) for start, end in exons])
+                transcript.finalize()
+                if loc is None:
+                    loc = Superlocus(transcript, stranded=False, json_conf=jconf, logger=self.logger)
+                else:
+                    loc.add_transcript_to_locus(transcript)
+            loc.regressor = regressor
+            superloci.append(loc)
+
+        # Same order of operations as LociProcesser.__analyse_scored_window
+        data_dict = {"junctions": dict(), "hits": collections.defaultdict(list),
+                     "orfs": collections.defaultdict(list), "external": collections.defaultdict(dict)}
+        prepared = [loci_processer.prepare_locus(loc, jconf, self.logger, data_dict=data_dict)
+                    for loc in superloci]
+        loci_processer.score_subloci([stranded for item in prepared for stranded in item], self.logger)
+        # The first superlocus is expensive: the definition of its loci uses up more than the whole budget
+        expensive = prepared[0][0]
+        define_loci = expensive.define_loci
+
+        def burn():
+            start = time.process_time()
+            while time.process_time() - start < 1:
+                sum(range(1000))
+            define_loci()
+
+        with unittest.mock.patch.object(expensive, "define_loci", side_effect=burn):
+            first = loci_processer._finalise_locus(superloci[0], 0, prepared[0], jconf, None, self.logger)
+        second = loci_processer._finalise_locus(superloci[1], 1, prepared[1], jconf, None, self.logger)
+        self.assertEqual(first[0].budget.degradations, ["alternative_splicing"])
+        self.assertEqual(len(second), 1)
+        self.assertEqual(second[0].budget.degradations, [])
+        self.assertLess(second[0].budget.elapsed, 0.5)
+
+    def test_metrics_pass(self):
+
+        transcripts = []
+        for num, (exons, cds) in enumerate([
+                ([(101, 300), (401, 600), (801, 1000)], [(201, 300), (401, 600), (801, 899)]),
+                ([(101, 300), (401, 600), (701, 1000)], [(251, 300), (401, 600), (701, 749)]),
+                ([(151, 300), (401, 1000)], [(201, 300), (401, 498)]),
+                ([(101, 600), (801, 1000)], [])]):
+            transcript = Transcript()
+            transcript.chrom, transcript.strand, transcript.id = "Chr1", "+", "t{}".format(num)
+            transcript.add_exons(exons)
+            if cds:
+                transcript.add_exons(cds, features="CDS")
+            transcript.finalize()
+            transcripts.append(transcript)
+
+        def sublocus():
+            slocus = Sublocus(transcripts[0].copy(), json_conf=self.my_json, logger=self.logger)
+            for transcript in transcripts[1:]:
+                slocus.add_transcript_to_locus(transcript.copy())
+            return slocus
+
+        metrics = ["exon_fraction", "intron_fraction", "combined_cds_locus_fraction",
+                   "selected_cds_locus_fraction", "retained_fraction", "proportion_verified_introns_inlocus"]
+        by_pass, by_transcript = sublocus(), sublocus()
+        by_pass.get_metrics()
+        self.assertIsNone(by_pass._metrics_pass)
+        for tid in sorted(by_transcript.transcripts):
+            by_transcript.calculate_metrics(tid)
+        for tid in by_pass:
+            self.assertGreater(by_pass[tid].exon_fraction, 0)
+            for metric in metrics:
+                self.assertEqual(getattr(by_pass[tid], metric), getattr(by_transcript[tid], metric),
+                                 (tid, metric))
+        self.assertEqual(by_pass["t3"].combined_cds_locus_fraction, 0)
+
+    def test_evaluate_column(self):
+
+        values = [0, 0.5, 1, 2, 10]
+        column = numpy.array(values, dtype=numpy.float64)
+        for operator, value in itertools.product(("eq", "ne", "gt", "lt", "ge", "le"), (0, 1, 2.5)):
+            conf = {"operator": operator, "value": value}
+            self.assertEqual(list(Abstractlocus._evaluate_column(values, column, conf)),
+                             [Abstractlocus.evaluate(val, conf) for val in values], conf)
+        for conf in ({"operator": "within", "value": [0, 2]}, {"operator": "not in", "value": [1, 10]}):
+            self.assertEqual(list(Abstractlocus._evaluate_column(values, column, conf)),
+                             [Abstractlocus.evaluate(val, conf) for val in values], conf)
+
+    def test_batch_model_scores(self):
+
+        metrics = ["cdna_length", "exon_num", "combined_cds_length", "selected_cds_fraction",
+                   "has_start_codon", "exon_fraction"]
+        rows = numpy.random.RandomState(0).rand(200, len(metrics)) * 1000
+        regressor = RandomForestRegressor(n_estimators=10, random_state=0).fit(rows, rows[:, 0] / rows[:, 2])
+        classifier = RandomForestClassifier(n_estimators=10, random_state=0).fit(rows, rows[:, 1] > rows[:, 3])
+        for model in (regressor, classifier):
+            model.metrics = metrics
+        self.assertEqual(list(Abstractlocus.predict_scores(regressor, rows[:20])),
+                         list(regressor.predict(rows[:20])))
+        self.assertEqual(list(Abstractlocus.predict_scores(classifier, rows[:20])),
+                         list(classifier.predict_proba(rows[:20])[:, 1]))
+
+        transcripts = []
+        for num, (exons, cds) in enumerate([
+                ([(101, 300), (401, 600), (801, 1000)], [(201, 300), (401, 600), (801, 899)]),
+                ([(101, 300), (401, 600), (701, 1000)], [(251, 300), (401, 600), (701, 749)]),
+                ([(151, 300), (401, 1000)], [(201, 300), (401, 498)]),
+                ([(101, 600), (801, 1000)], []),
+                ([(2101, 2400), (2501, 2800)], [(2201, 2400), (2501, 2604)]),
+                ([(2151, 2400), (2601, 2900)], [])]):
+            transcript = Transcript()
+            transcript.chrom, transcript.strand, transcript.id = "Chr1", "+", "t{}".format(num)
+            transcript.add_exons(exons)
+            if cds:
+                transcript.add_exons(cds, features="CDS")
+            transcript.finalize()
+            transcripts.append(transcript)
+
+        def subloci(model):
+            first = Sublocus(transcripts[0].copy(), json_conf=self.my_json, logger=self.logger)
+            for transcript in transcripts[1:4]:
+                first.add_transcript_to_locus(transcript.copy())
+            second = Sublocus(transcripts[4].copy(), json_conf=self.my_json, logger=self.logger)
+            second.add_transcript_to_locus(transcripts[5].copy())
+            for slocus in (first, second):
+                slocus.regressor = model
+            return [first, second]
+
+        for model in (regressor, classifier):
+            independent, batched = subloci(model), subloci(model)
+            for slocus in independent:
+                slocus.calculate_scores()
+            Abstractlocus.calculate_batch_scores(batched)
+            for single, batch in zip(independent, batched):
+                self.assertTrue(batch.scores_calculated)
+                self.assertEqual(single.scores, batch.scores)
+                for tid in single:
+                    self.assertEqual(single[tid].score, batch[tid].score)
+
 
 class ASeventsTester(unittest.TestCase):
 
@@ -427,6 +641,52 @@ class ASeventsTester(unittest.TestCase):
         self.locus.add_transcript_to_locus(t3)
         self.assertEqual(len(self.locus.transcripts), 3, self.locus.transcripts)
 
+    def test_redundant_as_signature(self):
+
+        t2 = Transcript()
+        t2.chrom = "Chr1"
+        t2.strand = "+"
+        t2.score = 20
+        t2.id = "G2.1"
+        t2.parent = "G2"
+        t2.add_exons([(101, 500), (601, 700), (1001, 1300), (1401, 1460), (1501, 1600)],
+                     "exon")
+        t2.add_exons([(401, 500), (601, 700), (1001, 1300), (1401, 1440)],
+                     "CDS")
+        t2.finalize()
+
+        self.locus.add_transcript_to_locus(t2)
+        self.assertEqual(len(self.locus.transcripts), 2, self.locus.transcripts)
+
+        # Same intron chain of G2.1, different terminal exons
+        t3 = Transcript()
+        t3.chrom = "Chr1"
+        t3.strand = "+"
+        t3.score = 20
+        t3.id = "G3.1"
+        t3.parent = "G3"
+        t3.add_exons([(201, 500), (601, 700), (1001, 1300), (1401, 1460), (1501, 1630)],
+                     "exon")
+        t3.add_exons([(401, 500), (601, 700), (1001, 1300), (1401, 1440)],
+                     "CDS")
+        t3.finalize()
+        self.assertEqual(Locus.as_signature(t2), Locus.as_signature(t3))
+
+        # The candidate is rejected without being compared against G2.1
+        with unittest.mock.patch("Mikado.loci.locus.comparison_cache.compare",
+                                 wraps=comparison_cache.compare) as compare:
+            self.assertEqual(self.locus.is_alternative_splicing(t3)[:2], (False, "J"))
+            self.assertEqual([call[0][1].id for call in compare.call_args_list], ["G1.1"])
+
+        # "=" is not redundant any more
+        self.locus.json_conf["pick"]["alternative_splicing"]["redundant_ccodes"] = ["c", "_", "m"]
+        self.assertEqual(self.locus.is_alternative_splicing(t3)[:2], (True, "J"))
+
+        # The index is updated when transcripts are removed from the locus
+        self.locus.json_conf["pick"]["alternative_splicing"]["redundant_ccodes"] = ["c", "=", "_", "m"]
+        self.locus.remove_transcript_from_locus("G2.1")
+        self.assertEqual(self.locus.is_alternative_splicing(t3)[:2], (True, "J"))
+
     def test_lowscore(self):
 
         t2 = Transcript()
@@ -1529,6 +1789,60 @@ class RetainedIntronTester(unittest.TestCase):
         self.assertEqual(sup.transcripts["t2"].retained_intron_num, 0)
 
 
+class FragmentTester(unittest.TestCase):
+
+    logger = create_null_logger("fragments")
+
+    def setUp(self):
+
+        self.json_conf = configurator.to_json(None)
+        self.json_conf["pick"]["fragments"]["remove"] = False
+        self.json_conf["pick"]["fragments"]["max_distance"] = 2000
+
+        self.gene = Transcript()
+        self.gene.chrom, self.gene.strand, self.gene.id, self.gene.parent = "Chr1", "+", "G1.1", "G1"
+        self.gene.start, self.gene.end = 10001, 13000
+        self.gene.add_exons([(10001, 10300), (10701, 11000), (11101, 11500), (11801, 13000)], "exon")
+        self.gene.add_exons([(10101, 10300), (10701, 11000), (11101, 11500), (11801, 11902)], "CDS")
+        self.gene.finalize()
+
+    def fragment(self, tid, start, end, strand):
+        transcript = Transcript()
+        transcript.chrom, transcript.strand, transcript.id, transcript.parent = "Chr1", strand, tid, tid + ".gene"
+        transcript.start, transcript.end = start, end
+        transcript.add_exons([(start, end)], "exon")
+        transcript.finalize()
+        return transcript
+
+    def test_remove_fragments(self):
+
+        from Mikado.picking.loci_processer import remove_fragments
+        import types
+
+        fragments = {"upstream": (7801, 7900, "+"),  # 2100bps away
+                     "downstream": (14001, 14200, "+"),  # 1000bps away
+                     "inside": (10401, 10600, "-"),  # Intronic, opposite strand
+                     "far": (30001, 30200, "+")}
+
+        for max_distance, expected in ((2000, {"downstream", "inside"}),
+                                       (3000, {"downstream", "inside", "upstream"}),
+                                       (0, {"inside"})):
+            with self.subTest(max_distance=max_distance):
+                self.json_conf["pick"]["fragments"]["max_distance"] = max_distance
+                loci = [Locus(self.gene, json_conf=self.json_conf, logger=self.logger)]
+                for tid, (start, end, strand) in fragments.items():
+                    loci.append(Locus(self.fragment(tid, start, end, strand),
+                                      json_conf=self.json_conf, logger=self.logger))
+                stranded_loci = [types.SimpleNamespace(id="sl{}".format(num), loci={locus.id: locus})
+                                 for num, locus in enumerate(loci)]
+                list(remove_fragments(stranded_loci, self.json_conf, self.logger))
+                tagged = set(locus.primary_transcript_id for locus in loci if locus.is_fragment)
+                self.assertEqual(tagged, expected)
+                for locus in loci:
+                    if locus.is_fragment:
+                        self.assertEqual(locus.attributes["fragment_of"], "G1.1")
+
+
 class PicklingTest(unittest.TestCase):
 
     def setUp(self):
@@ -1,8 +1,12 @@
 import unittest
+import itertools
+import random
+import types
 
 import networkx
 
 from Mikado.transcripts.clique_methods import find_cliques, find_communities
+from Mikado.transcripts.clique_methods import define_graph, overlapping_pairs
 from Mikado.transcripts.clique_methods import reid_daid_hurley
 
 
@@ -81,5 +85,64 @@ class TestCliques(unittest.TestCase):
         with self.assertRaises(networkx.NetworkXError):
             _ = reid_daid_hurley(self.graph, 1)
 
+    def test_self_loops(self):
+
+        self.graph.add_edges_from([(3, 3), (12, 12)])
+        self.assertEqual(set(find_cliques(self.graph)), self.correct_cliques)
+        self.assertEqual(find_communities(self.graph), self.correct_communities)
+
+    def test_random_graphs(self):
+
+        for seed in range(50):
+            graph = networkx.gnp_random_graph(random.Random(seed).randint(0, 40), 0.3, seed=seed)
+            graph = networkx.relabel_nodes(graph, dict((node, "t{}".format(node)) for node in graph))
+            self.assertEqual(set(find_cliques(graph)),
+                             set(frozenset(clique) for clique in networkx.find_cliques_recursive(graph)),
+                             seed)
+            self.assertEqual(find_communities(graph),
+                             set(frozenset(comm) for comm in networkx.connected_components(graph)),
+                             seed)
+            communities = set(frozenset(comm) for comm in networkx.k_clique_communities(graph, 3))
+            found = set.union(set(), *communities)
+            communities.update(frozenset([node]) for node in graph if node not in found)
+            self.assertEqual(reid_daid_hurley(graph, 3), communities, seed)
+
+
+class TestDefineGraph(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(5)
+        self.objects = dict()
+        for num in range(200):
+            start = random.randint(1, 5000)
+            self.objects["t{}".format(num)] = types.SimpleNamespace(
+                start=start, end=start + random.randint(0, 300))
+
+    @staticmethod
+    def overlapping(first, second):
+        return first.start <= second.end and second.start <= first.end
+
+    def test_overlapping_pairs(self):
+
+        expected = [(first, second) for first, second in itertools.combinations(self.objects, 2)
+                    if self.overlapping(self.objects[first], self.objects[second])]
+        self.assertEqual(overlapping_pairs(self.objects), expected)
+        # Intervals touching in a single base are overlapping
+        touching = {"a": types.SimpleNamespace(start=1, end=10), "b": types.SimpleNamespace(start=10, end=20),
+                    "c": types.SimpleNamespace(start=21, end=30)}
+        self.assertEqual(overlapping_pairs(touching), [("a", "b")])
+
+    def test_same_graph(self):
+
+        def inters(first, second, distance=0):
+            return self.overlapping(first, second) and abs(first.start - second.start) >= distance
+
+        for distance in (0, 50):
+            graph = define_graph(self.objects, inters, distance=distance)
+            swept = define_graph(self.objects, inters, overlapping_only=True, distance=distance)
+            self.assertEqual(list(graph.nodes()), list(swept.nodes()))
+            self.assertEqual(list(graph.edges()), list(swept.edges()))
+            self.assertGreater(graph.number_of_edges(), 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -14,7 +14,10 @@ import sqlite3
 import Mikado.serializers.junction
 import Mikado.serializers.blast_serializer
 import Mikado.serializers.orf
+import Mikado.picking.preload_store
 import shutil
+import pickle
+import tempfile
 import pkg_resources
 
 
@@ -127,5 +130,57 @@ class TestDbConnect(unittest.TestCase):
         self.assertEqual(str(connector.url), "sqlite:///:memory:")
 
 
+class TestPreloadStore(unittest.TestCase):
+
+    def setUp(self):
+        self.json = Mikado.configuration.configurator.to_json(
+            os.path.join(os.path.dirname(__file__), "configuration.yaml"))
+        self.json["db_settings"]["db"] = pkg_resources.resource_filename("Mikado.tests",
+                                                                         "mikado.db")
+        engine = Mikado.utilities.dbutils.connect(self.json)
+        session = sqlalchemy.orm.sessionmaker(bind=engine)()
+        self.junctions = dict(((junc.chrom, junc.junction_start, junc.junction_end), junc.strand)
+                              for junc in session.query(Mikado.serializers.junction.Junction))
+        self.orfs = dict()
+        for orf in session.query(Mikado.serializers.orf.Orf):
+            self.orfs.setdefault(orf.query, []).append(orf.as_bed12())
+        self.hits = {"foo": [{"target": "bar", "evalue": 10**-5, "hsps": [{"hsp_evalue": 10**-5}]}]}
+        self.external = {"foo": {"source1": 1.0, "source2": 0.5}}
+        self.store = Mikado.picking.preload_store.create_store(self.junctions, self.orfs, self.hits,
+                                                               self.external, directory=tempfile.gettempdir())
+
+    def tearDown(self):
+        Mikado.picking.preload_store.release_store(self.store.filename)
+        self.assertFalse(os.path.exists(self.store.filename))
+
+    def test_junctions(self):
+        junctions = self.store.data_dict["junctions"]
+        self.assertEqual(len(junctions), len(self.junctions))
+        self.assertEqual(dict(junctions.items()), self.junctions)
+        chrom, start, end = next(iter(self.junctions))
+        self.assertNotIn((chrom, start, end + 1), junctions)
+        self.assertNotIn(("foo", start, end), junctions)
+        with self.assertRaises(KeyError):
+            _ = junctions[(chrom, start - 1, end)]
+
+    def test_queries(self):
+        data_dict = self.store.data_dict
+        self.assertEqual(sorted(data_dict["orfs"].keys()), sorted(self.orfs.keys()))
+        for query, orfs in self.orfs.items():
+            self.assertEqual([str(_) for _ in data_dict["orfs"][query]], [str(_) for _ in orfs])
+            self.assertEqual([_.cds_len for _ in data_dict["orfs"][query]], [_.cds_len for _ in orfs])
+            self.assertNotIn(query, data_dict["hits"])
+        self.assertNotIn("foo", data_dict["orfs"])
+        self.assertEqual(data_dict["hits"]["foo"], self.hits["foo"])
+        self.assertEqual(data_dict["external"]["foo"], self.external["foo"])
+        self.assertEqual(len(data_dict["external"]), 1)
+        self.assertNotIn(None, data_dict["external"])
+
+    def test_pickling(self):
+        data_dict = pickle.loads(pickle.dumps(self.store.data_dict))
+        self.assertIs(data_dict["orfs"].store, self.store)
+        self.assertLess(len(pickle.dumps(self.store)), 500)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,13 +1,23 @@
+import collections
+import copy
 import csv
 import glob
 import gzip
 import itertools
+import json
 import logging
+import logging.handlers
+import multiprocessing
 import os
+import pickle
+import queue
 import random
+import shutil
 import sys
 import tempfile
+import threading
 import unittest
+import unittest.mock
 
 import pkg_resources
 import pyfaidx
@@ -17,9 +27,12 @@ import Mikado.daijin
 import Mikado.subprograms.configure
 from Mikado.configuration import configurator, daijin_configurator
 from Mikado.parsers import to_gff
-from Mikado.picking import picker
-from Mikado.preparation import prepare
+from Mikado.exceptions import UnsortedInput
+from Mikado.picking import journal, loci_processer, loci_writer, packing, picker, prefetch, shards
+from Mikado.preparation import annotation_parser, prepare, shelf
+from Mikado.preparation.genome import Genome
 from Mikado.scales.compare import compare, load_index
+from Mikado.utilities import dbutils
 from Mikado.subprograms.util.stats import Calculator
 from Mikado.transcripts.transcript import Namespace
 from Mikado.utilities.log_utils import create_null_logger
@@ -188,6 +201,301 @@ class PrepareCheck(unittest.TestCase):
                                        "mikado_prepared.fasta.fai"))
 
 
+class PrepareChunksCheck(unittest.TestCase):
+
+    """Tests for the parallel parsing of the chunks of the input files of Mikado prepare."""
+
+    def setUp(self):
+        self.conf = configurator.to_json(None)
+        self.logger = create_null_logger("prepare_chunks")
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        logging.shutdown()
+
+    @staticmethod
+    def __rows(shelves):
+        rows = []
+        for name in shelves:
+            with shelf.Shelf(name) as current:
+                rows.extend(entry[:5] + (current.get(entry[5]),) for entry in current)
+        return rows
+
+    def __load(self, gff, procs, chunk_size=2000):
+        """Load the exon lines of a file, dividing it in chunks of the given size (in bytes)."""
+
+        args = Namespace()
+        args.json_conf = self.conf
+        args.json_conf["prepare"]["files"]["gff"] = [gff]
+        args.json_conf["prepare"]["files"]["labels"] = [""]
+        args.json_conf["prepare"]["files"]["strand_specific_assemblies"] = [False]
+        args.json_conf["prepare"]["procs"] = procs
+        args.level = "WARNING"
+        args.logging_queue = multiprocessing.Queue(-1)
+        listener = logging.handlers.QueueListener(args.logging_queue, self.logger)
+        listener.start()
+        shelf = os.path.join(self.tempdir.name, "mikado_shelf_{}.shelf".format(procs))
+        with unittest.mock.patch("Mikado.preparation.prepare.find_chunks",
+                                 side_effect=lambda name, _: annotation_parser.find_chunks(name, chunk_size)):
+            shelves = prepare.load_exon_lines(args, [shelf], self.logger)
+        listener.stop()
+        return shelves
+
+    def test_find_chunks(self):
+
+        for test_file in ("trinity.gff3", "trinity.gtf", "cufflinks.gtf"):
+            with self.subTest(test_file=test_file):
+                name = pkg_resources.resource_filename("Mikado.tests", test_file)
+                size = os.stat(name).st_size
+                self.assertEqual(annotation_parser.find_chunks(name, 0), [(0, size)])
+                self.assertEqual(annotation_parser.find_chunks(name, size), [(0, size)])
+                chunks = annotation_parser.find_chunks(name, 2000)
+                self.assertGreater(len(chunks), 1)
+                self.assertEqual(chunks[0][0], 0)
+                self.assertEqual(chunks[-1][1], size)
+                self.assertTrue(all(first[1] == second[0] for first, second in zip(chunks, chunks[1:])))
+
+    def test_chunks_equal_whole_file(self):
+
+        for test_file in ("trinity.gff3",
+                          "trinity.match_matchpart.gff3",
+                          "trinity.cDNA_match.gff3",
+                          "trinity.gtf",
+                          "cufflinks.gtf"):
+            with self.subTest(test_file=test_file):
+                name = pkg_resources.resource_filename("Mikado.tests", test_file)
+                whole = self.__load(name, procs=1)
+                chunked = self.__load(name, procs=2)
+                self.assertEqual(len(whole), 1)
+                self.assertGreater(len(chunked), 1)
+                self.assertEqual(self.__rows(chunked), self.__rows(whole))
+
+    def test_ungrouped_file(self):
+
+        """If a transcript is split between chunks, the file has to be parsed as a whole."""
+
+        with open(pkg_resources.resource_filename("Mikado.tests", "trinity.gtf")) as original:
+            lines = original.readlines()
+        name = os.path.join(self.tempdir.name, "ungrouped.gtf")
+        with open(name, "wt") as ungrouped:
+            ungrouped.writelines(lines[:1] + lines[2:] + lines[1:2])
+
+        whole = self.__load(name, procs=1)
+        chunked = self.__load(name, procs=2)
+        self.assertEqual(chunked, [os.path.join(self.tempdir.name, "mikado_shelf_2.shelf")])
+        self.assertEqual(sorted(self.__rows(chunked)), sorted(self.__rows(whole)))
+        self.assertEqual(os.listdir(self.tempdir.name).count("mikado_shelf_2_00001.shelf"), 0)
+
+
+class PrepareShelfCheck(unittest.TestCase):
+
+    """Tests for the binary shelves used by Mikado prepare to store the transcripts."""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.name = os.path.join(self.tempdir.name, "test.shelf")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_roundtrip(self):
+
+        transcripts = [
+            ("t2", {"chrom": "Chr1", "strand": "+", "source": "foo", "tid": "t2", "parent": "t2.gene",
+                    "strand_specific": True, "attributes": {"gene_id": "t2.gene", "exon_number": 1,
+                                                            "Parent": ["t2.gene"], "flag": True},
+                    "features": {"exon": [(100, 200), (300, 400)], "CDS": [(150, 200), (300, 350)]}},
+             100, 400),
+            ("t1", {"chrom": "Chr1", "strand": "-", "source": "foo", "tid": "t1", "parent": "t1.gene",
+                    "strand_specific": False, "attributes": {"gene_id": "t1.gene", "score": 1.5},
+                    "features": {"exon": [(100, 200), (300, 400)]}, "exon": []},
+             100, 400),
+            ("t0", {"chrom": "Chr1", "strand": None, "tid": "t0", "parent": "t0.gene",
+                    "attributes": {}, "features": {"exon": [(10, 5000000000)]}},
+             10, 5000000000),
+            ("t3", {"chrom": "Chr0", "strand": "+", "source": "bar", "tid": "t3", "parent": "t3.gene",
+                    "strand_specific": False, "attributes": {"gene_id": 1},
+                    "features": {"exon": [(1000, 2000)]}},
+             1000, 2000)]
+
+        with shelf.ShelfWriter(self.name) as writer:
+            for tid, transcript, start, end in transcripts:
+                writer.add(tid, transcript, start, end)
+            self.assertEqual(len(writer), 4)
+
+        with shelf.Shelf(self.name) as reader:
+            self.assertEqual(len(reader), 4)
+            index = list(reader)
+            # Sorted by chromosome, start and end; ties keep the order of insertion
+            self.assertEqual([entry[:5] for entry in index],
+                             [("Chr0", 1000, 2000, "+", "t3"),
+                              ("Chr1", 10, 5000000000, None, "t0"),
+                              ("Chr1", 100, 400, "+", "t2"),
+                              ("Chr1", 100, 400, "-", "t1")])
+            self.assertEqual(reader.tids, ["t3", "t0", "t2", "t1"])
+            for (tid, transcript, _, __), entry in zip(transcripts, [index[2], index[3], index[1], index[0]]):
+                with self.subTest(tid=tid):
+                    # The transcripts are retrieved as they would be after a JSON round trip
+                    self.assertEqual(reader.get(entry[5]), json.loads(json.dumps(transcript)))
+
+            # Values are not shared between different transcripts
+            first = reader.get(index[2][5])
+            first["attributes"]["Parent"].append("foo")
+            self.assertEqual(reader.get(index[2][5])["attributes"]["Parent"], ["t2.gene"])
+
+    def test_merge(self):
+
+        """The shelves are merged in order of coordinates, removing the redundant transcripts of each position."""
+
+        def transcript(tid, chrom, strand, exons):
+            return {"chrom": chrom, "strand": strand, "tid": tid, "parent": tid + ".gene",
+                    "attributes": {}, "features": {"exon": exons}}
+
+        contents = [[("a1", "Chr2", "+", [(100, 200), (300, 400)]),
+                     ("a2", "Chr1", "+", [(500, 600)]),
+                     ("a3", "Chr1", "+", [(100, 200), (300, 400)])],
+                    [("b1", "Chr1", "+", [(100, 200), (300, 400)]),
+                     ("b2", "Chr1", "-", [(100, 200), (300, 400)]),
+                     ("b3", "Chr1", "+", [(100, 250), (300, 400)]),
+                     ("b4", "Chr1", "+", [(50, 600)])]]
+        shelf_stacks = dict()
+        for num, content in enumerate(contents):
+            name = os.path.join(self.tempdir.name, "{}.shelf".format(num))
+            with shelf.ShelfWriter(name) as writer:
+                for tid, chrom, strand, exons in content:
+                    writer.add(tid, transcript(tid, chrom, strand, exons), exons[0][0], exons[-1][1])
+            shelf_stacks[name] = shelf.Shelf(name)
+
+        logger = create_null_logger("merge")
+        merged = [(tid[0], chrom, key) for tid, chrom, key in prepare.store_transcripts(
+            shelf_stacks, logger, keep_redundant=True)]
+        self.assertEqual(merged, [("b4", "Chr1", (50, 600)),
+                                  ("a3", "Chr1", (100, 400)),
+                                  ("b1", "Chr1", (100, 400)),
+                                  ("b2", "Chr1", (100, 400)),
+                                  ("b3", "Chr1", (100, 400)),
+                                  ("a2", "Chr1", (500, 600)),
+                                  ("a1", "Chr2", (100, 400))])
+
+        for _ in range(5):
+            merged = [tid[0] for tid, chrom, key in prepare.store_transcripts(
+                shelf_stacks, logger, keep_redundant=False)]
+            self.assertEqual(len(merged), 6)
+            self.assertIn(merged[1], ("a3", "b1"))
+            self.assertEqual(merged[:1] + merged[2:], ["b4", "b2", "b3", "a2", "a1"])
+        [_.close() for _ in shelf_stacks.values()]
+
+    def test_fingerprint(self):
+
+        exons = [(100, 200), (300, 400)]
+        self.assertEqual(shelf.fingerprint("+", exons), shelf.fingerprint("+", [[300, 400], [100, 200]]))
+        self.assertNotEqual(shelf.fingerprint("+", exons), shelf.fingerprint("-", exons))
+        self.assertNotEqual(shelf.fingerprint("+", exons), shelf.fingerprint(None, exons))
+        self.assertNotEqual(shelf.fingerprint("+", exons), shelf.fingerprint("+", [(100, 200), (301, 400)]))
+        self.assertNotEqual(shelf.fingerprint("+", exons), shelf.fingerprint("+", [(100, 400)]))
+
+        with shelf.ShelfWriter(self.name) as writer:
+            writer.add("t1", {"chrom": "Chr1", "strand": "+", "features": {"exon": exons}}, 100, 400)
+        with shelf.Shelf(self.name) as reader:
+            self.assertEqual([entry[6] for entry in reader], [shelf.fingerprint("+", exons)])
+
+    def test_contained(self):
+
+        outer = ("+", [(100, 200), (300, 400), (500, 600), (700, 800)])
+        for inner, expected in [(("+", [(150, 200), (300, 400), (500, 550)]), True),
+                                (("+", [(300, 400), (500, 800)]), False),
+                                (("+", [(300, 400), (500, 600)]), True),
+                                (("-", [(300, 400), (500, 600)]), False),
+                                (("+", [(50, 200), (300, 400)]), False),
+                                (("+", [(150, 200), (300, 350)]), True),
+                                (("+", [(150, 200), (310, 400), (500, 550)]), False),
+                                (("+", [(150, 200), (500, 550)]), False),
+                                (("+", [(550, 580)]), True),
+                                (("+", [(550, 650)]), False),
+                                (("+", outer[1]), True),
+                                (("+", outer[1] + [(900, 1000)]), False)]:
+            with self.subTest(inner=inner):
+                self.assertEqual(prepare.is_contained(outer, inner), expected)
+
+    def test_collapse_contained(self):
+
+        contents = [("t1", "+", [(100, 200), (300, 400), (500, 600)]),
+                    ("t2", "+", [(100, 200), (300, 400)]),
+                    ("t3", "+", [(150, 200), (300, 400), (500, 550)]),
+                    ("t4", "-", [(150, 200), (300, 400)]),
+                    ("t5", "+", [(320, 380)]),
+                    ("t6", "+", [(320, 450)]),
+                    ("t7", "+", [(100, 200), (300, 420), (500, 600)]),
+                    ("t8", "+", [(700, 800), (900, 1000)])]
+        with shelf.ShelfWriter(self.name) as writer:
+            for tid, strand, exons in contents:
+                writer.add(tid, {"chrom": "Chr1", "strand": strand, "features": {"exon": exons}},
+                           exons[0][0], exons[-1][1])
+
+        logger = create_null_logger("collapse")
+        with shelf.Shelf(self.name) as reader:
+            shelf_stacks = {self.name: reader}
+            self.assertEqual([tid[0] for tid, _, __ in prepare.store_transcripts(shelf_stacks, logger)],
+                             ["t2", "t1", "t7", "t4", "t3", "t5", "t6", "t8"])
+            self.assertEqual([tid[0] for tid, _, __ in prepare.store_transcripts(
+                shelf_stacks, logger, collapse_contained=True)], ["t1", "t7", "t4", "t6", "t8"])
+            self.assertEqual(len(list(prepare.store_transcripts(
+                shelf_stacks, logger, keep_redundant=True, collapse_contained=True))), 8)
+
+    def test_invalid(self):
+
+        with open(self.name, "wb") as invalid:
+            invalid.write(b"SQLite format 3" + bytes(100))
+        with self.assertRaises(ValueError):
+            shelf.Shelf(self.name)
+
+
+class PrepareGenomeCheck(unittest.TestCase):
+
+    """Tests for the memory-mapped access to the genome used by Mikado prepare."""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        rand = random.Random(10)
+        self.sequences = collections.OrderedDict(
+            (name, "".join(rand.choice("ACGTNacgt") for _ in range(length)))
+            for name, length in [("Chr1", 1000), ("Chr2", 61), ("Chr3", 60), ("Chr4", 7)])
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def __write(self, name, line_length, newline="\n"):
+        name = os.path.join(self.tempdir.name, name)
+        with open(name, "wt", newline="") as out:
+            for chrom, seq in self.sequences.items():
+                out.write(">{} description{}".format(chrom, newline))
+                for pos in range(0, len(seq), line_length):
+                    out.write(seq[pos:pos + line_length] + newline)
+        return name
+
+    def test_fetch(self):
+
+        for line_length, newline in ((60, "\n"), (80, "\n"), (60, "\r\n"), (1000, "\n")):
+            with self.subTest(line_length=line_length, newline=newline):
+                name = self.__write("genome_{}_{}.fa".format(line_length, len(newline)), line_length, newline)
+                fasta = pyfaidx.Fasta(name)
+                genome = Genome(name)
+                self.assertEqual(sorted(genome.keys()), sorted(self.sequences.keys()))
+                self.assertIn("Chr1", genome)
+                self.assertNotIn("Chr5", genome)
+                for chrom, seq in self.sequences.items():
+                    for start, end in [(1, len(seq)), (1, 1), (len(seq), len(seq)), (2, 59), (60, 61),
+                                       (59, 122), (3, len(seq) + 10), (len(seq) + 1, len(seq) + 5)]:
+                        self.assertEqual(genome.fetch(chrom, start, end), seq[start - 1:end])
+                        self.assertEqual(genome.fetch(chrom, start, end), str(fasta[chrom][start - 1:end]))
+                # When pickled, the genome is mapped again
+                genome = pickle.loads(pickle.dumps(genome))
+                self.assertEqual(genome.fetch("Chr1", 100, 300), self.sequences["Chr1"][99:300])
+                genome.close()
+                fasta.close()
+
+
 class CompareCheck(unittest.TestCase):
 
     """Test to check that compare interacts correctly with match, match_part, cDNA_match"""
@@ -456,6 +764,284 @@ class PickTest(unittest.TestCase):
 
         [os.remove(_) for _ in glob.glob(os.path.join(tempfile.gettempdir(), "mikado.multiproc.") + "*")]
 
+    def test_preload_multi_proc(self):
+        json_conf = configurator.to_json(None)
+        json_conf["pick"]["run_options"]["procs"] = 2
+        json_conf["pick"]["run_options"]["preload"] = True
+        json_conf["pick"]["files"]["input"] = pkg_resources.resource_filename("Mikado.tests",
+                                                                              "mikado_prepared.gtf")
+        outdir = tempfile.mkdtemp()
+        json_conf["pick"]["files"]["output_dir"] = outdir
+        json_conf["pick"]["files"]["loci_out"] = "mikado.preload.loci.gff3"
+        json_conf["pick"]["files"]["log"] = "mikado.preload.log"
+        json_conf["db_settings"]["db"] = pkg_resources.resource_filename("Mikado.tests", "mikado.db")
+        json_conf["log_settings"]["log_level"] = "WARNING"
+
+        pick_caller = picker.Picker(json_conf=json_conf)
+        with self.assertRaises(SystemExit), self.assertLogs("main_logger", "INFO"):
+            pick_caller()
+        with to_gff(os.path.join(outdir, "mikado.preload.loci.gff3")) as inp_gff:
+            lines = [_ for _ in inp_gff if not _.header is True]
+            self.assertGreater(len([_ for _ in lines if _.is_transcript is True]), 0)
+            self.assertGreater(len([_ for _ in lines if _.feature == "CDS"]), 0)
+        # The preload store must have been removed
+        self.assertEqual(glob.glob(os.path.join(outdir, "mikado_preload_*")), [])
+        shutil.rmtree(outdir)
+
+    def test_sharded_superloci(self):
+
+        json_conf = configurator.to_json(None)
+        input_file = pkg_resources.resource_filename("Mikado.tests", "mikado_prepared.gtf")
+        flank = json_conf["pick"]["clustering"]["flank"]
+
+        whole = shards.index_input(input_file, flank=flank, shard_size=10**9)
+        self.assertEqual(len(whole), 1)
+        expected = [(counter, sorted(slocus.transcripts.keys()))
+                    for slocus, counter in shards.shard_superloci(whole[0], json_conf)]
+        self.assertGreater(len(expected), 1)
+        self.assertEqual(sum(len(_[1]) for _ in expected),
+                         len(set(_.transcript for _ in to_gff(input_file) if _.is_transcript)))
+
+        split = shards.index_input(input_file, flank=flank, shard_size=1)
+        self.assertGreater(len(split), 1)
+        self.assertEqual([(_.start, _.end) for _ in split][1:],
+                         [(split[num].end, split[num + 1].end) for num in range(len(split) - 1)])
+        found = [(counter, sorted(slocus.transcripts.keys()))
+                 for shard in split for slocus, counter in shards.shard_superloci(shard, json_conf)]
+        self.assertEqual(expected, found)
+
+    def test_packed_superloci(self):
+
+        json_conf = configurator.to_json(None)
+        input_file = pkg_resources.resource_filename("Mikado.tests", "mikado_prepared.gtf")
+        superloci = [slocus for shard in shards.index_input(input_file)
+                     for slocus, _ in shards.shard_superloci(shard, json_conf)]
+
+        # Add a coding superlocus
+        coding = Mikado.transcripts.Transcript()
+        coding.chrom, coding.strand, coding.start, coding.end = "Chr1", "+", 101, 1000
+        coding.id, coding.parent = "t1", "g1"
+        coding.add_exons([(101, 300), (401, 600), (801, 1000)])
+        coding.add_exons([(201, 300), (401, 600), (801, 899)], features="CDS", phases=[0, 2, 0])
+        coding.finalize()
+        self.assertTrue(coding.is_coding)
+        superloci.append(Mikado.loci.Superlocus(coding, stranded=False, json_conf=json_conf))
+
+        for slocus in superloci:
+            with self.subTest(slocus=slocus.id):
+                packed = packing.pack_superlocus(slocus)
+                self.assertNotIn("json_conf", str(packed))
+                unpacked = packing.unpack_superlocus(pickle.loads(pickle.dumps(packed)), json_conf)
+                self.assertEqual(unpacked.id, slocus.id)
+                self.assertEqual(list(unpacked.transcripts.keys()), list(slocus.transcripts.keys()))
+                for tid in slocus:
+                    self.assertEqual(unpacked[tid].as_dict(remove_attributes=False),
+                                     slocus[tid].as_dict(remove_attributes=False))
+                    self.assertEqual(str(unpacked[tid]), str(slocus[tid]))
+                    self.assertEqual(unpacked[tid].phases, slocus[tid].phases)
+
+    def test_prefetch_window(self):
+
+        json_conf = configurator.to_json(None)
+        json_conf["db_settings"]["db"] = pkg_resources.resource_filename("Mikado.tests", "mikado.db")
+        input_file = pkg_resources.resource_filename("Mikado.tests", "mikado_prepared.gtf")
+        engine = dbutils.connect(json_conf)
+
+        def superloci():
+            return [(slocus, counter) for shard in shards.index_input(input_file)
+                    for slocus, counter in shards.shard_superloci(shard, json_conf)]
+
+        windows = list(prefetch.windows(superloci(), 10**6))
+        self.assertEqual(len(windows), 1)
+        self.assertEqual(len(list(prefetch.windows(superloci(), 0))), len(windows[0]))
+        prefetcher = prefetch.Prefetcher(engine, json_conf)
+        data_dict = prefetcher.fetch([_[0] for _ in windows[0]])
+        self.assertGreater(len(data_dict["junctions"]), 0)
+        self.assertGreater(len(data_dict["hits"]), 0)
+        self.assertLessEqual(prefetcher.queries, 10)
+
+        for (prefetched, _), (queried, _) in zip(windows[0], superloci()):
+            with self.subTest(slocus=queried.id):
+                prefetched.load_all_transcript_data(data_dict=data_dict)
+                queried.load_all_transcript_data(engine=engine)
+                self.assertEqual(prefetched.locus_verified_introns, queried.locus_verified_introns)
+                self.assertEqual(sorted(prefetched.transcripts.keys()), sorted(queried.transcripts.keys()))
+                for tid in queried:
+                    self.assertEqual(prefetched[tid].blast_hits, queried[tid].blast_hits)
+                    self.assertEqual(prefetched[tid].external_scores.__getstate__(),
+                                     queried[tid].external_scores.__getstate__())
+                    self.assertEqual(str(prefetched[tid]), str(queried[tid]))
+
+    def test_sharded_unsorted(self):
+
+        gtf = """Chr1	foo	transcript	10000	20000	.	+	.	gene_id "foo2"; transcript_id "foo2.1"
+Chr1	foo	exon	10000	20000	.	+	.	gene_id "foo2"; transcript_id "foo2.1"
+Chr1	foo	transcript	100	1000	.	+	.	gene_id "foo1"; transcript_id "foo1.1"
+Chr1	foo	exon	100	1000	.	+	.	gene_id "foo1"; transcript_id "foo1.1"
+"""
+        with tempfile.NamedTemporaryFile(mode="wt", suffix=".gtf") as temp_gtf:
+            temp_gtf.write(gtf)
+            temp_gtf.flush()
+            with self.assertRaises(UnsortedInput), self.assertLogs("shards", "CRITICAL"):
+                shards.index_input(temp_gtf.name)
+
+    def test_sharded_multi_proc(self):
+        json_conf = configurator.to_json(None)
+        json_conf["pick"]["run_options"]["procs"] = 2
+        json_conf["pick"]["run_options"]["shard_input"] = True
+        json_conf["pick"]["run_options"]["shard_size"] = 1
+        json_conf["pick"]["files"]["input"] = pkg_resources.resource_filename("Mikado.tests",
+                                                                              "mikado_prepared.gtf")
+        json_conf["pick"]["files"]["output_dir"] = tempfile.gettempdir()
+        json_conf["pick"]["files"]["loci_out"] = "mikado.sharded.loci.gff3"
+        json_conf["pick"]["files"]["log"] = "mikado.sharded.log"
+        json_conf["db_settings"]["db"] = pkg_resources.resource_filename("Mikado.tests", "mikado.db")
+        json_conf["log_settings"]["log_level"] = "WARNING"
+
+        pick_caller = picker.Picker(json_conf=json_conf)
+        with self.assertRaises(SystemExit), self.assertLogs("main_logger", "INFO"):
+            pick_caller()
+        self.assertTrue(os.path.exists(os.path.join(tempfile.gettempdir(), "mikado.sharded.loci.gff3")))
+        with to_gff(os.path.join(tempfile.gettempdir(), "mikado.sharded.loci.gff3")) as inp_gff:
+            lines = [_ for _ in inp_gff if not _.header is True]
+            self.assertGreater(len(lines), 0)
+            genes = [_.id for _ in lines if _.is_gene is True]
+            self.assertGreater(len(genes), 0)
+            self.assertEqual(len(genes), len(set(genes)))
+            self.assertGreater(len([_ for _ in lines if _.feature == "CDS"]), 0)
+
+        [os.remove(_) for _ in glob.glob(os.path.join(tempfile.gettempdir(), "mikado.sharded.") + "*")]
+
+    def test_ordered_writer(self):
+
+        outdir = tempfile.mkdtemp()
+        names = [[os.path.join(outdir, "loci.{}".format(_)) for _ in ("metrics.tsv", "scores.tsv", "gff3")],
+                 [None] * 3, [None] * 3]
+
+        def result(chrom, genes):
+            gff = "".join("{0}\tG{1}\n".format(chrom, loci_processer._gene_number(num))
+                          for num in range(1, genes + 1))
+            return chrom, genes, [gff, gff, gff] + [None] * 6
+
+        results_queue, logging_queue = queue.Queue(), queue.Queue()
+        slots = threading.Semaphore(0)
+        # Items are received out of order; the second is split in two parts, as it happens for shards
+        for item in [(3, [result("Chr2", 1)], True),
+                     (2, [result("Chr1", 1)], False),
+                     (1, [result("Chr1", 2), (None, 0, [""] * 3 + [None] * 6)], True),
+                     (4, [], True),
+                     (2, [result("Chr1", 2)], True),
+                     ("EXIT", 4, True)]:
+            results_queue.put(item)
+        writer = loci_writer.LociWriter(names, results_queue, slots, logging_queue)
+        writer.run()
+        for name in names[0]:
+            with open(name) as handle:
+                self.assertEqual(handle.read(), "Chr1\tG1\nChr1\tG2\nChr1\tG3\nChr1\tG4\nChr1\tG5\nChr2\tG1\n")
+        # All the slots have been released
+        self.assertTrue(all(slots.acquire(blocking=False) for _ in range(4)))
+        self.assertFalse(slots.acquire(blocking=False))
+        shutil.rmtree(outdir)
+
+    def test_resume_writer(self):
+
+        outdir = tempfile.mkdtemp()
+        names = [[os.path.join(outdir, "loci.{}".format(_)) for _ in ("metrics.tsv", "scores.tsv", "gff3")],
+                 [None] * 3, [None] * 3]
+        for name in names[0]:
+            with open(name, "wt") as handle:
+                print("##header", file=handle)
+
+        def result(chrom, genes):
+            gff = "".join("{0}\tG{1}\n".format(chrom, loci_processer._gene_number(num))
+                          for num in range(1, genes + 1))
+            return chrom, genes, [gff, gff, gff] + [None] * 6
+
+        def write(items, checkpoint=None):
+            results_queue = queue.Queue()
+            for item in items:
+                results_queue.put(item)
+            writer = loci_writer.LociWriter(names, results_queue, threading.Semaphore(0), queue.Queue(),
+                                            journal=run_journal, checkpoint=checkpoint)
+            writer.run()
+
+        run_journal = journal.Journal(os.path.join(outdir, "loci.journal"), {"input": "foo", "shards": None})
+        run_journal.start(names)
+        # Interrupted run: the output of the third item is missing
+        write([(1, [result("Chr1", 2)], True), (2, [result("Chr2", 1)], True), ("EXIT", 3, True)])
+        self.assertTrue(os.path.exists(run_journal.filename))
+        # Output written after the last checkpoint
+        with open(names[0][2], "at") as handle:
+            print("Chr2\tG2", file=handle)
+
+        other = journal.Journal(run_journal.filename, {"input": "bar", "shards": None})
+        self.assertIsNone(other.load(names))
+        checkpoint = run_journal.load(names)
+        self.assertEqual((checkpoint["item"], checkpoint["chrom"], checkpoint["genes"]), (2, "Chr2", 1))
+        run_journal.restore(checkpoint, names)
+        write([(3, [result("Chr2", 2)], True), ("EXIT", 3, True)], checkpoint=checkpoint)
+        self.assertFalse(os.path.exists(run_journal.filename))
+        for name in names[0]:
+            with open(name) as handle:
+                self.assertEqual(handle.read(), "##header\nChr1\tG1\nChr1\tG2\nChr2\tG1\nChr2\tG2\nChr2\tG3\n")
+        shutil.rmtree(outdir)
+
+    def test_resume_fingerprint(self):
+        json_conf = configurator.to_json(None)
+        json_conf["pick"]["files"]["input"] = pkg_resources.resource_filename("Mikado.tests",
+                                                                              "mikado_prepared.gtf")
+        json_conf["pick"]["files"]["output_dir"] = tempfile.gettempdir()
+        json_conf["pick"]["files"]["loci_out"] = "mikado.fingerprint.loci.gff3"
+        json_conf["pick"]["files"]["log"] = "mikado.fingerprint.log"
+        json_conf["db_settings"]["db"] = pkg_resources.resource_filename("Mikado.tests", "mikado.db")
+        json_conf["log_settings"]["log_level"] = "WARNING"
+
+        fingerprints = []
+        for procs, prefix in ((2, "mikado"), (3, "mikado"), (2, "other")):
+            conf = copy.deepcopy(json_conf)
+            conf["pick"]["run_options"]["procs"] = procs
+            conf["pick"]["output_format"]["id_prefix"] = prefix
+            fingerprints.append(picker.Picker(json_conf=conf)._Picker__run_fingerprint(None))
+        # The number of processes does not change the output, the prefix of the IDs does
+        self.assertEqual(fingerprints[0], fingerprints[1])
+        self.assertNotEqual(fingerprints[0], fingerprints[2])
+        [os.remove(_) for _ in glob.glob(os.path.join(tempfile.gettempdir(), "mikado.fingerprint.") + "*")]
+
+    def test_profile(self):
+        json_conf = configurator.to_json(None)
+        json_conf["pick"]["run_options"]["procs"] = 2
+        json_conf["pick"]["run_options"]["slow_loci"] = 3
+        json_conf["pick"]["files"]["input"] = pkg_resources.resource_filename("Mikado.tests",
+                                                                              "mikado_prepared.gtf")
+        json_conf["pick"]["files"]["output_dir"] = tempfile.gettempdir()
+        json_conf["pick"]["files"]["loci_out"] = "mikado.profiled.loci.gff3"
+        json_conf["pick"]["files"]["profile_out"] = "mikado.profiled.profile.json"
+        json_conf["pick"]["files"]["log"] = "mikado.profiled.log"
+        json_conf["db_settings"]["db"] = pkg_resources.resource_filename("Mikado.tests", "mikado.db")
+        json_conf["log_settings"]["log_level"] = "WARNING"
+
+        pick_caller = picker.Picker(json_conf=json_conf)
+        with self.assertRaises(SystemExit), self.assertLogs("main_logger", "INFO"):
+            pick_caller()
+        with open(os.path.join(tempfile.gettempdir(), "mikado.profiled.profile.json")) as summary:
+            summary = json.load(summary)
+        self.assertEqual(sorted(summary["processes"]),
+                         ["LociProcesser-1", "LociProcesser-2", "LociWriter", "main"])
+        for stage in ("parse_input", "load_data", "define_subloci", "define_loci", "print", "write"):
+            self.assertIn(stage, summary["total"]["stages"])
+            self.assertGreater(summary["total"]["stages"][stage]["calls"], 0)
+        self.assertGreater(summary["total"]["counters"]["superloci"], 3)
+        self.assertGreater(summary["total"]["counters"]["graph_edges"], 0)
+
+        with open(os.path.join(tempfile.gettempdir(), "mikado.profiled.profile.slow_loci.tsv")) as slow:
+            rows = list(csv.DictReader(slow, delimiter="\t"))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual([row["superlocus"] for row in rows], [_["superlocus"] for _ in summary["slow_loci"]])
+        self.assertEqual(sorted([float(row["wall"]) for row in rows], reverse=True),
+                         [float(row["wall"]) for row in rows])
+
+        [os.remove(_) for _ in glob.glob(os.path.join(tempfile.gettempdir(), "mikado.profiled.") + "*")]
+
     def test_subprocess(self):
         
         json_conf = configurator.to_json(None)
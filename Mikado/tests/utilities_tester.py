@@ -2,11 +2,17 @@
 
 
 import Mikado.utilities
+import copy
+import io
 import unittest
 import os
+import pickle
 import tempfile
+import time
 import logging
 import queue
+import itertools
+import types
 
 
 class UtilTester(unittest.TestCase):
@@ -84,6 +90,17 @@ class UtilTester(unittest.TestCase):
         os.remove(out_name)
         self.assertFalse(os.path.exists(out_name))
 
+    def test_merge_partial_groups(self):
+
+        first = io.StringIO("1/a\n1/b\n4/c\n10/d\n10/e\n")
+        second = io.StringIO("2/f\n3/g/h\n3/i\n11/j\n")
+        groups = list(Mikado.utilities.merge_partial_groups([first, second]))
+        self.assertEqual([(index, num) for index, num, _ in groups],
+                         [(1, 0), (2, 1), (3, 1), (4, 0), (10, 0), (11, 1)])
+        self.assertEqual(groups[0][2], ["a\n", "b\n"])
+        self.assertEqual(groups[2][2], ["g/h\n", "i\n"])
+        self.assertEqual(groups[4][2], ["d\n", "e\n"])
+
 
 class LogUtilsTester(unittest.TestCase):
 
@@ -165,6 +182,47 @@ class LogUtilsTester(unittest.TestCase):
         Mikado.utilities.log_utils.create_queue_logger(instance, prefix="prefix_test")
         self.assertEqual(instance.logger.level, 30)
 
+    def test_batch_queue_logger(self):
+
+        logging_queue = queue.Queue()
+        handler = Mikado.utilities.log_utils.BatchQueueHandler(logging_queue, capacity=3)
+        context = Mikado.utilities.log_utils.LocusContext()
+        logger = logging.getLogger("test_batch")
+        logger.addHandler(handler)
+        logger.addFilter(context)
+        logger.setLevel("DEBUG")
+        logger.propagate = False
+
+        context.locus, context.counter = "Chr1:100-200", 1
+        logger.debug("first %s", "message")
+        logger.debug("second")
+        self.assertTrue(logging_queue.empty())
+        logger.debug("third")
+        batch = logging_queue.get_nowait()
+        self.assertEqual([_.getMessage() for _ in batch], ["first message", "second", "third"])
+        self.assertTrue(all(_.name == "Chr1:100-200" and _.counter == 1 for _ in batch))
+        # Errors are sent immediately
+        context.locus, context.counter = "Chr1:300-400", 2
+        logger.debug("fourth")
+        logger.error("fifth")
+        self.assertEqual([_.getMessage() for _ in logging_queue.get_nowait()], ["fourth", "fifth"])
+        logger.info("sixth")
+        handler.flush()
+        batch = logging_queue.get_nowait()
+        self.assertEqual(batch[0].name, "Chr1:300-400")
+
+        # The listener handles both batches and single records
+        with self.assertLogs("test_listener", level="DEBUG") as test_log:
+            listener = Mikado.utilities.log_utils.BatchQueueListener(
+                logging_queue, logging.getLogger("test_listener"))
+            logging_queue.put(batch + batch)
+            logging_queue.put(batch[0])
+            listener.start()
+            listener.stop()
+        self.assertEqual(len(test_log.output), 3)
+        logger.removeHandler(handler)
+        logger.removeFilter(context)
+
     def test_check_logger(self):
         logger = logging.getLogger("test_validity")
         self.assertEqual(logger, Mikado.utilities.log_utils.check_logger(logger))
@@ -184,5 +242,234 @@ class LogUtilsTester(unittest.TestCase):
                          merged)
 
 
+class SharedStoreTester(unittest.TestCase):
+
+    def setUp(self):
+        self.json_conf = Mikado.configuration.configurator.to_json(None)
+        self.handle = Mikado.utilities.shared_store.publish(self.json_conf, regressor=None)
+
+    def tearDown(self):
+        Mikado.utilities.shared_store.release(self.handle)
+
+    def test_attach(self):
+
+        self.assertTrue(os.path.exists(self.handle))
+        json_conf, regressor = Mikado.utilities.shared_store.attach(self.handle)
+        self.assertIs(json_conf, self.json_conf)
+        self.assertIsNone(regressor)
+        self.assertEqual(Mikado.utilities.shared_store.handle_of(self.json_conf), self.handle)
+        self.assertIsNone(Mikado.utilities.shared_store.handle_of(self.json_conf.copy()))
+        # The expressions are compiled once, upon publishing
+        for key in Mikado.utilities.shared_store.compiled_sections:
+            self.assertIsNotNone(self.json_conf[key].get("compiled", None), key)
+            self.assertIsInstance(self.json_conf[key].get("predicate", None),
+                                  Mikado.utilities.predicates.Predicate, key)
+        # The backing file must contain the configuration without the compiled expressions
+        with open(self.handle, "rb") as backing:
+            stored, _ = pickle.load(backing)
+        self.assertNotIn("compiled", stored["requirements"])
+        self.assertNotIn("predicate", stored["requirements"])
+        self.assertEqual(stored["requirements"]["expression"], self.json_conf["requirements"]["expression"])
+
+    def test_release(self):
+
+        Mikado.utilities.shared_store.release(self.handle)
+        self.assertFalse(os.path.exists(self.handle))
+        self.assertIsNone(Mikado.utilities.shared_store.handle_of(self.json_conf))
+
+    def test_serialise_with_handle(self):
+
+        transcript = Mikado.transcripts.Transcript()
+        transcript.chrom, transcript.strand, transcript.id = "Chr1", "+", "t1"
+        transcript.add_exons([(101, 300), (401, 600)])
+        transcript.finalize()
+        transcript.json_conf = self.json_conf
+        locus = Mikado.loci.Superlocus(transcript, json_conf=self.json_conf)
+
+        for obj in (transcript, locus):
+            with self.subTest(obj=obj):
+                dumped = pickle.dumps(obj)
+                self.assertLess(len(dumped), len(pickle.dumps(
+                    Mikado.utilities.shared_store.strip_compiled(self.json_conf))))
+                self.assertIs(pickle.loads(dumped).json_conf, self.json_conf)
+                self.assertIs(copy.deepcopy(obj).json_conf, self.json_conf)
+
+
+class PredicateTester(unittest.TestCase):
+
+    def setUp(self):
+        self.section = {"parameters": {
+            "exon_num.multi": {"name": "exon_num", "operator": "gt", "value": 1},
+            "cdna_length": {"name": "cdna_length", "operator": "ge", "value": 200},
+            "exon_num.mono": {"name": "exon_num", "operator": "eq", "value": 1},
+            "is_complete": {"name": "is_complete", "operator": "eq", "value": True},
+            "suspicious_splicing": {"name": "suspicious_splicing", "operator": "within", "value": [0, 0]}}}
+        self.section["expression"] = (
+            '(evaluated["exon_num.multi"] and evaluated["cdna_length"]) or '
+            '(evaluated["exon_num.mono"] and not evaluated["is_complete"]) and evaluated["suspicious_splicing"]')
+        self.transcripts = []
+        for exon_num, cdna_length, is_complete, suspicious in itertools.product(
+                (1, 2, 5), (100, 200, 1000), (True, False), (False, True)):
+            self.transcripts.append(types.SimpleNamespace(
+                exon_num=exon_num, cdna_length=cdna_length, is_complete=is_complete,
+                suspicious_splicing=suspicious))
+
+    def __evaluate(self, transcript):
+        # pylint: disable=eval-used
+        evaluated = dict((key, Mikado.utilities.predicates.evaluate(getattr(transcript, conf["name"]), conf))
+                         for key, conf in self.section["parameters"].items())
+        return eval(self.section["expression"]) is not False
+
+    def test_passing(self):
+
+        predicate = Mikado.utilities.predicates.Predicate(self.section)
+        self.assertTrue(predicate.compiled)
+        self.assertEqual(list(predicate.passing(self.transcripts)),
+                         [self.__evaluate(transcript) for transcript in self.transcripts])
+
+    def test_fallback(self):
+
+        # Expressions which are not combinations of "and", "or" and "not" are evaluated as Python code
+        self.section["expression"] = '{} if evaluated["cdna_length"] else False'.format(self.section["expression"])
+        predicate = Mikado.utilities.predicates.Predicate(self.section)
+        self.assertFalse(predicate.compiled)
+        self.assertEqual(list(predicate.passing(self.transcripts)),
+                         [self.__evaluate(transcript) for transcript in self.transcripts])
+        self.assertEqual(pickle.loads(pickle.dumps(predicate)).expression, predicate.expression)
+
+    def test_failed_clauses(self):
+
+        predicate = Mikado.utilities.predicates.Predicate(self.section)
+        self.section["expression"] = 'evaluated["exon_num.multi"] and evaluated["cdna_length"]'
+        both = Mikado.utilities.predicates.Predicate(self.section)
+        transcript = types.SimpleNamespace(exon_num=1, cdna_length=100, is_complete=True, suspicious_splicing=False)
+        clauses = both.clauses([transcript])
+        self.assertEqual(both.failed_clauses(clauses, 0),
+                         ["exon_num.multi (exon_num gt 1)", "cdna_length (cdna_length ge 200)"])
+        clauses = predicate.clauses([transcript])
+        self.assertFalse(predicate.combine(clauses)[0])
+        self.assertEqual(predicate.failed_clauses(clauses, 0),
+                         ["((exon_num.multi and cdna_length) or ((exon_num.mono and not is_complete) "
+                          "and suspicious_splicing))"])
+        transcript.exon_num = 5
+        self.assertEqual(both.failed_clauses(both.clauses([transcript]), 0),
+                         ["cdna_length (cdna_length ge 200)"])
+        transcript.cdna_length = 200
+        self.assertEqual(both.failed_clauses(both.clauses([transcript]), 0), [])
+
+    def test_get_predicate(self):
+
+        predicate = Mikado.utilities.predicates.get_predicate(self.section)
+        self.assertIs(self.section["predicate"], predicate)
+        self.assertIs(Mikado.utilities.predicates.get_predicate(self.section), predicate)
+
+
+class ProfilingTester(unittest.TestCase):
+
+    def tearDown(self):
+        Mikado.utilities.profiling.disable()
+
+    def test_disabled(self):
+
+        self.assertIsNone(Mikado.utilities.profiling.active())
+        with Mikado.utilities.profiling.stage("foo"):
+            Mikado.utilities.profiling.count("bar")
+        self.assertIsNone(Mikado.utilities.profiling.disable())
+
+    def test_default_slow_loci(self):
+
+        json_conf = Mikado.configuration.configurator.to_json(None)
+        self.assertEqual(json_conf["pick"]["run_options"]["slow_loci"],
+                         Mikado.utilities.profiling.default_slow_loci)
+        self.assertEqual(Mikado.utilities.profiling.Profile().slow_loci,
+                         Mikado.utilities.profiling.default_slow_loci)
+
+    def test_nested_stages(self):
+
+        profile = Mikado.utilities.profiling.enable(name="test", slow_loci=2)
+        start = time.perf_counter()
+        with Mikado.utilities.profiling.stage("outer"):
+            with Mikado.utilities.profiling.stage("inner"):
+                sum(range(100000))
+            for _ in Mikado.utilities.profiling.timed("inner", range(3)):
+                Mikado.utilities.profiling.count("items")
+        elapsed = time.perf_counter() - start
+        self.assertEqual(profile.stages["outer"][0], 1)
+        self.assertEqual(profile.stages["inner"][0], 5)
+        self.assertEqual(profile.counters["items"], 3)
+        # The time of the nested stages is not counted twice
+        self.assertLessEqual(profile.stages["outer"][1] + profile.stages["inner"][1], elapsed)
+        self.assertIs(Mikado.utilities.profiling.disable(), profile)
+
+    def test_merge(self):
+
+        profile = Mikado.utilities.profiling.Profile(name="main", slow_loci=2)
+        worker = Mikado.utilities.profiling.Profile(name="worker", slow_loci=2)
+        for num, wall in enumerate([3, 1, 2], 1):
+            worker.record_locus("Chr1:{}-{}".format(num, num + 1), num, wall, wall)
+        worker.add("define_loci", 1.5, 1)
+        profile.add("define_loci", 0.5, 0.5)
+        profile.record_locus("Chr2:1-2", 1, 2.5, 0)
+        profile.update(worker.to_dict())
+        summary = profile.summary()
+        self.assertEqual(sorted(summary["processes"]), ["main", "worker"])
+        self.assertEqual(summary["total"]["stages"]["define_loci"], {"calls": 2, "wall": 2, "cpu": 1.5})
+        self.assertEqual(summary["total"]["counters"]["superloci"], 4)
+        self.assertEqual([_["superlocus"] for _ in summary["slow_loci"]], ["Chr1:1-2", "Chr2:1-2"])
+
+
+class BudgetTester(unittest.TestCase):
+
+    def test_disabled(self):
+
+        budget = Mikado.utilities.budget.Budget()
+        self.assertFalse(budget.enabled)
+        budget.spend(10 ** 6)
+        self.assertFalse(budget.exhausted())
+        self.assertTrue(budget.affordable(10 ** 6))
+
+    def test_work(self):
+
+        budget = Mikado.utilities.budget.Budget(work=10)
+        self.assertTrue(budget.enabled)
+        self.assertTrue(budget.affordable(10))
+        budget.spend(6)
+        self.assertFalse(budget.affordable(5))
+        self.assertTrue(budget.affordable(4))
+        budget.spend(4)
+        self.assertTrue(budget.exhausted())
+        self.assertFalse(budget.affordable(0))
+
+    def test_cpu_time(self):
+
+        budget = Mikado.utilities.budget.Budget(cpu_time=0.01)
+        self.assertTrue(budget.affordable(10 ** 6))
+        while budget.elapsed < 0.01:
+            sum(range(1000))
+        self.assertTrue(budget.exhausted())
+
+    def test_pause(self):
+
+        budget = Mikado.utilities.budget.Budget(cpu_time=0.01)
+        budget.pause()
+        elapsed = budget.elapsed
+        start = time.process_time()
+        while time.process_time() - start < 0.02:
+            sum(range(1000))
+        self.assertEqual(budget.elapsed, elapsed)
+        self.assertFalse(budget.exhausted())
+        budget.resume()
+        while budget.elapsed < 0.01:
+            sum(range(1000))
+        self.assertTrue(budget.exhausted())
+
+    def test_degradations(self):
+
+        budget = Mikado.utilities.budget.Budget(work=1)
+        for stage in ("subloci", "alternative_splicing", "subloci"):
+            budget.degrade(stage)
+        self.assertEqual(budget.degradations, ["subloci", "alternative_splicing"])
+
+
 if __name__ == "__main__":
     unittest.main()
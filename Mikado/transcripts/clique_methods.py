@@ -2,12 +2,17 @@
 
 """
 Module that implements the Reid/Daid/Hurley algorithm for community finding.
+Cliques and communities are computed on a compact version of the graph, where
+the nodes are numbered and the neighbours of each node are stored as a bitset
+(a Python integer whose n-th bit is set when the node is connected to node n).
 """
 
+import heapq
+import logging
 import networkx
 from ..utilities.log_utils import create_null_logger
 from collections import defaultdict
-from itertools import chain, combinations
+from itertools import combinations
 
 __all__ = ["reid_daid_hurley"]
 
@@ -31,18 +36,43 @@ def find_communities(graph: networkx.Graph, logger=None) -> list:
     if logger is None:
         logger = create_null_logger()
 
-    logger.debug("Creating the communities for %s", logger.name)
-    communities = [frozenset(comm) for comm in networkx.connected_components(graph)]
+    # The name of the superlocus is carried by the records of the logger
+    logger.debug("Creating the communities")
+    nodes, adjacency = _compact_graph(graph)
+    communities = [frozenset(nodes[num] for num in _bits(component))
+                   for component in _connected_components(adjacency)]
 
-    logger.debug("Communities for %s:\n\t\t%s", logger.name, "\n\t\t".join(
-        [str(_) for _ in communities]))
-    # result = [frozenset(x) for x in communities.values()]
-    for element in set.difference(set(graph.nodes()), set(chain(*communities[:]))):
-        communities.append(frozenset([element]))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Communities:\n\t\t%s", "\n\t\t".join([str(_) for _ in communities]))
     return set(communities)
 
 
-def define_graph(objects: dict, inters, **kwargs) -> networkx.Graph:
+def overlapping_pairs(objects: dict) -> list:
+    """
+    :param objects: a dictionary of objects with "start" and "end" attributes
+    :type objects: dict
+
+    This function finds all the pairs of objects whose (closed) intervals overlap,
+    by sweeping over the objects sorted by their start.
+    The pairs are returned in the same order of itertools.combinations over the keys.
+    """
+
+    keys = list(objects.keys())
+    active = []
+    pairs = []
+    for num in sorted(range(len(keys)), key=lambda index: objects[keys[index]].start):
+        start = objects[keys[num]].start
+        # Discard the objects that end before the current one starts
+        while active and active[0][0] < start:
+            heapq.heappop(active)
+        pairs.extend((min(num, other), max(num, other)) for _, other in active)
+        heapq.heappush(active, (objects[keys[num]].end, num))
+
+    pairs.sort()
+    return [(keys[first], keys[second]) for first, second in pairs]
+
+
+def define_graph(objects: dict, inters, overlapping_only=False, **kwargs) -> networkx.Graph:
     """
     :param objects: a dictionary of objects to be grouped into a graph
     :type objects: dict
@@ -50,6 +80,11 @@ def define_graph(objects: dict, inters, **kwargs) -> networkx.Graph:
     :param inters: the intersecting function to be used to define the graph
     :type inters: callable
 
+    :param overlapping_only: boolean flag. If True, the intersecting function will be called
+    only on the pairs of objects whose start-end intervals overlap. It must be used only with functions
+    which can never be true for non-overlapping objects.
+    :type overlapping_only: bool
+
     :param kwargs: optional arguments to be passed to the inters function
     :type kwargs: dict
 
@@ -70,7 +105,12 @@ def define_graph(objects: dict, inters, **kwargs) -> networkx.Graph:
     # memory usage to increase too much
     graph.add_nodes_from(objects.keys())
 
-    for obj, other_obj in combinations(objects.keys(), 2):
+    if overlapping_only is True:
+        candidates = overlapping_pairs(objects)
+    else:
+        candidates = combinations(objects.keys(), 2)
+
+    for obj, other_obj in candidates:
         if inters(objects[obj], objects[other_obj], **kwargs):
             # Connections are not directional
             graph.add_edge(*tuple(sorted([obj, other_obj])))
@@ -95,13 +135,182 @@ def find_cliques(graph: networkx.Graph, logger=None) -> (networkx.Graph, list):
     if logger is None:
         logger = create_null_logger()
 
-    logger.debug("Creating cliques for %s", logger.name)
-    cliques = [frozenset(x) for x in networkx.find_cliques_recursive(graph)]
-    logger.debug("Created %d cliques for %s", len(cliques), logger.name)
+    logger.debug("Creating cliques")
+    nodes, adjacency = _compact_graph(graph)
+    cliques = []
+    for component in _connected_components(adjacency):
+        if component & (component - 1) == 0:
+            # Isolated node
+            cliques.append(frozenset([nodes[component.bit_length() - 1]]))
+            continue
+        # Renumber the component starting from the most connected core of the graph
+        order = [nodes[num] for num in reversed(_degeneracy_order(adjacency, component))]
+        order, local_adjacency = _compact_graph(graph, order)
+        cliques.extend(frozenset(map(order.__getitem__, clique))
+                       for clique in _maximal_cliques(local_adjacency))
+    logger.debug("Created %d cliques", len(cliques))
 
     return cliques
 
 
+def _compact_graph(graph: networkx.Graph, nodes=None) -> (list, list):
+    """
+    :param graph: the graph to convert.
+    :type graph: networkx.Graph
+
+    :param nodes: optional list of nodes to number, in order. It must contain all the neighbours
+    of its nodes (eg a connected component). By default, all the nodes of the graph.
+    :type nodes: (None|list)
+
+    This function numbers the nodes of the graph and returns two lists:
+        - the nodes, so that nodes[n] is the node numbered n
+        - the neighbours of each node, as bitsets. Self-loops are ignored.
+    """
+
+    if nodes is None:
+        nodes = list(graph.nodes())
+    index = dict((node, num) for num, node in enumerate(nodes))
+    adjacency = [0] * len(nodes)
+    for num, node in enumerate(nodes):
+        neighbours = 0
+        for other in graph.adj[node]:
+            if other != node:
+                neighbours |= 1 << index[other]
+        adjacency[num] = neighbours
+    return nodes, adjacency
+
+
+def _bits(bitset: int):
+    """Generator of the numbers of the nodes in a bitset, in increasing order."""
+
+    while bitset:
+        lowest = bitset & -bitset
+        yield lowest.bit_length() - 1
+        bitset ^= lowest
+
+
+def _popcount(bitset: int) -> int:
+    """Number of nodes in a bitset."""
+
+    if not bitset:
+        return 0
+    # Discard the trailing zeros first, as the cost of bin is proportional to the length of the number
+    return bin(bitset >> ((bitset & -bitset).bit_length() - 1)).count("1")
+
+
+def _connected_components(adjacency: list) -> list:
+    """
+    :param adjacency: the neighbours of each node, as bitsets.
+    :type adjacency: list
+
+    This function returns the connected components of the graph, as bitsets.
+    """
+
+    components = []
+    unvisited = (1 << len(adjacency)) - 1
+    while unvisited:
+        frontier = component = unvisited & -unvisited
+        while frontier:
+            reached = 0
+            for num in _bits(frontier):
+                reached |= adjacency[num]
+            frontier = reached & ~component
+            component |= frontier
+        components.append(component)
+        unvisited &= ~component
+    return components
+
+
+def _degeneracy_order(adjacency: list, nodes: int) -> list:
+    """
+    :param adjacency: the neighbours of each node, as bitsets.
+    :type adjacency: list
+
+    :param nodes: the nodes to order, as a bitset. They must include all of their neighbours.
+    :type nodes: int
+
+    This function returns the nodes in degeneracy order, ie repeatedly removing the node
+    with the smallest number of neighbours among those remaining.
+    """
+
+    degrees = dict((num, _popcount(adjacency[num])) for num in _bits(nodes))
+    heap = [(degree, num) for num, degree in degrees.items()]
+    heapq.heapify(heap)
+    removed = 0
+    order = []
+    while heap:
+        degree, num = heapq.heappop(heap)
+        if removed >> num & 1 or degree != degrees[num]:
+            continue  # Stale entry
+        order.append(num)
+        removed |= 1 << num
+        for neighbour in _bits(adjacency[num] & ~removed):
+            degrees[neighbour] -= 1
+            heapq.heappush(heap, (degrees[neighbour], neighbour))
+    return order
+
+
+def _maximal_cliques(adjacency: list) -> list:
+    """
+    :param adjacency: the neighbours of each node, as bitsets.
+    :type adjacency: list
+
+    Implementation of the Bron-Kerbosch algorithm with pivoting (Tomita et al., 2006).
+    It returns the maximal cliques of the graph, as lists of node numbers.
+    The nodes should be numbered in reverse degeneracy order: the nodes of the densest part
+    of the graph come first, so that good pivots are found early, and the nodes of each
+    neighbourhood have close numbers, which keeps the bitsets short.
+    """
+
+    cliques = []
+    if adjacency:
+        _expand_clique([], (1 << len(adjacency)) - 1, 0, adjacency, cliques)
+    return cliques
+
+
+def _expand_clique(clique: list, candidates: int, excluded: int, adjacency: list, cliques: list):
+    """
+    Recursive step of the Bron-Kerbosch algorithm.
+
+    :param clique: the nodes of the current clique.
+    :param candidates: the nodes which can extend the clique, as a bitset. It must not be empty.
+    :param excluded: the nodes which could extend the clique but have already been explored, as a bitset.
+    :param adjacency: the neighbours of each node, as bitsets.
+    :param cliques: the list to which the maximal cliques are appended.
+    """
+
+    # The pivot is the node connected to most candidates; its neighbours need not be explored.
+    # If a node is connected to all the candidates, no better pivot can be found: the excluded
+    # nodes are examined first, as in that case the branch cannot produce any maximal clique.
+    # The candidates are counted after discarding the trailing zeros (see _popcount).
+    shift = (candidates & -candidates).bit_length() - 1
+    total = bin(candidates >> shift).count("1")
+    pivot, best = None, -1
+    for remaining in (excluded, candidates):
+        while remaining and best < total:
+            lowest = remaining & -remaining
+            remaining ^= lowest
+            num = lowest.bit_length() - 1
+            connected = bin((candidates & adjacency[num]) >> shift).count("1")
+            if connected > best:
+                pivot, best = num, connected
+
+    remaining = candidates & ~adjacency[pivot]
+    while remaining:
+        lowest = remaining & -remaining
+        remaining ^= lowest
+        num = lowest.bit_length() - 1
+        neighbours = adjacency[num]
+        if candidates & neighbours:
+            _expand_clique(clique + [num], candidates & neighbours, excluded & neighbours,
+                           adjacency, cliques)
+        elif not excluded & neighbours:
+            # The clique cannot be extended any further
+            cliques.append(clique + [num])
+        candidates ^= lowest
+        excluded |= lowest
+
+
 def reid_daid_hurley(graph, k, cliques=None, logger=None):
 
     """
@@ -118,71 +327,55 @@ def reid_daid_hurley(graph, k, cliques=None, logger=None):
 
     if k < 2:
         raise networkx.NetworkXError("k=%d, k must be greater than 1." % k)
-    if cliques is None:
-        cliques = [frozenset(x) for x in networkx.find_cliques_recursive(graph)]
 
     if logger is None:
         logger = create_null_logger("null")
 
-    nodes_to_clique_dict = defaultdict(set)
-    # Create the dictionary that links each node to its clique
+    nodes, adjacency = _compact_graph(graph)
+    index = dict((node, num) for num, node in enumerate(nodes))
+    if cliques is None:
+        cliques = find_cliques(graph, logger=logger)
+    cliques = [[index[node] for node in clique] for clique in cliques]
+
+    # Cliques are represented as bitsets over the node numbers
     logger.debug("Creating the node dictionary")
-    cliques = [_ for _ in cliques if len(_) >= k]
-    for clique in cliques:
-        for node in clique:
-            nodes_to_clique_dict[node].add(clique)
+    cliques = [sum(1 << num for num in clique) for clique in cliques if len(clique) >= k]
+    nodes_to_clique_dict = defaultdict(set)
+    for num, clique in enumerate(cliques):
+        for node in _bits(clique):
+            nodes_to_clique_dict[node].add(num)
 
     if len(nodes_to_clique_dict) > 100 or len(cliques) > 500:
-        logger.debug("Complex locus at %s, with %d nodes and %d cliques with length >= %d",
-                     logger.name, len(nodes_to_clique_dict), len(cliques), k)
-
-    current_component = 0
+        logger.debug("Complex locus, with %d nodes and %d cliques with length >= %d",
+                     len(nodes_to_clique_dict), len(cliques), k)
 
     logger.debug("Starting to explore the clique graph")
-    cliques_to_components_dict = dict()
-    counter = 0
-    for clique in cliques:
-        # visited = set()
-        counter += 1
-        logger.debug("Exploring clique %d out of %d", counter, len(cliques))
-        if clique not in cliques_to_components_dict:
-            current_component += 1
-            cliques_to_components_dict[clique] = current_component
-            frontier = set()
-            frontier.add(clique)
-            cycle = 0
-            while len(frontier) > 0:
-                current_clique = frontier.pop()
-                # if current_clique in visited_cliques:
-                #     continue
-                cycle += 1
-                logger.debug("Cycle %d for clique %d with %d nodes",
-                             cycle,
-                             counter,
-                             len(current_clique))
-
-                for neighbour in _get_unvisited_neighbours(current_clique, nodes_to_clique_dict):
-                    if len(frozenset.intersection(current_clique, neighbour)) >= (k-1):
-                        cliques_to_components_dict[neighbour] = current_component
-                        frontier.add(neighbour)
-                        for node in neighbour:
-                            nodes_to_clique_dict[node].remove(neighbour)
-
-                logger.debug("Found %d neighbours of clique %d in cycle %d",
-                             len(frontier), counter, cycle)
+    components = []
+    visited = set()
+    for num, clique in enumerate(cliques):
+        if num in visited:
+            continue
+        visited.add(num)
+        component = clique
+        frontier = [num]
+        while frontier:
+            current = cliques[frontier.pop()]
+            for neighbour in _get_unvisited_neighbours(current, nodes_to_clique_dict):
+                if neighbour not in visited and _popcount(current & cliques[neighbour]) >= (k - 1):
+                    visited.add(neighbour)
+                    frontier.append(neighbour)
+                    component |= cliques[neighbour]
+                    for node in _bits(cliques[neighbour]):
+                        nodes_to_clique_dict[node].discard(neighbour)
+        components.append(component)
 
     logger.debug("Finished exploring the clique graph")
-    communities = dict()
-    for clique in cliques_to_components_dict:
-        if cliques_to_components_dict[clique] not in communities:
-            communities[cliques_to_components_dict[clique]] = set()
-        communities[cliques_to_components_dict[clique]].update(set(clique))
-
-    logger.debug("Reporting the results")
-
-    result = [frozenset(x) for x in communities.values()]
-    for element in set.difference(set(graph.nodes()), set(chain(*result[:]))):
-        result.append(frozenset([element]))
+    result = [frozenset(nodes[num] for num in _bits(component)) for component in components]
+    found = 0
+    for component in components:
+        found |= component
+    for num in _bits(((1 << len(nodes)) - 1) & ~found):
+        result.append(frozenset([nodes[num]]))
 
     return set(result)
 
@@ -191,12 +384,12 @@ def _get_unvisited_neighbours(current_clique, nodes_to_clique_dict):
 
     """
 
-    :param current_clique:
-    :param nodes_to_clique_dict:
+    :param current_clique: the clique, as a bitset of node numbers.
+    :param nodes_to_clique_dict: dictionary linking each node to the cliques which have not been visited yet.
     :return:
     """
 
     neighbours = set()
-    for node in current_clique:
+    for node in _bits(current_clique):
         neighbours.update(nodes_to_clique_dict[node])
-    return frozenset(neighbours - {current_clique})
+    return neighbours
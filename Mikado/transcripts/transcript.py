@@ -29,6 +29,7 @@ from ..serializers.external import External
 from ..serializers.orf import Orf
 from ..transcripts.clique_methods import find_communities, define_graph
 from ..utilities.log_utils import create_null_logger
+from ..utilities import shared_store
 from .transcript_methods import splitting, retrieval
 from .transcript_methods.finalizing import finalize
 from .transcript_methods.printing import create_lines_cds
@@ -465,15 +466,18 @@ class Transcript:
         state = copy.deepcopy(dict((key, val) for key, val in self.__dict__.items()
                                    if key not in ("_Transcript__segmenttree",
                                                   "_Transcript__cds_introntree",
-                                                  "_Transcript__cds_tree")))
+                                                  "_Transcript__cds_tree",
+                                                  "_Transcript__json_conf")))
         self.logger = logger
 
-        if hasattr(self, "json_conf") and self.json_conf is not None:
-            if "json_conf" not in state:
-                state["json_conf"] = copy.deepcopy(self.json_conf)
-            for key in state["json_conf"]:
-                if "compiled" in state["json_conf"][key]:
-                    del state["json_conf"][key]["compiled"]
+        state["_Transcript__json_conf"] = None
+        if self.json_conf is not None:
+            # A published configuration is shared by reference through its handle
+            handle = shared_store.handle_of(self.json_conf)
+            if handle is not None:
+                state["json_conf_handle"] = handle
+            else:
+                state["_Transcript__json_conf"] = copy.deepcopy(shared_store.strip_compiled(self.json_conf))
 
         if hasattr(self, "session"):
             if state["session"] is not None:
@@ -492,7 +496,10 @@ class Transcript:
         return state
 
     def __setstate__(self, state):
+        handle = state.pop("json_conf_handle", None)
         self.__dict__.update(state)
+        if handle is not None:
+            self.json_conf = shared_store.attach(handle)[0]
         self.__cds_tree = IntervalTree()
         self.__segmenttree = IntervalTree()
         self.__cds_introntree = IntervalTree()
@@ -890,7 +897,7 @@ class Transcript:
         the strand will be removed from it.
         """
 
-        self.logger.debug("Stripping CDS from {0}".format(self.id))
+        self.logger.debug("Stripping CDS from %s", self.id)
         self.finalized = False
         assert len(self.exons) > 0
         if self.monoexonic is True and strand_specific is False:
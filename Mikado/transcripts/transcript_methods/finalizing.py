@@ -512,9 +512,9 @@ def __check_phase_correctness(transcript):
         transcript.logger.exception(exception)
         raise exception
 
-    transcript.logger.debug("{} has {} internal ORF{}".format(
-        transcript.id, len(transcript.internal_orfs),
-        "s" if len(transcript.internal_orfs) > 1 else ""))
+    transcript.logger.debug("%s has %d internal ORF%s",
+                            transcript.id, len(transcript.internal_orfs),
+                            "s" if len(transcript.internal_orfs) > 1 else "")
     for orf_index in range(len(transcript.internal_orfs)):
         transcript.logger.debug("ORF #%d for %s: %s",
                                 orf_index, transcript.id, transcript.phases)
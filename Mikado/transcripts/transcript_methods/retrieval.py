@@ -3,6 +3,7 @@ This module contains the methods used by the Transcript class to retrieve inform
 from the database/dictionary provided during the pick operation.
 """
 
+import logging
 import operator
 from itertools import groupby
 
@@ -280,7 +281,7 @@ def load_information_from_db(transcript, json_conf, introns=None, session=None,
     Otherwise, they will be extracted from the database directly.
     """
 
-    transcript.logger.debug("Loading {0}".format(transcript.id))
+    transcript.logger.debug("Loading %s", transcript.id)
     transcript.json_conf = json_conf
 
     __load_verified_introns(transcript, data_dict, introns)
@@ -426,7 +427,7 @@ def find_overlapping_cds(transcript, candidates: list) -> list:
         minimal_secondary_orf_length = 0
     transcript.logger.debug("Minimal orf loading: %d", minimal_secondary_orf_length)
 
-    transcript.logger.debug("{0} input ORFs for {1}".format(len(candidates), transcript.id))
+    transcript.logger.debug("%d input ORFs for %s", len(candidates), transcript.id)
     if any(corf.transcriptomic is False for corf in candidates):
         transcript.logger.debug("%d non-transcriptomic ORFs in the candidates",
                                 len([corf.transcriptomic is False for corf in candidates]))
@@ -440,7 +441,7 @@ def find_overlapping_cds(transcript, candidates: list) -> list:
     candidates = list(corf for corf in candidates if (
         corf.invalid is False and corf.transcriptomic is True))
 
-    transcript.logger.debug("{0} filtered ORFs for {1}".format(len(candidates), transcript.id))
+    transcript.logger.debug("%d filtered ORFs for %s", len(candidates), transcript.id)
     if len(candidates) == 0:
         return []
 
@@ -450,18 +451,18 @@ def find_overlapping_cds(transcript, candidates: list) -> list:
     graph = define_graph(orf_dictionary, inters=transcript.is_overlapping_cds)
     candidate_orfs = find_candidate_orfs(transcript, graph, orf_dictionary)
 
-    transcript.logger.debug("{0} candidate retained ORFs for {1}: {2}".format(
-        len(candidate_orfs),
-        transcript.id,
-        [x.name for x in candidate_orfs]))
+    if transcript.logger.isEnabledFor(logging.DEBUG):
+        transcript.logger.debug("%d candidate retained ORFs for %s: %s",
+                                len(candidate_orfs),
+                                transcript.id,
+                                [x.name for x in candidate_orfs])
     final_orfs = [candidate_orfs[0]]
     if len(candidate_orfs) > 1:
         others = list(corf for corf in candidate_orfs[1:] if
                       corf.cds_len >= minimal_secondary_orf_length)
-        transcript.logger.debug("Found {0} secondary ORFs for {1} of length >= {2}".format(
-            len(others), transcript.id,
-            minimal_secondary_orf_length
-        ))
+        transcript.logger.debug("Found %d secondary ORFs for %s of length >= %s",
+                                len(others), transcript.id,
+                                minimal_secondary_orf_length)
         final_orfs.extend(others)
 
     transcript.logger.debug("Retained %d ORFs for %s: %s",
@@ -687,22 +688,23 @@ def find_candidate_orfs(transcript, graph, orf_dictionary) -> list:
     while len(graph) > 0:
         cliques = find_cliques(graph, logger=transcript.logger)
         communities = find_communities(graph, logger=transcript.logger)
-        clique_str = []
-        for clique in cliques:
-            clique_str.append(str([(orf_dictionary[x].thick_start,
-                                    orf_dictionary[x].thick_end) for x in clique]))
-        comm_str = []
-        for comm in communities:
-            comm_str.append(str([(orf_dictionary[x].thick_start,
-                                  orf_dictionary[x].thick_end) for x in comm]))
-        transcript.logger.debug("{0} communities for {1}:\n\t{2}".format(
-            len(communities),
-            transcript.id,
-            "\n\t".join(comm_str)))
-        transcript.logger.debug("{0} cliques for {1}:\n\t{2}".format(
-            len(cliques),
-            transcript.id,
-            "\n\t".join(clique_str)))
+        if transcript.logger.isEnabledFor(logging.DEBUG):
+            clique_str = []
+            for clique in cliques:
+                clique_str.append(str([(orf_dictionary[x].thick_start,
+                                        orf_dictionary[x].thick_end) for x in clique]))
+            comm_str = []
+            for comm in communities:
+                comm_str.append(str([(orf_dictionary[x].thick_start,
+                                      orf_dictionary[x].thick_end) for x in comm]))
+            transcript.logger.debug("%d communities for %s:\n\t%s",
+                                    len(communities),
+                                    transcript.id,
+                                    "\n\t".join(comm_str))
+            transcript.logger.debug("%d cliques for %s:\n\t%s",
+                                    len(cliques),
+                                    transcript.id,
+                                    "\n\t".join(clique_str))
 
         to_remove = set()
         for comm in communities:
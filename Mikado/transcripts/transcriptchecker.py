@@ -8,7 +8,6 @@ to verify that e.g. the assigned strand is correct.
 from .transcript import Transcript
 from ..exceptions import IncorrectStrandError
 from collections import Counter
-from itertools import zip_longest
 
 
 # pylint: disable=too-many-instance-attributes
@@ -105,9 +104,7 @@ class TranscriptChecker(Transcript):
         :type string: str
         """
 
-        return "".join(x for x in reversed(
-            string.translate(cls.get_translation_table())
-        ))
+        return string.translate(cls.get_translation_table())[::-1]
 
     @property
     def strand_specific(self):
@@ -286,16 +283,16 @@ class TranscriptChecker(Transcript):
 
         self.check_strand()
         fasta = [">{0}".format(self.id)]
-        sequence = ''
-
-        for exon in self.exons:
-            start = exon[0] - self.start
-            end = exon[1] + 1 - self.start
-            _ = self.fasta_seq[start:end]
-            sequence += _
 
         # pylint: disable=no-member
-        if not isinstance(sequence, str):
+        if isinstance(self.fasta_seq, str):
+            # The spliced sequence is assembled at once, rather than by repeated concatenation
+            sequence = "".join([self.fasta_seq[exon[0] - self.start:exon[1] + 1 - self.start]
+                                for exon in self.exons])
+        else:
+            sequence = ''
+            for exon in self.exons:
+                sequence += self.fasta_seq[exon[0] - self.start:exon[1] + 1 - self.start]
             if hasattr(sequence, "seq"):
                 sequence = str(sequence.seq)
             else:
@@ -311,22 +308,6 @@ class TranscriptChecker(Transcript):
         #     len(sequence), sum(exon[1] + 1 - exon[0] for exon in self.exons)
         # )
 
-        sequence = self.grouper(sequence, 60)
-        fasta.extend(sequence)
+        fasta.extend(sequence[pos:pos + 60] for pos in range(0, len(sequence), 60))
         fasta = "\n".join(fasta)
         return fasta
-
-    @staticmethod
-    def grouper(iterable, num, fillvalue=""):
-        """Collect data into fixed-length chunks or blocks. From core documentation.
-
-        :param iterable: the iterable to be considered for grouping.
-        :param num: length of the chunks.
-        :type num: int
-
-        :param fillvalue: the default filler for missing positions while grouping.
-        :type fillvalue: str
-        """
-        # grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx"
-        args = [iter(iterable)] * num
-        return list("".join(x) for x in zip_longest(*args, fillvalue=fillvalue))
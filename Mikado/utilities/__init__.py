@@ -7,9 +7,9 @@ import os
 import functools
 from . import dbutils
 from . import log_utils
-import collections
 import gzip
-from itertools import zip_longest
+import heapq
+from itertools import groupby
 from .overlap import overlap
 # from ..parsers import to_gff
 
@@ -63,7 +63,8 @@ def memoize(obj):
 def merge_partial(filenames, handle, logger=None, gzipped=False):
 
     """This function merges the partial files created by the multiprocessing into a single
-    sorted file.
+    sorted file. As each partial file is already sorted, the files are merged record by record,
+    without loading them in memory.
 
     :param filenames: the filenames to merge into the handle
     :type filenames: list[str]
@@ -83,8 +84,6 @@ def merge_partial(filenames, handle, logger=None, gzipped=False):
     logger.debug("Starting to merge %d files (root: %s)",
                  len(filenames), "-".join(filenames[0].split("-")[:-1]))
 
-    current_lines = collections.defaultdict(list)
-
     try:
         if gzipped is False:
             fnames = [open(_) for _ in filenames if os.stat(_).st_size > 0]
@@ -101,33 +100,62 @@ def merge_partial(filenames, handle, logger=None, gzipped=False):
 
         return 0
 
-    for lines in zip_longest(*fnames):
-        for line in iter(_ for _ in lines if _ is not None):
-            _ = line.split("/")
-            index = int(_[0])
-            current_lines[index].append("/".join(_[1:]))
+    total = None
+    for index, _, lines in merge_partial_groups(fnames):
+        for line in lines:
+            print(line, file=handle, end="")
+        total = index
+
+    [_.close() for _ in fnames]
 
-    if len(current_lines) == 0:
+    if total is None:
         logger.exception("Nothing found to merge  for root %s. ERROR!.",
                          "-".join(filenames[0].split("-")[:-1]))
-        [_.close() for _ in fnames]
         [os.remove(_) for _ in filenames]
 
         raise IndexError
 
-    total = max(current_lines.keys())
-
-    [_.close() for _ in fnames]
     [os.remove(_) for _ in filenames]
 
-    for index in sorted(current_lines.keys()):
-        for line in current_lines[index]:
-            print(line, file=handle, end="")
-        del current_lines[index]
-
     return total
 
 
+def partial_groups(handle):
+    """
+    Generator which reads a partial file, whose lines are prefixed by the counter of the
+    corresponding record ("<counter>/<line>"), and yields the lines of each record together.
+
+    :param handle: the partial file.
+    :type handle: io.TextIOWrapper
+
+    :returns: tuples (counter, lines), with the counter prefix removed from the lines.
+    """
+
+    for index, lines in groupby(handle, key=lambda line: int(line.split("/", 1)[0])):
+        yield index, [line.split("/", 1)[1] for line in lines]
+
+
+def _numbered_groups(handle, num):
+    """Private generator to tag the records of a partial file with the index of the file."""
+
+    for index, lines in partial_groups(handle):
+        yield index, num, lines
+
+
+def merge_partial_groups(handles):
+    """
+    Generator which merges the records of a group of partial files. Each partial file must
+    be already sorted by counter, so that only one record per file has to be kept in memory.
+
+    :param handles: the partial files to merge.
+    :type handles: list
+
+    :returns: tuples (counter, file index, lines), in counter order.
+    """
+
+    return heapq.merge(*[_numbered_groups(handle, num) for num, handle in enumerate(handles)])
+
+
 def grouper(iterable, n):
     """
     Function to chunk an iterable into slices of at most n elements.
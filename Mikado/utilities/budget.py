@@ -0,0 +1,142 @@
+# coding: utf-8
+
+"""
+This module implements the budget used to bound the time spent by Mikado pick on each superlocus.
+The budget is expressed as CPU time and/or as an estimate of the work to perform (the number of edges
+of the transcript graph, and the number of comparisons needed to define the alternative splicing events).
+When the budget of a superlocus runs out, the following stages of its analysis are performed with cheaper
+algorithms (eg the approximations used for complex loci, or no further AS events); each degradation is
+recorded, so that it can be reported in the output files.
+When no budget is set, the analysis is never degraded.
+"""
+
+import time
+from . import profiling
+
+__author__ = 'Luca Venturini'
+
+
+class Budget:
+
+    """
+    Class which keeps track of the CPU time and of the work spent on a superlocus,
+    and of the stages of its analysis which have been degraded.
+    """
+
+    def __init__(self, cpu_time=0, work=0):
+        """
+        :param cpu_time: maximum CPU time, in seconds. If 0, the CPU time is not limited.
+        :type cpu_time: (int|float)
+
+        :param work: maximum amount of work units. If 0, the work is not limited.
+        :type work: int
+        """
+
+        self.cpu_time = cpu_time
+        self.work = work
+        self.spent = 0
+        self.degradations = []
+        # CPU time accumulated while the clock was running, and start of the current interval
+        # (None if the clock is paused)
+        self.__elapsed = 0
+        self.__start = time.process_time()
+
+    @classmethod
+    def from_configuration(cls, json_conf):
+        """
+        Class method to create a budget from the run options of the configuration.
+        :param json_conf: the configuration dictionary.
+        :type json_conf: dict
+
+        :rtype: Budget
+        """
+
+        return cls(cpu_time=json_conf["pick"]["run_options"]["superlocus_cpu_budget"],
+                   work=json_conf["pick"]["run_options"]["superlocus_work_budget"])
+
+    @property
+    def enabled(self):
+        """Flag. True if either the CPU time or the work are limited."""
+        return self.cpu_time > 0 or self.work > 0
+
+    @property
+    def elapsed(self):
+        """CPU time spent since the budget was created, excluding the intervals in which it was paused."""
+        if self.__start is None:
+            return self.__elapsed
+        return self.__elapsed + time.process_time() - self.__start
+
+    def pause(self):
+        """
+        Method to stop the CPU clock of the budget, eg while the process works on other superloci.
+        Pausing a budget which is already paused has no effect.
+        """
+
+        if self.__start is not None:
+            self.__elapsed += time.process_time() - self.__start
+            self.__start = None
+
+    def resume(self):
+        """
+        Method to restart the CPU clock of a paused budget.
+        Resuming a budget which is already running has no effect.
+        """
+
+        if self.__start is None:
+            self.__start = time.process_time()
+
+    def exhausted(self):
+        """
+        Method to check whether the budget has run out.
+        :rtype: bool
+        """
+
+        if self.cpu_time > 0 and self.elapsed >= self.cpu_time:
+            return True
+        return self.work > 0 and self.spent >= self.work
+
+    def affordable(self, work):
+        """
+        Method to check whether the budget can cover the given amount of work.
+        :param work: the estimated number of work units.
+        :type work: int
+
+        :rtype: bool
+        """
+
+        if self.exhausted():
+            return False
+        return self.work <= 0 or self.spent + work <= self.work
+
+    def spend(self, work):
+        """
+        Method to record that some work has been performed.
+        :param work: the number of work units.
+        :type work: int
+        """
+
+        self.spent += work
+
+    def degrade(self, stage):
+        """
+        Method to record that a stage of the analysis has been degraded.
+        :param stage: the name of the stage.
+        :type stage: str
+        """
+
+        if stage not in self.degradations:
+            self.degradations.append(stage)
+            profiling.count("budget_degradation_{}".format(stage))
+
+
+def enabled(json_conf):
+    """
+    Function to check whether the analysis of the superloci is limited by a budget,
+    in which case the degradations are reported in the metrics files.
+    :param json_conf: the configuration dictionary.
+    :type json_conf: dict
+
+    :rtype: bool
+    """
+
+    return Budget.from_configuration(json_conf).enabled
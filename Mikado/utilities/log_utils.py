@@ -101,6 +101,84 @@ def create_queue_logger(instance, prefix=""):
     return
 
 
+class LocusContext(logging.Filter):
+
+    """
+    Filter used to carry the context of the analysis (the superlocus and its counter) on the records
+    of a logger which is shared by all the superloci analysed by a process. The name of the records
+    is set to that of the superlocus, so that the log looks as if each superlocus had its own logger.
+    """
+
+    def __init__(self, name=""):
+        super().__init__(name)
+        self.locus = None
+        self.counter = None
+
+    def filter(self, record):
+        record.locus, record.counter = self.locus, self.counter
+        if self.locus is not None:
+            record.name = self.locus
+        return True
+
+
+class BatchQueueHandler(logging.handlers.QueueHandler):
+
+    """
+    QueueHandler which sends the records to the queue in batches (lists of records), to be
+    received by a BatchQueueListener. The batch is sent when it reaches its capacity, when a record
+    of at least flush_level is emitted, or when the handler is flushed.
+    """
+
+    def __init__(self, queue, capacity=100, flush_level=logging.ERROR):
+        """
+        :param queue: the logging queue.
+        :param capacity: maximum number of records to keep before sending them.
+        :type capacity: int
+        :param flush_level: records of this level (or higher) are sent immediately.
+        """
+
+        super().__init__(queue)
+        self.capacity = capacity
+        self.flush_level = flush_level
+        self.buffer = []
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.buffer) >= self.capacity or record.levelno >= self.flush_level:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer:
+                self.enqueue(self.buffer)
+                self.buffer = []
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class BatchQueueListener(logging.handlers.QueueListener):
+
+    """
+    QueueListener which accepts both single records and the batches sent by a BatchQueueHandler.
+    """
+
+    def handle(self, record):
+        if isinstance(record, list):
+            for item in record:
+                super().handle(item)
+        else:
+            super().handle(record)
+
+
 def create_logger_from_conf(conf, name="mikado", mode="a"):
 
     logger = logging.getLogger(name)
@@ -0,0 +1,253 @@
+"""
+This module implements the evaluation of the filters defined in the configuration, ie the
+"requirements" sections ("requirements", "as_requirements", "not_fragmentary") and the filters
+of the scoring parameters. The expression of a requirements section is compiled once into a tree
+of clauses, which is then evaluated over the metrics of all the transcripts of a locus at once,
+rather than transcript by transcript. The predicate can also report which clauses caused
+a transcript to fail.
+"""
+
+import ast
+import numpy
+
+__author__ = 'Luca Venturini'
+
+
+_comparisons = {"eq": numpy.equal, "ne": numpy.not_equal,
+                "gt": numpy.greater, "lt": numpy.less,
+                "ge": numpy.greater_equal, "le": numpy.less_equal}
+
+
+def evaluate(param, conf: dict) -> bool:
+
+    """
+    :param param: value to be checked according to the expression in the configuration
+
+    :param conf: a dictionary containing the expressions to evaluate
+    :type conf: dict
+
+    This function evaluates a single parameter using the requested
+    operation from the JSON dict file.
+    """
+
+    if conf["operator"] == "eq":
+        comparison = (float(param) == float(conf["value"]))
+    elif conf["operator"] == "ne":
+        comparison = (float(param) != float(conf["value"]))
+    elif conf["operator"] == "gt":
+        comparison = (float(param) > float(conf["value"]))
+    elif conf["operator"] == "lt":
+        comparison = (float(param) < float(conf["value"]))
+    elif conf["operator"] == "ge":
+        comparison = (float(param) >= float(conf["value"]))
+    elif conf["operator"] == "le":
+        comparison = (float(param) <= float(conf["value"]))
+    elif conf["operator"] == "in":
+        comparison = (param in conf["value"])
+    elif conf["operator"] == "not in":
+        comparison = (param not in conf["value"])
+    elif conf["operator"] == "within":
+        comparison = (param in range(*sorted([conf["value"][0], conf["value"][1] + 1])))
+    elif conf["operator"] == "not within":
+        comparison = (param not in range(*sorted([conf["value"][0], conf["value"][1] + 1])))
+    else:
+        raise ValueError("Unknown operator: {0}".format(conf["operator"]))
+    return comparison
+
+
+def evaluate_column(values, conf, column=None):
+    """
+    Function to evaluate a filter over a list of values, with the same semantics of evaluate.
+    Comparisons are performed on the whole column at once.
+
+    :param values: the values to evaluate.
+    :type values: list
+
+    :param conf: the filter to evaluate.
+    :type conf: dict
+
+    :param column: optionally, the values already converted into a float array.
+    :type column: (None|numpy.ndarray)
+
+    :rtype: numpy.ndarray
+    """
+
+    if conf["operator"] in _comparisons:
+        if column is None:
+            column = numpy.array(values, dtype=numpy.float64)
+        return _comparisons[conf["operator"]](column, float(conf["value"]))
+    return numpy.array([evaluate(value, conf) for value in values], dtype=bool)
+
+
+class Predicate:
+
+    """
+    Compiled form of a requirements section of the configuration. The section must have been
+    checked already, so that its expression refers to the parameters as evaluated["<name>"].
+    Expressions which cannot be translated into a tree of "and", "or" and "not" clauses
+    are evaluated transcript by transcript, as Python expressions.
+    """
+
+    def __init__(self, section):
+        """
+        :param section: the requirements section.
+        :type section: dict
+        """
+
+        self.parameters = section["parameters"]
+        self.expression = section["expression"]
+        self.__compiled = None
+        try:
+            self.__tree = self.__convert(ast.parse(self.expression, mode="eval").body)
+        except ValueError:
+            self.__tree = None
+            self.__compiled = compile(self.expression, "<json>", "eval")
+
+    def __reduce__(self):
+        return self.__class__, ({"parameters": self.parameters, "expression": self.expression},)
+
+    def __convert(self, node):
+        """Private method to translate a node of the parsed expression into the tree of clauses."""
+
+        if isinstance(node, ast.BoolOp):
+            kind = "and" if isinstance(node.op, ast.And) else "or"
+            return kind, [self.__convert(value) for value in node.values]
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return "not", self.__convert(node.operand)
+        elif (isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and
+              node.value.id == "evaluated"):
+            key = node.slice.value if isinstance(node.slice, ast.Index) else node.slice
+            key = getattr(key, "value", getattr(key, "s", None))
+            if key in self.parameters:
+                return "param", key
+        raise ValueError("Unsupported clause in expression: {}".format(self.expression))
+
+    @property
+    def compiled(self):
+        """Boolean flag. True if the expression has been translated into a tree of clauses."""
+        return self.__tree is not None
+
+    def clauses(self, transcripts):
+        """
+        Method to evaluate each parameter of the section over a list of transcripts.
+
+        :param transcripts: the transcripts to evaluate.
+        :type transcripts: list
+
+        :returns: a dictionary with a boolean array for each parameter.
+        :rtype: dict
+        """
+
+        return dict((key, evaluate_column([getattr(transcript, conf["name"]) for transcript in transcripts],
+                                          conf))
+                    for key, conf in self.parameters.items())
+
+    def combine(self, clauses):
+        """
+        Method to combine the evaluated parameters according to the expression.
+
+        :param clauses: the dictionary returned by the clauses method.
+        :type clauses: dict
+
+        :returns: a boolean array, True for the transcripts passing the requirements.
+        :rtype: numpy.ndarray
+        """
+
+        if self.__tree is not None:
+            return self.__combine(self.__tree, clauses)
+        size = len(next(iter(clauses.values()))) if clauses else 0
+        # pylint: disable=eval-used
+        return numpy.array([
+            eval(self.__compiled, {"evaluated": dict((key, bool(clauses[key][num])) for key in clauses)})
+            is not False for num in range(size)], dtype=bool)
+
+    def __combine(self, node, clauses):
+
+        if node[0] == "param":
+            return clauses[node[1]]
+        elif node[0] == "not":
+            return numpy.logical_not(self.__combine(node[1], clauses))
+        combiner = numpy.logical_and if node[0] == "and" else numpy.logical_or
+        return combiner.reduce([self.__combine(child, clauses) for child in node[1]])
+
+    def passing(self, transcripts):
+        """
+        Method to evaluate the requirements over a list of transcripts.
+        :param transcripts: the transcripts to evaluate.
+        :type transcripts: list
+
+        :rtype: numpy.ndarray
+        """
+
+        return self.combine(self.clauses(transcripts))
+
+    def failed_clauses(self, clauses, index):
+        """
+        Method to report which clauses of the expression caused a transcript to fail.
+        Failed "and" clauses are reported through their failing components;
+        "or" and "not" clauses are reported as a whole.
+
+        :param clauses: the dictionary returned by the clauses method.
+        :type clauses: dict
+
+        :param index: the position of the transcript.
+        :type index: int
+
+        :rtype: list
+        """
+
+        if self.__tree is None:
+            return [self.__describe(key) for key in self.parameters if not clauses[key][index]]
+        if self.__value(self.__tree, clauses, index):
+            return []
+        return self.__failed(self.__tree, clauses, index)
+
+    def __value(self, node, clauses, index):
+
+        if node[0] == "param":
+            return bool(clauses[node[1]][index])
+        elif node[0] == "not":
+            return not self.__value(node[1], clauses, index)
+        elif node[0] == "and":
+            return all(self.__value(child, clauses, index) for child in node[1])
+        return any(self.__value(child, clauses, index) for child in node[1])
+
+    def __failed(self, node, clauses, index):
+
+        if node[0] == "param":
+            return [self.__describe(node[1])]
+        elif node[0] == "and":
+            failed = []
+            for child in node[1]:
+                if not self.__value(child, clauses, index):
+                    failed.extend(self.__failed(child, clauses, index))
+            return failed
+        return [self.__format(node)]
+
+    def __describe(self, key):
+        conf = self.parameters[key]
+        return "{} ({} {} {})".format(key, conf["name"], conf["operator"], conf["value"])
+
+    def __format(self, node):
+
+        if node[0] == "param":
+            return node[1]
+        elif node[0] == "not":
+            return "not {}".format(self.__format(node[1]))
+        return "({})".format(" {} ".format(node[0]).join(self.__format(child) for child in node[1]))
+
+
+def get_predicate(section):
+    """
+    Function to retrieve the compiled predicate of a requirements section,
+    compiling it if necessary.
+
+    :param section: the requirements section.
+    :type section: dict
+
+    :rtype: Predicate
+    """
+
+    if section.get("predicate", None) is None:
+        section["predicate"] = Predicate(section)
+    return section["predicate"]
@@ -0,0 +1,329 @@
+# coding: utf-8
+
+"""
+This module implements the instrumentation used to profile Mikado pick. When profiling is enabled,
+each process accumulates the wall-clock and CPU time spent in each stage of the analysis, a set of
+counters (transcripts, graph edges, cliques, approximation levels ...) and the time spent on each
+superlocus. The data of all the processes is then combined into a JSON summary, and the slowest
+superloci are reported in a separate tabular file.
+When profiling is disabled, the functions of this module do nothing.
+"""
+
+import collections
+import csv
+import functools
+import heapq
+import itertools
+import json
+import re
+import time
+
+__author__ = 'Luca Venturini'
+
+
+# Default number of slowest superloci to report; it must match the default of the configuration
+default_slow_loci = 20
+
+
+class _Stage:
+
+    """
+    Context manager which measures the time spent in a stage. The time spent in nested stages
+    is subtracted from the enclosing one, so that the times of all the stages can be summed up.
+    """
+
+    __slots__ = ["profile", "name", "wall", "cpu", "child_wall", "child_cpu"]
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+        self.wall = self.cpu = self.child_wall = self.child_cpu = 0
+
+    def __enter__(self):
+        self.profile.stack.append(self)
+        self.wall, self.cpu = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        wall, cpu = time.perf_counter() - self.wall, time.process_time() - self.cpu
+        self.profile.stack.pop()
+        if self.profile.stack:
+            self.profile.stack[-1].child_wall += wall
+            self.profile.stack[-1].child_cpu += cpu
+        self.profile.add(self.name, wall - self.child_wall, cpu - self.child_cpu)
+        return False
+
+
+class _NullStage:
+
+    """Context manager used instead of _Stage when profiling is disabled."""
+
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+class Profile:
+
+    """
+    Class which holds the profiling data of a process, or the combined data of multiple processes.
+    """
+
+    # Columns of the report of the slowest superloci
+    slow_loci_fields = ["superlocus", "item", "wall", "cpu", "transcripts", "stranded_loci",
+                        "loci", "approximation_level", "process"]
+
+    def __init__(self, name="main", slow_loci=default_slow_loci):
+        """
+        :param name: name of the process.
+        :type name: str
+
+        :param slow_loci: number of superloci to report, sorted by decreasing wall-clock time.
+        :type slow_loci: int
+        """
+
+        self.name = name
+        self.slow_loci = slow_loci
+        self.stages = dict()
+        self.counters = collections.Counter()
+        self.loci = []
+        self.stack = []
+        self.processes = dict()
+        self.__order = itertools.count()
+        self.__start = (time.perf_counter(), time.process_time())
+
+    def stage(self, name):
+        """Method to create the context manager which measures the time spent in a stage."""
+        return _Stage(self, name)
+
+    def add(self, name, wall, cpu):
+        """
+        Method to record the time spent in a stage.
+
+        :param name: the name of the stage.
+        :param wall: wall-clock time, in seconds.
+        :param cpu: CPU time, in seconds.
+        """
+
+        values = self.stages.setdefault(name, [0, 0.0, 0.0])
+        values[0] += 1
+        values[1] += wall
+        values[2] += cpu
+
+    def record_locus(self, superlocus, item, wall, cpu, **details):
+        """
+        Method to record the time spent on a superlocus. Only the slowest ones are kept.
+
+        :param superlocus: the name of the superlocus (chrom:start-end).
+        :param item: the number of the superlocus in the input.
+        :param wall: wall-clock time, in seconds.
+        :param cpu: CPU time, in seconds.
+        :param details: additional values to report (see slow_loci_fields).
+        """
+
+        self.counters["superloci"] += 1
+        if self.slow_loci <= 0:
+            return
+        details.update({"superlocus": superlocus, "item": item, "wall": wall, "cpu": cpu,
+                        "process": self.name})
+        self.__keep(details)
+
+    def __keep(self, details):
+        """Private method to add a superlocus to the slowest ones, if appropriate."""
+
+        if self.slow_loci <= 0:
+            return
+        # The second element breaks the ties, so that the dictionaries are never compared
+        record = (details["wall"], -next(self.__order), details)
+        if len(self.loci) < self.slow_loci:
+            heapq.heappush(self.loci, record)
+        elif record > self.loci[0]:
+            heapq.heapreplace(self.loci, record)
+
+    def to_dict(self):
+        """
+        Method to serialise the profile, eg to send it to another process.
+        The elapsed time is measured from the creation of the profile.
+        :rtype: dict
+        """
+
+        wall, cpu = time.perf_counter() - self.__start[0], time.process_time() - self.__start[1]
+        processes = dict(self.processes)
+        processes[self.name] = {
+            "elapsed": {"wall": wall, "cpu": cpu},
+            "stages": self.__format_stages(self.stages),
+            "counters": dict(self.counters)}
+        return {"processes": processes,
+                "slow_loci": [record[2] for record in sorted(self.loci, reverse=True)]}
+
+    def update(self, data):
+        """
+        Method to add to this profile the data of other processes, as returned by to_dict.
+        :param data: the serialised profile.
+        :type data: dict
+        """
+
+        for name, process in data["processes"].items():
+            self.processes[name] = process
+        for details in data["slow_loci"]:
+            self.__keep(details)
+
+    @staticmethod
+    def __format_stages(stages):
+        return dict((name, {"calls": values[0], "wall": values[1], "cpu": values[2]})
+                    for name, values in stages.items())
+
+    def summary(self):
+        """
+        Method to create the summary of the profile: the totals over all the processes,
+        the data of each process and the slowest superloci.
+        :rtype: dict
+        """
+
+        data = self.to_dict()
+        stages = dict()
+        counters = collections.Counter()
+        for process in data["processes"].values():
+            for name, values in process["stages"].items():
+                total = stages.setdefault(name, {"calls": 0, "wall": 0.0, "cpu": 0.0})
+                for key in total:
+                    total[key] += values[key]
+            counters.update(process["counters"])
+        return {"total": {"stages": stages, "counters": dict(counters)},
+                "processes": data["processes"],
+                "slow_loci": data["slow_loci"]}
+
+    def write(self, filename):
+        """
+        Method to write the summary of the profile in JSON format, and the slowest superloci in
+        a tabular file with the same prefix (eg mikado.profile.slow_loci.tsv for mikado.profile.json).
+        :param filename: the name of the JSON file.
+        :type filename: str
+        """
+
+        summary = self.summary()
+        with open(filename, "wt") as out:
+            json.dump(summary, out, indent=2, sort_keys=True)
+            print(file=out)
+
+        with open(slow_loci_file(filename), "wt") as out:
+            writer = csv.DictWriter(out, self.slow_loci_fields, delimiter="\t", lineterminator="\n",
+                                    extrasaction="ignore")
+            writer.writeheader()
+            for row in summary["slow_loci"]:
+                writer.writerow(row)
+
+
+def slow_loci_file(filename):
+    """Function to derive the name of the report of the slowest superloci from that of the JSON summary."""
+    return re.sub("$", ".slow_loci.tsv", re.sub(".json$", "", filename))
+
+
+# Profile of the current process; None when profiling is disabled.
+_profile = None
+
+
+def enable(name="main", slow_loci=default_slow_loci):
+    """
+    Function to start profiling the current process.
+    :param name: the name of the process.
+    :param slow_loci: number of slowest superloci to keep.
+    :rtype: Profile
+    """
+
+    global _profile
+    _profile = Profile(name=name, slow_loci=slow_loci)
+    return _profile
+
+
+def disable():
+    """
+    Function to stop profiling the current process.
+    :returns: the profile of the process, or None if profiling was not enabled.
+    :rtype: (Profile|None)
+    """
+
+    global _profile
+    profile, _profile = _profile, None
+    return profile
+
+
+def active():
+    """Function to retrieve the profile of the current process (None if profiling is disabled)."""
+    return _profile
+
+
+def stage(name):
+    """
+    Function to measure the time spent in a stage, to be used as a context manager:
+
+        with profiling.stage("define_loci"):
+            ...
+
+    :param name: the name of the stage.
+    """
+
+    if _profile is None:
+        return _null_stage
+    return _profile.stage(name)
+
+
+def count(name, value=1):
+    """
+    Function to increase one of the counters of the current profile.
+    :param name: the name of the counter.
+    :param value: the amount to add.
+    """
+
+    if _profile is not None:
+        _profile.counters[name] += value
+
+
+def profiled(name):
+    """
+    Decorator to measure the time spent in a function or method as part of a stage.
+    :param name: the name of the stage.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profile is None:
+                return function(*args, **kwargs)
+            with _profile.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed(name, iterable):
+    """
+    Function to measure the time spent to produce each item of an iterable
+    (eg the parsing of the input) as part of a stage.
+    :param name: the name of the stage.
+    :param iterable: the iterable to wrap.
+    :returns: an iterator over the items of the iterable.
+    """
+
+    if _profile is None:
+        return iter(iterable)
+    return _timed(name, iter(iterable))
+
+
+def _timed(name, iterator):
+    """Private generator used by timed."""
+
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
@@ -0,0 +1,134 @@
+"""
+This module implements a small read-only store for the data shared by all the processes
+of a Mikado run, ie the configuration (together with its compiled expressions) and the
+optional scoring model. The main process publishes the data once and receives a handle;
+the worker processes attach to the store through the handle. Under the "fork" start method
+the published objects are inherited directly from the parent, otherwise they are loaded
+from the backing file only once per process.
+Objects which refer to a published configuration can be serialised using just the handle.
+"""
+
+import os
+import pickle
+import tempfile
+from . import predicates
+
+__author__ = 'Luca Venturini'
+
+
+__store = dict()
+__handles = dict()
+
+compiled_sections = ("requirements", "as_requirements", "not_fragmentary")
+
+
+def compile_expressions(json_conf):
+    """
+    Function to compile the expressions of the requirement sections of a configuration
+    ("requirements", "as_requirements", "not_fragmentary"), both as Python code and as predicates,
+    if they are not compiled already.
+    :param json_conf: the configuration dictionary.
+    :type json_conf: dict
+    """
+
+    for key in compiled_sections:
+        section = json_conf.get(key, None)
+        if isinstance(section, dict) and "expression" in section:
+            if section.get("compiled", None) is None:
+                section["compiled"] = compile(section["expression"], "<json>", "eval")
+            predicates.get_predicate(section)
+
+
+def strip_compiled(json_conf):
+    """
+    Function to return a copy of the configuration without the compiled expressions,
+    which cannot be pickled, and without the predicates derived from them.
+    Only the sections containing a compiled expression are copied.
+    :param json_conf: the configuration dictionary.
+    :type json_conf: dict
+
+    :rtype: dict
+    """
+
+    conf = json_conf.copy()
+    for key, val in conf.items():
+        if isinstance(val, dict) and ("compiled" in val or "predicate" in val):
+            conf[key] = val.copy()
+            conf[key].pop("compiled", None)
+            conf[key].pop("predicate", None)
+    return conf
+
+
+def __register(handle, json_conf, regressor):
+    compile_expressions(json_conf)
+    __store[handle] = (json_conf, regressor)
+    __handles[id(json_conf)] = handle
+
+
+def publish(json_conf, regressor=None, directory=None):
+    """
+    Function to publish the configuration and the scoring model into the store.
+    :param json_conf: the configuration dictionary.
+    :type json_conf: dict
+
+    :param regressor: the optional scoring model.
+
+    :param directory: the directory where to create the backing file.
+    :type directory: (None|str)
+
+    :returns: the handle to be used to attach to the store.
+    :rtype: str
+    """
+
+    handle_descriptor, handle = tempfile.mkstemp(suffix=".pickle", prefix="mikado_shared_", dir=directory)
+    with os.fdopen(handle_descriptor, "wb") as backing:
+        pickle.dump((strip_compiled(json_conf), regressor), backing)
+    __register(handle, json_conf, regressor)
+    return handle
+
+
+def attach(handle):
+    """
+    Function to retrieve the configuration and the scoring model associated with a handle.
+    The data is loaded from the backing file only if it is not present already in the process.
+    :param handle: the handle returned by publish.
+    :type handle: str
+
+    :returns: the configuration and the scoring model.
+    :rtype: (dict, object)
+    """
+
+    if handle not in __store:
+        with open(handle, "rb") as backing:
+            json_conf, regressor = pickle.load(backing)
+        __register(handle, json_conf, regressor)
+    return __store[handle]
+
+
+def handle_of(json_conf):
+    """
+    Function to retrieve the handle of a published configuration.
+    :param json_conf: the configuration dictionary.
+
+    :returns: the handle, or None if the configuration has not been published.
+    :rtype: (None|str)
+    """
+
+    handle = __handles.get(id(json_conf), None)
+    if handle is not None and __store[handle][0] is json_conf:
+        return handle
+    return None
+
+
+def release(handle):
+    """
+    Function to remove a published configuration from the store, deleting its backing file.
+    :param handle: the handle returned by publish.
+    :type handle: str
+    """
+
+    if handle in __store:
+        json_conf, _ = __store.pop(handle)
+        __handles.pop(id(json_conf), None)
+    if os.path.exists(handle):
+        os.remove(handle)